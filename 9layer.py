@@ -1,14 +1,22 @@
 #!/usr/bin/env python3
 import os
-import random
-import subprocess
 import sys
 import time
 import threading
-from queue import Queue, Empty
+from collections import deque
 from pathlib import Path
 import termios
-import collections # For deque
+from library_index import INDEX_DB_PATH, LibraryIndex
+from audio_probe import DurationCache, SeekIndex
+from playback import GaplessPlayer
+from renderer import Screen, Renderer
+from event_loop import EventLoop
+from metadata_db import DB_PATH as METADATA_DB_PATH
+from metrics import Metrics, NULL_METRICS, SamplingProfiler, add_process_gauges, make_exporter
+from shuffle import ShuffleBag, History, PlayStats, play_count_weight, recency_weight
+from track_library import PartialLibrary, TrackLibrary
+from loudness_gains import LoudnessGains
+from session import HISTORY_KEPT, SESSION_PATH, load_session, resolve_track, save_session, track_identity
 
 # Cassette animation frames (simplified)
 CASSETTE_FRAMES = [
@@ -20,20 +28,71 @@ CASSETTE_FRAMES = [
     "╭───────╮\n│▒▒▒▒▒  │\n╰───────╯"
 ]
 
-SUPPORTED_FORMATS = ('.mp3', '.wav', '.ogg', '.flac', '.m4a', '.aac')
 SCRIPT_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
 MUSIC_DIR = str(SCRIPT_DIR / 'music')
 PLAYER_CMD = 'mpg123'
+# Optional in-process output instead of mpg123: 'alsa', 'alsa:<device>', 'wav:<path>' or 'null'
+AUDIO_OUTPUT = os.environ.get('NINELAYER_OUTPUT', '')
+# Loudness normalization from loudness.py's analysis: 'track', 'album' or 'off'
+NORMALIZE = os.environ.get('NINELAYER_NORMALIZE', 'track')
+# Optional shuffle weighting: 'plays' favours less-played tracks, 'recency' ones not heard lately
+SHUFFLE_WEIGHTING = os.environ.get('NINELAYER_SHUFFLE', '')
+# Optional latency metrics in Prometheus text format: 'file:<path>' or 'unix:<path>'
+METRICS_OUTPUT = os.environ.get('NINELAYER_METRICS', '')
+# Optional sampling profiler: folded stacks written to this path on exit
+PROFILE_OUTPUT = os.environ.get('NINELAYER_PROFILE', '')
+# Where the track, position and settings are kept between runs; 'off' to start fresh every time
+SESSION_FILE = os.environ.get('NINELAYER_SESSION', str(SESSION_PATH))
+
+KEY_BINDINGS = {
+    'q': 'stop', '\x03': 'stop', # Ctrl-C arrives as a character in raw mode
+    'n': 'next',
+    'p': 'prev',
+    ',': 'skip_backward',
+    '.': 'skip_forward',
+    'r': 'random',
+    '=': 'vol_up', '+': 'vol_up', # Support + too
+    '-': 'vol_down',
+    'm': 'mute',
+    'a': 'autoplay',
+    ' ': 'pause',
+    '/': 'search',
+}
+SEARCH_ROW = 14 # First screen row used by the search prompt
+SEARCH_RESULTS = 8
+STARTUP_TRACKS = 16 # Random tracks to choose among while the full play order is still loading
+SESSION_SAVE_DELAY = 1 # Seconds; a burst of changes is written once
+SESSION_INTERVAL = 15 # Seconds between position snapshots while playing, in case of a crash
 
 class MusicPlayer:
-    def __init__(self):
-        self.music_files = []
+    def __init__(self, music_dir=MUSIC_DIR, index_path=INDEX_DB_PATH, metadata_path=METADATA_DB_PATH,
+                 output=AUDIO_OUTPUT, out=None, metrics=METRICS_OUTPUT, profile=PROFILE_OUTPUT,
+                 session=SESSION_FILE):
+        # Everything defaults to the real library; bench.py points them at a synthetic one
+        self.music_dir = music_dir
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+        self.output = output
+        self.metrics_output = metrics
+        self.profile_output = profile
+        # With metrics off every span and observe() below is a no-op
+        self.metrics = Metrics() if metrics else NULL_METRICS
+        self.metrics_exporter = None
+        self.profiler = None
+        self.audio_requested_at = None # When play_current_song last asked for audio, for first-audio latency
+        self.session_path = session if session and session != 'off' else None
+        self.resume_history = None # Saved history as paths, restored once the full library is loaded
+        self._session_timer = None
+        self.music_files = [] # A TrackLibrary once loaded: paged from the index and metadata DBs
         self.current_index = 0
-        self.playback_process = None
+        # Keys, decoder status lines, child exit and render timers all arrive on this one loop
+        self.loop = EventLoop()
+        self.duration_cache = DurationCache(index_path)
+        self.engine = self.create_engine()
         self.running = False
-        self.command_queue = Queue()
         self.random_mode = True
-        self.volume = 50
+        self.volume = 100 # Decoder gain in percent; 100 leaves the signal untouched
+        self.paused = False
         self.muted = False
         self._term_settings = None
         self.auto_play = True
@@ -41,27 +100,123 @@ class MusicPlayer:
         self.song_duration = 0
         self.elapsed_time = 0
         self.progress = 0
-        # Initialize play_history as a deque with a max length (e.g., 50)
-        self.play_history = collections.deque(maxlen=50)
-
-    def find_music_files(self):
-        files = []
-        if not Path(MUSIC_DIR).is_dir():
-            print(f"ERROR: Music directory does not exist: {MUSIC_DIR}")
-            return files
-        for root, _, filenames in os.walk(MUSIC_DIR):
-            for f in filenames:
-                if f.lower().endswith(SUPPORTED_FORMATS):
-                    files.append(os.path.join(root, f))
-        return files
+        # Compact array of indices, so prev can walk back through millions of plays
+        self.play_history = History()
+        self.play_stats = PlayStats(db_path=index_path) # Saved by path; remapped whenever the order changes
+        self.shuffle = None # ShuffleBag over music_files, created once they're known
+        self.seek_index = SeekIndex(index_path)
+        self.loudness = self.create_loudness()
+        self.now_playing = None # (title, album, artist) shown in the header
+        self.anim_frame = 0
+        self.screen = Screen(out)
+        self.renderer = Renderer(self.screen, self.draw, self.loop,
+                                 on_frame=self.observe_frame if self.metrics else None)
+        self.next_index = None # Resolved ahead of time so the next track can be preloaded
+        self.play_queue = deque() # Tracks queued from search, played before shuffle/sequence
+        self.search_index = None # Built in the background once music_files is known
+        self.search_generation = 0 # Bumped on every library reload, so stale indexes are dropped
+        self.search_mode = False
+        self.search_query = ''
+        self.search_results = []
+        self.search_selected = 0
+
+    def create_engine(self):
+        callbacks = dict(on_finished=self.on_track_finished,
+                         on_advanced=self.on_advanced, # The preloaded track already took over
+                         on_near_end=self.maybe_preload_next)
+        if self.metrics:
+            callbacks['on_started'] = self.on_audio_started
+        if self.output:
+            # Decoded by ffmpeg and mixed here; needs numpy (and pyalsaaudio for ALSA)
+            from pcm_output import PcmPlayer, make_sink, FFMPEG_CMD
+            self.player_cmd = FFMPEG_CMD
+            return PcmPlayer(make_sink(self.output), self.loop, duration_of=self.duration_cache.get_duration,
+                             **callbacks)
+        self.player_cmd = PLAYER_CMD
+        return GaplessPlayer(PLAYER_CMD, self.loop, **callbacks)
+
+    def create_loudness(self):
+        if NORMALIZE == 'off':
+            return None
+        return LoudnessGains(self.music_dir, NORMALIZE, self.metadata_path)
+
+    def track_gain(self, file_path):
+        # Measured ahead of time by loudness.py, so this is a single indexed lookup
+        return self.loudness.gain(file_path) if self.loudness else 1.0
+
+    def start_library(self, resume_path=None):
+        """Play-first startup: the tracks known right away, with the full library loaded in the background.
+
+        A restart samples STARTUP_TRACKS from the index in a few indexed reads; a first
+        start waits only for the scan to list one directory with audio in it. Either
+        way the real TrackLibrary replaces the stand-in through reload_library().
+        A resumed track comes first.
+        """
+        if not Path(self.music_dir).is_dir():
+            print(f"ERROR: Music directory does not exist: {self.music_dir}")
+            return []
+        partial = PartialLibrary(self.music_dir)
+        if resume_path:
+            resume_path = os.path.abspath(resume_path) # Spelled like the index's paths, to compare with them
+            partial.extend([resume_path])
+        with LibraryIndex(self.music_dir, self.index_path) as index:
+            first_scan = index.is_empty()
+            if not first_scan:
+                # The resumed track may be drawn again; it's listed once
+                partial.extend(path for path in index.sample_files(STARTUP_TRACKS) if path != resume_path)
+        threading.Thread(target=self.load_library, args=(partial, first_scan), daemon=True).start()
+        partial.ready.wait()
+        return partial
+
+    def load_library(self, partial, first_scan):
+        # Runs on a worker thread; the finished library is handed to the loop in one step
+        try:
+            with LibraryIndex(self.music_dir, self.index_path) as index:
+                if first_scan:
+                    prefix = os.path.abspath(self.music_dir) + os.sep
+                    index.scan(on_found=lambda paths: partial.extend(prefix + path for path in paths))
+            library = TrackLibrary(self.music_dir, self.index_path, self.metadata_path)
+            library.load()
+        finally:
+            partial.finish() # Nothing found at all: let startup give up
+        self.loop.call_soon_threadsafe(self.reload_library, library)
+        if not first_scan:
+            self.rescan_library()
+
+    def rescan_library(self):
+        # Runs on a worker thread; unchanged directories are only stat'ed, never listed
+        with LibraryIndex(self.music_dir, self.index_path) as index:
+            changes = index.scan()
+        if changes:
+            self.loop.call_soon_threadsafe(self.reload_library)
+
+    def reload_library(self, library=None):
+        """Rebuild the play order around the current track after a rescan, or swap in a newly loaded library."""
+        current_path = self.music_files[self.current_index] if self.music_files else None
+        history = self.recent_history()
+        self.discard_preload()
+        if library is None:
+            count = self.music_files.load()
+        else:
+            self.music_files.close()
+            self.music_files = library
+            count = len(library)
+        index = self.music_files.index_of(current_path) if current_path else None
+        self.current_index = index if index is not None else min(self.current_index, max(count - 1, 0))
+        if index is not None and self.now_playing:
+            self.now_playing = self.music_files.describe(index) # Titles from the metadata DB
+        # Indices refer to the old order: carry the recent history over by path, and reload the stats
+        self.restore_history(history)
+        self.play_stats.load(self.music_files)
+        self.resume_history = None
+        self.play_queue.clear()
+        self.close_search()
+        self.start_search_index()
 
     def get_song_duration(self, file_path):
-        try:
-            cmd = f"ffprobe -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 '{file_path}'"
-            duration = float(subprocess.check_output(cmd, shell=True, stderr=subprocess.DEVNULL))
-            return int(duration)
-        except Exception:
-            return 0
+        # Parsed from container headers and cached by path/size/mtime; ffprobe is only a fallback
+        with self.metrics.span('ninelayer_duration_probe_seconds'):
+            return int(self.duration_cache.get_duration(file_path))
 
     def format_time(self, seconds):
         return f"{seconds//60}:{seconds%60:02d}"
@@ -73,91 +228,100 @@ class MusicPlayer:
     def play_current_song(self, start_time_sec=0, played_from_history=False):
         if not self.music_files:
             return
-
-        if self.playback_process:
-            self.playback_process.terminate()
-            try:
-                self.playback_process.wait(timeout=0.5)
-            except subprocess.TimeoutExpired:
-                self.playback_process.kill()
-            self.playback_process = None
+        if self.metrics:
+            self.audio_requested_at = time.perf_counter()
 
         if not played_from_history:
             if not self.play_history or self.play_history[-1] != self.current_index:
                 self.play_history.append(self.current_index)
-
         full_song_path = self.music_files[self.current_index]
-        album = os.path.basename(os.path.dirname(full_song_path))
-        song_dir = os.path.dirname(full_song_path)
-        song_filename = os.path.basename(full_song_path)
+
+        if start_time_sec == 0:
+            self.play_stats.record(self.current_index, rel_path=os.path.relpath(full_song_path, self.music_dir))
 
         if self.song_duration == 0 or start_time_sec == 0:
             self.song_duration = self.get_song_duration(full_song_path)
 
         self.song_start_time = time.time() - start_time_sec
-        self.elapsed_time = start_time_sec
+        self.elapsed_time = int(start_time_sec)
 
-        print("\033[2J\033[H", end="")
-        print("\033[0;0HNow Playing ...")
-        print(f"\033[1;0H{song_filename}")
-        print("\033[2;0Hfrom")
-        print(f"\033[3;0H{album}")
+        self.now_playing = self.music_files.describe(self.current_index)
 
-        def animate():
-            frame_idx = 0
-            while self.running and self.playback_process and self.playback_process.poll() is None:
-                frame = CASSETTE_FRAMES[frame_idx % len(CASSETTE_FRAMES)]
-                for i, line in enumerate(frame.split('\n')):
-                    print(f"\033[{5+i};0H{line}")
-
-                self.elapsed_time = int(time.time() - self.song_start_time)
-                progress = min(self.elapsed_time / self.song_duration, 1.0) if self.song_duration > 0 else 0
-
-                time_display = f"{self.format_time(self.elapsed_time)} / {self.format_time(self.song_duration)}"
-                print(f"\033[8;0H\033[K{time_display}")
-
-                progress_bar = self.get_progress_bar(progress)
-                print(f"\033[9;0H\033[K{progress_bar}")
-
-                print(f"\033[11;0H\033[KRandom: {'ON' if self.random_mode else 'OFF'} | Volume: {'🔇 MUTED' if self.muted else '🔊 '+str(self.volume)+'%'} | AutoPlay: {'ON' if self.auto_play else 'OFF'}")
-                print(f"\033[12;0H\033[KControls: [N]ext [P]rev [,]SkipBack [.]SkipNext [R]andom [A]utoPlay [=]Vol+ [-]Vol- [M]ute [Q]uit")
-
-                time.sleep(0.1)
-                frame_idx += 1
-
-        cmd = [PLAYER_CMD, '-q']
-        if start_time_sec > 0:
-            frames_to_skip = int(start_time_sec * 38.28) # Approx frames for MP3
-            if frames_to_skip > 0:
-                cmd.extend(['-k', str(frames_to_skip)])
-        cmd.append(song_filename)
+        start = 0
+        if start_time_sec > 0 and self.engine.seeks_in_seconds:
+            start = start_time_sec
+        elif start_time_sec > 0:
+            start = self.seek_index.frame_at(full_song_path, start_time_sec)
+            if start is None:
+                start = int(start_time_sec * 38.28) # Approx frames for 44.1 kHz MPEG-1
 
         try:
-            self.playback_process = subprocess.Popen(
-                cmd,
-                cwd=song_dir,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
+            with self.metrics.span('ninelayer_decoder_start_seconds'):
+                # One decoder stays alive across tracks; only its first use spawns a process
+                if not self.engine.alive():
+                    self.engine.start()
+                    self.engine.set_volume(0 if self.muted else self.volume)
+                self.paused = False
+                self.engine.load(full_song_path, start, gain=self.track_gain(full_song_path))
         except FileNotFoundError:
-            print(f"ERROR: PLAYER_CMD '{PLAYER_CMD}' not found. Is it installed and in your PATH?")
+            print(f"ERROR: PLAYER_CMD '{self.player_cmd}' not found. Is it installed and in your PATH?")
             self.running = False
+            self.loop.stop()
             return
         except Exception as e:
             print(f"ERROR: Failed to start playback process: {e}")
             self.running = False
+            self.loop.stop()
             return
-
-        anim_thread = threading.Thread(target=animate)
-        anim_thread.daemon = True
-        anim_thread.start()
-
-    def set_volume(self, change=None, mute=None):
-        if sys.platform != 'darwin': # macOS specific volume control
-            if change is not None or mute is not None:
-                pass # Silently ignore on other platforms or provide a generic message
+        self.renderer.wake()
+        self.mark_session_changed()
+
+    def draw(self, screen, frame_idx):
+        """Fill the screen model; the renderer only sends the rows that changed."""
+        playing = self.engine.is_playing()
+        if self.now_playing:
+            title, album, artist = self.now_playing
+            screen.set_line(1, "Now Playing ...")
+            screen.set_line(2, f"{title} — {artist}" if artist else title)
+            screen.set_line(3, "from")
+            screen.set_line(4, album)
+
+        # The cassette only turns while audio is actually playing, so an idle screen stops changing
+        if playing and not self.paused:
+            self.anim_frame += 1
+        frame = CASSETTE_FRAMES[self.anim_frame % len(CASSETTE_FRAMES)]
+        for i, line in enumerate(frame.split('\n')):
+            screen.set_line(5 + i, line)
+
+        if playing:
+            self.update_elapsed_time()
+            progress = min(self.elapsed_time / self.song_duration, 1.0) if self.song_duration > 0 else 0
+            screen.set_line(8, f"{self.format_time(self.elapsed_time)} / {self.format_time(self.song_duration)}")
+            screen.set_line(9, self.get_progress_bar(progress))
+        else:
+            screen.set_line(8, f"--:-- / {self.format_time(self.song_duration) if self.song_duration > 0 else '--:--'}")
+            screen.set_line(9, self.get_progress_bar(0))
+
+        screen.set_line(11, f"Random: {'ON' if self.random_mode else 'OFF'} | Volume: {'🔇 MUTED' if self.muted else '🔊 '+str(self.volume)+'%'} | AutoPlay: {'ON' if self.auto_play else 'OFF'}{' | PAUSED' if self.paused else ''}")
+        screen.set_line(12, "Controls: [N]ext [P]rev [,]SkipBack [.]SkipNext [Space]Pause [R]andom [A]utoPlay [=]Vol+ [-]Vol- [M]ute [/]Search [Q]uit")
+        self.draw_search(screen)
+
+    def update_elapsed_time(self):
+        # Prefer the decoder's own position; fall back to wall-clock until it reports one
+        if self.engine.has_position():
+            self.elapsed_time = int(self.engine.position)
+        elif not self.paused:
+            self.elapsed_time = int(time.time() - self.song_start_time)
+
+    def toggle_pause(self):
+        if not self.engine.is_playing():
             return
+        self.paused = not self.paused
+        self.engine.set_paused(self.paused)
+        if not self.paused:
+            self.song_start_time = time.time() - self.elapsed_time
 
+    def set_volume(self, change=None, mute=None):
         if mute is not None:
             self.muted = mute
 
@@ -165,132 +329,293 @@ class MusicPlayer:
             self.volume = max(0, min(100, self.volume + change))
             self.muted = False # Unmute if volume is changed
 
-        vol_to_set = 0 if self.muted else self.volume
-        try:
-            subprocess.run(['osascript', '-e', f"set volume output volume {vol_to_set}"],
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-        except subprocess.CalledProcessError:
-            pass # Silently ignore if osascript fails
-        except FileNotFoundError:
-            pass # Silently ignore if osascript is not found
+        # Applied by the decoder itself, so it works on every platform without spawning anything
+        self.engine.set_volume(0 if self.muted else self.volume)
 
     def stop(self):
         self.running = False
-        if self.playback_process:
-            self.playback_process.terminate()
-            try:
-                self.playback_process.wait(timeout=1)
-            except subprocess.TimeoutExpired:
-                self.playback_process.kill()
-            self.playback_process = None
+        self.loop.stop()
+        self.renderer.stop()
+        self.close_session() # Before the engine goes, while it still knows the position
+        self.engine.quit()
+        self.play_stats.close()
+        self.stop_metrics()
         if self._term_settings and sys.stdin.isatty(): # Check isatty before restoring
             termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, self._term_settings)
 
-    def refresh_ui_stopped(self):
-        """Refreshes the UI status lines when the player is stopped."""
-        print(f"\033[8;0H\033[K--:-- / {self.format_time(self.song_duration) if self.song_duration > 0 else '--:--'}")
-        print(f"\033[9;0H\033[K{self.get_progress_bar(0)}")
-        print(f"\033[11;0H\033[KRandom: {'ON' if self.random_mode else 'OFF'} | Volume: {'🔇 MUTED' if self.muted else '🔊 '+str(self.volume)+'%'} | AutoPlay: {'ON' if self.auto_play else 'OFF'}")
-        print(f"\033[12;0H\033[KControls: [N]ext [P]rev [,]SkipBack [.]SkipNext [R]andom [A]utoPlay [=]Vol+ [-]Vol- [M]ute [Q]uit")
-
     def player_loop(self):
         self.running = True
+        self.setup_input()
+        self.start_metrics()
 
-        input_thread = threading.Thread(target=self.input_handler)
-        input_thread.daemon = True
-        input_thread.start()
-
-        self.music_files = self.find_music_files()
+        resume_path, resume_position = self.restore_session()
+        self.music_files = self.start_library(resume_path)
 
         if not self.music_files:
             print("No music files found in 'music' directory. Exiting.")
             self.stop()
             return
 
-        if self.random_mode and self.music_files:
-             self.current_index = random.randint(0, len(self.music_files) - 1)
+        self.renderer.start()
+        self.start_search_index()
+
+        self.play_stats.load(self.music_files)
+        self.shuffle = self.create_shuffle()
+        if resume_path:
+            self.current_index = 0 # start_library put the resumed track first
+        elif self.random_mode and self.music_files:
+             self.current_index = self.shuffle.next()
         else:
             self.current_index = 0
         
         if self.auto_play and self.music_files:
-            self.play_current_song()
-        elif not self.music_files:
-             pass
+            self.play_current_song(start_time_sec=resume_position)
+        if self.session_path:
+            self.loop.call_later(SESSION_INTERVAL, self.save_session_periodically)
 
         try:
-            while self.running:
-                if self.playback_process and self.playback_process.poll() is not None:
-                    self.playback_process = None
-                    if self.auto_play and self.running:
-                        self.command_queue.put('next')
-                    elif not self.auto_play:
-                         self.refresh_ui_stopped()
-
-                try:
-                    cmd_from_queue = self.command_queue.get(timeout=0.1)
-                except Empty:
-                    continue
-
-                if cmd_from_queue == 'stop':
-                    self.running = False
-                    break
-                elif cmd_from_queue == 'next':
-                    if not self.music_files: continue
-                    if self.random_mode:
-                        if len(self.music_files) > 1:
-                            prev_song_idx = self.current_index
-                            next_idx = prev_song_idx
-                            attempts = 0
-                            # Try to pick a different song, limit attempts
-                            while next_idx == prev_song_idx and attempts < len(self.music_files) * 2 :
-                                next_idx = random.randint(0, len(self.music_files) - 1)
-                                attempts += 1
-                            self.current_index = next_idx
-                        # If only one song, current_index doesn't change
-                    else: # Sequential mode
-                        self.current_index = (self.current_index + 1) % len(self.music_files)
-                    self.song_duration = 0 # Reset duration for new song
-                    self.play_current_song() # played_from_history defaults to False
-
-                elif cmd_from_queue == 'prev':
-                    if not self.music_files: continue
-                    
-                    if len(self.play_history) >= 2:
-                        self.play_history.pop() # Remove current song's index
-                        self.current_index = self.play_history[-1] # Get previous from history
-                        self.song_duration = 0
-                        self.play_current_song(played_from_history=True)
-                    else:
-                        # Fallback to sequential previous if history is too short
-                        self.current_index = (self.current_index - 1 + len(self.music_files)) % len(self.music_files)
-                        self.song_duration = 0
-                        self.play_history.clear() # Clear history as we're breaking the chain
-                        self.play_current_song() # played_from_history defaults to False
-
-                elif cmd_from_queue == 'random':
-                    self.random_mode = not self.random_mode
-                elif cmd_from_queue == 'vol_up':
-                    self.set_volume(change=10)
-                elif cmd_from_queue == 'vol_down':
-                    self.set_volume(change=-10)
-                elif cmd_from_queue == 'mute':
-                    self.set_volume(mute=not self.muted)
-                elif cmd_from_queue == 'autoplay':
-                    self.auto_play = not self.auto_play
-                elif cmd_from_queue == 'skip_backward':
-                    self.skip_backward()
-                elif cmd_from_queue == 'skip_forward':
-                    self.skip_forward()
-                
-                # Refresh UI if a command was processed that doesn't start a song, and no song is playing
-                if self.playback_process is None and cmd_from_queue not in ['next', 'prev', 'skip_backward', 'skip_forward', 'stop']:
-                    self.refresh_ui_stopped()
+            # Sleeps in select() until a key, a decoder event or a render timer needs handling
+            if self.running:
+                self.loop.run()
         finally:
             self.stop()
 
+    def post(self, command):
+        """Queue a command from any thread; it runs on the event loop."""
+        if self.metrics:
+            self.loop.call_soon_threadsafe(self.handle_posted, command, time.perf_counter())
+        else:
+            self.loop.call_soon_threadsafe(self.handle_command, command)
+
+    def handle_posted(self, command, posted_at):
+        self.metrics.observe('ninelayer_command_dequeue_seconds', time.perf_counter() - posted_at)
+        self.handle_command(command)
+
+    def handle_command(self, command):
+        with self.metrics.span('ninelayer_command_seconds', command=command):
+            self.run_command(command)
+        self.mark_session_changed()
+
+    def run_command(self, command):
+        if command == 'stop':
+            self.running = False
+            self.loop.stop()
+            return
+        elif command == 'next':
+            self.play_next()
+
+        elif command == 'prev':
+            if not self.music_files: return
+            self.discard_preload() # Chosen for the track we're leaving
+            
+            if len(self.play_history) >= 2:
+                self.play_history.pop() # Remove current song's index
+                self.current_index = self.play_history[-1] # Get previous from history
+                self.song_duration = 0
+                self.play_current_song(played_from_history=True)
+            else:
+                # Fallback to sequential previous if history is too short
+                self.current_index = (self.current_index - 1 + len(self.music_files)) % len(self.music_files)
+                self.song_duration = 0
+                self.play_history.clear() # Clear history as we're breaking the chain
+                self.play_current_song() # played_from_history defaults to False
+
+        elif command == 'random':
+            self.random_mode = not self.random_mode
+            self.discard_preload()
+        elif command == 'vol_up':
+            self.set_volume(change=10)
+        elif command == 'vol_down':
+            self.set_volume(change=-10)
+        elif command == 'mute':
+            self.set_volume(mute=not self.muted)
+        elif command == 'pause':
+            self.toggle_pause()
+        elif command == 'autoplay':
+            self.auto_play = not self.auto_play
+            if not self.auto_play:
+                self.discard_preload()
+        elif command == 'skip_backward':
+            self.skip_backward()
+        elif command == 'skip_forward':
+            self.skip_forward()
+        elif command == 'search':
+            self.search_mode = True
+            self.search_query = ''
+            self.update_search()
+        
+        # Show the effect of the command right away instead of on the next frame
+        self.renderer.wake()
+
+    def on_advanced(self):
+        self.play_next()
+        self.audio_requested_at = None # Handed over without a gap: nothing to wait for
+
+    def on_audio_started(self):
+        if self.audio_requested_at is not None:
+            self.metrics.observe('ninelayer_first_audio_seconds', time.perf_counter() - self.audio_requested_at)
+            self.audio_requested_at = None
+
+    def observe_frame(self, cost):
+        self.metrics.observe('ninelayer_render_frame_seconds', cost)
+
+    def start_metrics(self):
+        if self.metrics:
+            add_process_gauges(self.metrics)
+            self.metrics.gauge('ninelayer_tracks', 'Tracks in the library', lambda: len(self.music_files))
+            self.loop.on_lag = lambda lag: self.metrics.observe('ninelayer_loop_lag_seconds', lag)
+            try:
+                self.metrics_exporter = make_exporter(self.metrics_output, self.metrics, self.loop)
+                self.metrics_exporter.start()
+            except (OSError, ValueError) as e:
+                print(f"ERROR: Cannot export metrics to '{self.metrics_output}': {e}")
+                self.metrics_exporter = None
+        if self.profile_output:
+            self.profiler = SamplingProfiler(self.profile_output)
+            self.profiler.start()
+
+    def stop_metrics(self):
+        if self.metrics_exporter:
+            self.metrics_exporter.close()
+            self.metrics_exporter = None
+        if self.profiler:
+            self.profiler.stop()
+            self.profiler = None
+
+    def restore_session(self):
+        """Apply the saved settings; returns (path, position) of the track to resume, or (None, 0)."""
+        state = load_session(self.session_path) if self.session_path else None
+        if state is None:
+            return None, 0
+        try:
+            volume = max(0, min(100, int(state.get('volume', self.volume))))
+            position = max(0.0, float(state.get('position', 0)))
+            identity = state.get('track')
+            path = resolve_track(self.music_dir, identity) # Keyed by path, not list index
+            if path is None and identity:
+                with LibraryIndex(self.music_dir, self.index_path) as index:
+                    path = resolve_track(self.music_dir, identity, index)
+        except (TypeError, ValueError, KeyError):
+            return None, 0 # Hand-edited or from another version: start fresh
+        self.random_mode = bool(state.get('random_mode', self.random_mode))
+        self.auto_play = bool(state.get('auto_play', self.auto_play))
+        self.volume = volume
+        self.muted = bool(state.get('muted', self.muted))
+        self.resume_history = [p for p in state.get('history') or [] if isinstance(p, str)]
+        if path is None:
+            return None, 0
+        return path, position
+
+    def restore_history(self, rel_paths):
+        self.play_history.clear()
+        for rel_path in rel_paths:
+            index = self.music_files.index_of(os.path.join(self.music_dir, rel_path))
+            if index is not None:
+                self.play_history.append(index)
+        if self.music_files and (not self.play_history or self.play_history[-1] != self.current_index):
+            self.play_history.append(self.current_index)
+
+    def recent_history(self):
+        """The last HISTORY_KEPT plays as paths relative to the music dir, oldest first."""
+        if self.resume_history is not None:
+            return self.resume_history # The full library hasn't arrived to map it onto yet
+        recent = range(max(0, len(self.play_history) - HISTORY_KEPT), len(self.play_history))
+        return [os.path.relpath(path, self.music_dir)
+                for path in self.music_files.paths_at(self.play_history[i] for i in recent)]
+
+    def session_state(self):
+        if not self.music_files:
+            return None
+        position = self.engine.position if self.engine.has_position() else self.elapsed_time
+        return {'track': track_identity(self.music_dir, self.music_files[self.current_index]),
+                'position': round(position, 3),
+                'random_mode': self.random_mode,
+                'auto_play': self.auto_play,
+                'volume': self.volume,
+                'muted': self.muted,
+                'history': self.recent_history()}
+
+    def write_session(self):
+        if self._session_timer:
+            self._session_timer.cancel()
+            self._session_timer = None
+        state = self.session_state()
+        if state is None:
+            return
+        try:
+            save_session(state, self.session_path)
+        except OSError as e:
+            print(f"Error saving session: {e}")
+
+    def mark_session_changed(self):
+        """Snapshot the session shortly; everything changed until then goes in one write."""
+        if self.session_path and self._session_timer is None:
+            self._session_timer = self.loop.call_later(SESSION_SAVE_DELAY, self.write_session)
+
+    def save_session_periodically(self):
+        if not self.session_path:
+            return
+        if self.engine.is_playing() and not self.paused:
+            self.write_session()
+        self.loop.call_later(SESSION_INTERVAL, self.save_session_periodically)
+
+    def close_session(self):
+        """The snapshot taken on exit; later calls do nothing."""
+        if self.session_path:
+            self.write_session()
+            self.session_path = None
+
+    def on_track_finished(self):
+        if self.auto_play and self.running:
+            self.play_next()
+        else:
+            self.renderer.wake()
+
+    def play_next(self):
+        if not self.music_files: return
+        self.current_index = self.resolve_next_index()
+        self.next_index = None
+        self.song_duration = 0 # Reset duration for new song
+        self.play_current_song() # played_from_history defaults to False
+
+    def create_shuffle(self):
+        if SHUFFLE_WEIGHTING == 'plays':
+            weight = play_count_weight(self.play_stats)
+        elif SHUFFLE_WEIGHTING == 'recency':
+            weight = recency_weight(self.play_stats)
+        else:
+            weight = None
+        return ShuffleBag(len(self.music_files), weight)
+
+    def choose_next_index(self):
+        if self.random_mode:
+            # No track repeats until the whole library has played
+            self.shuffle.resize(len(self.music_files))
+            return self.shuffle.next(avoid=self.current_index)
+        return (self.current_index + 1) % len(self.music_files) # Sequential mode
+
+    def resolve_next_index(self):
+        if self.next_index is None:
+            self.next_index = self.play_queue.popleft() if self.play_queue else self.choose_next_index()
+        return self.next_index
+
+    def maybe_preload_next(self):
+        """Called PRELOAD_SECONDS before the end: probe and load the next track so it starts with no gap."""
+        if not (self.auto_play and self.music_files and self.engine.is_playing()) or self.paused:
+            return
+        if self.engine.preloaded_path is not None:
+            return
+        next_path = self.music_files[self.resolve_next_index()]
+        self.duration_cache.get_duration(next_path)
+        self.engine.preload(next_path, self.track_gain(next_path))
+
+    def discard_preload(self):
+        self.next_index = None
+        self.engine.cancel_preload()
+
     def skip_backward(self):
         if not self.music_files: return
-        if not self.playback_process: # If not playing, start current song from beginning
+        if not self.engine.is_playing(): # If not playing, start current song from beginning
             self.song_duration = 0
             self.play_current_song(start_time_sec=0)
             return
@@ -303,59 +628,137 @@ class MusicPlayer:
 
     def skip_forward(self):
         if not self.music_files: return
-        if not self.playback_process: # If not playing, act like 'next'
-            self.command_queue.put('next')
+        if not self.engine.is_playing(): # If not playing, act like 'next'
+            self.play_next()
             return
 
         new_position = self.elapsed_time + 15
 
         if self.song_duration > 0 and new_position >= self.song_duration - 2: # If near end, skip to next
-            self.command_queue.put('next')
+            self.play_next()
         elif self.song_duration == 0 and new_position > 15: # If duration unknown and skipped significantly
-             self.command_queue.put('next')
+             self.play_next()
         else:
             if self.song_duration > 0 :
                 new_position = min(new_position, self.song_duration -1) # Cap at song end
             new_position = max(0, new_position) # Ensure not negative
             self.play_current_song(start_time_sec=new_position)
 
-    def input_handler(self):
+    def setup_input(self):
         import tty # Specific to this function for TTY manipulation
         fd = sys.stdin.fileno()
         if not sys.stdin.isatty(): # Check if running in a TTY
-            # print("Warning: Not running in a TTY. Input handling may be limited.")
             return # Essential TTY features needed
 
         try:
             self._term_settings = termios.tcgetattr(fd)
+            tty.setraw(fd)
         except termios.error:
-            # print(f"Warning: Could not get terminal settings: {e}")
             return # Cannot proceed without terminal settings
+        self.loop.add_reader(fd, self.on_input, fd)
 
+    def on_input(self, fd):
         try:
-            tty.setraw(fd)
-            while self.running:
-                try:
-                    ch = sys.stdin.read(1)
-                    if not self.running: break # Exit if player stopped
-
-                    if ch == 'q': self.command_queue.put('stop'); break
-                    elif ch == 'n': self.command_queue.put('next')
-                    elif ch == 'p': self.command_queue.put('prev')
-                    elif ch == ',': self.command_queue.put('skip_backward')
-                    elif ch == '.': self.command_queue.put('skip_forward')
-                    elif ch == 'r': self.command_queue.put('random')
-                    elif ch == '=' or ch == '+': self.command_queue.put('vol_up') # Support + too
-                    elif ch == '-': self.command_queue.put('vol_down')
-                    elif ch == 'm': self.command_queue.put('mute')
-                    elif ch == 'a': self.command_queue.put('autoplay')
-                except Exception: # Catch potential errors during read
-                    break 
-        except Exception: # Catch potential errors during tty.setraw
-            pass
-        finally:
-            if self._term_settings: # Restore terminal settings if they were captured
-                termios.tcsetattr(fd, termios.TCSADRAIN, self._term_settings)
+            data = os.read(fd, 64)
+        except OSError:
+            data = b''
+        if not data: # Terminal went away
+            self.loop.remove_reader(fd)
+            return
+        if self.search_mode:
+            self.handle_search_input(data.decode(errors='ignore'))
+            return
+        for ch in data.decode(errors='ignore'):
+            command = KEY_BINDINGS.get(ch)
+            if command:
+                self.handle_command(command)
+            if not self.running: break
+
+    def start_search_index(self):
+        self.search_generation += 1
+        self.search_index = None
+        threading.Thread(target=self.build_search_index, args=(self.search_generation,), daemon=True).start()
+
+    def build_search_index(self, generation):
+        # Runs on a worker thread; the finished index is handed to the loop in one step
+        from search import index_descriptions # Deferred: not needed before the first track plays
+        library = self.music_files
+        try:
+            index = index_descriptions(library.describe(i) for i in range(len(library)))
+        except IndexError:
+            return # The library shrank under us; its reload starts a fresh build
+        def install():
+            if generation != self.search_generation:
+                return # The library was reloaded meanwhile
+            self.search_index = index
+            if self.search_mode:
+                self.update_search()
+        self.loop.call_soon_threadsafe(install)
+
+    def update_search(self):
+        if self.search_index is not None:
+            self.search_results = self.search_index.search(self.search_query, limit=SEARCH_RESULTS)
+        self.search_selected = 0
+        self.renderer.wake()
+
+    def close_search(self):
+        self.search_mode = False
+        self.search_results = []
+        self.renderer.wake()
+
+    def handle_search_input(self, text):
+        i = 0
+        while i < len(text):
+            ch = text[i]
+            if text.startswith('\x1b[A', i) or text.startswith('\x1b[B', i):
+                step = -1 if text[i + 2] == 'A' else 1
+                if self.search_results:
+                    self.search_selected = (self.search_selected + step) % len(self.search_results)
+                    self.renderer.wake()
+                i += 3
+                continue
+            if ch == '\x03':
+                self.handle_command('stop')
+                return
+            elif ch == '\x1b':
+                self.close_search()
+                return
+            elif ch in '\r\n\t':
+                if self.search_results:
+                    idx = self.search_results[self.search_selected]
+                    if ch == '\t': # Tab queues, Enter plays now
+                        self.play_queue.append(idx)
+                        self.discard_preload()
+                    else:
+                        self.discard_preload()
+                        self.current_index = idx
+                        self.song_duration = 0
+                        self.play_current_song()
+                self.close_search()
+                return
+            elif ch in '\x7f\x08':
+                self.search_query = self.search_query[:-1]
+            elif ch.isprintable():
+                self.search_query += ch
+            i += 1
+        self.update_search()
+
+    def draw_search(self, screen):
+        rows = range(SEARCH_ROW, SEARCH_ROW + SEARCH_RESULTS + 2)
+        if not self.search_mode:
+            for row in rows:
+                screen.clear_line(row)
+            return
+        status = '' if self.search_index is not None else '  (indexing...)'
+        screen.set_line(SEARCH_ROW, f"Search: {self.search_query}_{status}")
+        for n, row in enumerate(rows[1:-1]):
+            if n < len(self.search_results):
+                title, album, artist = self.music_files.describe(self.search_results[n])
+                line = f"  {title} — {artist} / {album}"
+                screen.set_line(row, f"\033[7m{line}\033[0m" if n == self.search_selected else line)
+            else:
+                screen.clear_line(row)
+        screen.set_line(rows[-1], "\033[38;5;244m[Enter]Play [Tab]Queue [↑/↓]Select [Esc]Close\033[0m")
 
     def run(self):
         # Hide cursor
@@ -364,17 +767,10 @@ class MusicPlayer:
 
         print("Scanning music directory...") # Initial message
 
-        player_thread = threading.Thread(target=self.player_loop)
-        player_thread.daemon = False # Ensure thread is joined for proper cleanup
-        player_thread.start()
-
         try:
-            player_thread.join() # Wait for the player_loop to complete
+            self.player_loop()
         except KeyboardInterrupt:
             print("\nStopping player...") # User interrupted
-            self.command_queue.put('stop') # Signal player_loop to stop
-            if player_thread.is_alive():
-                player_thread.join(timeout=2) # Wait for graceful shutdown
         finally:
             # Ensure stop is called, which also restores terminal and cursor
             if self.running: # If stop wasn't called through normal flow (e.g. error in thread)
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+import os
+import sys
+import mmap
+import struct
+import sqlite3
+import subprocess
+import threading
+from collections import namedtuple
+
+from library_index import INDEX_DB_PATH
+
+AudioInfo = namedtuple('AudioInfo', 'format duration sample_rate channels')
+
+# MPEG audio tables, indexed by [version][layer]; version 1 = MPEG-1, 2 = MPEG-2 and 2.5
+MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),   # MPEG-2.5
+}
+
+# How far into the file to look for the first MPEG frame sync
+MP3_SYNC_SEARCH = 64 * 1024
+
+Mp3Frame = namedtuple('Mp3Frame', 'version layer bitrate sample_rate samples length channels')
+
+
+def parse_mp3_header(header):
+    """Decode a 4-byte MPEG audio frame header, or return None if it isn't one."""
+    if len(header) < 4:
+        return None
+    b1, b2, b3 = header[1], header[2], header[3]
+    if header[0] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version_bits = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_idx = (b2 >> 4) & 0x0F
+    rate_idx = (b2 >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+    version = 1 if version_bits == 3 else 2
+    layer = 4 - layer_bits
+    bitrate = MP3_BITRATES[(version, layer)][bitrate_idx] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version_bits][rate_idx]
+    padding = (b2 >> 1) & 0x01
+    channels = 1 if (b3 >> 6) == 3 else 2
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or version == 1) else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return Mp3Frame(version, layer, bitrate, sample_rate, samples, length, channels)
+
+
+def skip_id3v2(f):
+    """Position f after a leading ID3v2 tag and return that offset."""
+    f.seek(0)
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b'ID3':
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        offset = 10 + size + (10 if header[5] & 0x10 else 0)
+    else:
+        offset = 0
+    f.seek(offset)
+    return offset
+
+
+def find_first_mp3_frame(f):
+    """Return (offset, frame) of the first frame whose successor also syncs."""
+    start = skip_id3v2(f)
+    data = f.read(MP3_SYNC_SEARCH)
+    pos = data.find(b'\xff')
+    while 0 <= pos < len(data) - 4:
+        frame = parse_mp3_header(data[pos:pos + 4])
+        if frame:
+            # Guard against false syncs inside leftover tag data
+            following = data[pos + frame.length:pos + frame.length + 4]
+            if len(following) < 4 or parse_mp3_header(following):
+                return start + pos, frame
+        pos = data.find(b'\xff', pos + 1)
+    return None, None
+
+
+def mp3_audio_end(f, size):
+    """Offset where MPEG frames stop, excluding a trailing ID3v1 tag."""
+    if size >= 128:
+        f.seek(size - 128)
+        if f.read(3) == b'TAG':
+            return size - 128
+    return size
+
+
+def xing_offset(frame):
+    # Side information size sits between the header and the Xing/Info tag
+    if frame.version == 1:
+        return 4 + (17 if frame.channels == 1 else 32)
+    return 4 + (9 if frame.channels == 1 else 17)
+
+
+def read_vbr_header(f, offset, frame):
+    """Parse a Xing/Info or VBRI header in the first frame.
+
+    Returns (frame_count, byte_count, toc) with toc being a 100-entry Xing table or None.
+    """
+    f.seek(offset)
+    data = f.read(frame.length)
+    pos = xing_offset(frame)
+    tag = data[pos:pos + 4]
+    if tag in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        pos += 8
+        frames = byte_count = toc = None
+        if flags & 0x1:
+            frames = struct.unpack('>I', data[pos:pos + 4])[0]
+            pos += 4
+        if flags & 0x2:
+            byte_count = struct.unpack('>I', data[pos:pos + 4])[0]
+            pos += 4
+        if flags & 0x4:
+            toc = tuple(data[pos:pos + 100])
+            if len(toc) != 100:
+                toc = None
+        return frames, byte_count, toc
+    if data[36:40] == b'VBRI':
+        byte_count, frames = struct.unpack('>II', data[46:54])
+        return frames, byte_count, None
+    return None, None, None
+
+
+def iter_mp3_frames(f, offset, end):
+    """Yield (offset, frame) for each consecutive frame, reading only headers."""
+    while offset + 4 <= end:
+        f.seek(offset)
+        frame = parse_mp3_header(f.read(4))
+        if frame is None or frame.length <= 0:
+            return
+        yield offset, frame
+        offset += frame.length
+
+
+def probe_mp3(f, size):
+    offset, first = find_first_mp3_frame(f)
+    if first is None:
+        return None
+    frames, _, _ = read_vbr_header(f, offset, first)
+    if not frames:
+        # No VBR header: count frames by hopping from header to header
+        frames = sum(1 for _ in iter_mp3_frames(f, offset, mp3_audio_end(f, size)))
+    duration = frames * first.samples / first.sample_rate
+    return AudioInfo('mp3', duration, first.sample_rate, first.channels)
+
+
+def probe_flac(f, size):
+    offset = skip_id3v2(f)
+    if f.read(4) != b'fLaC':
+        return None
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0:
+        return None
+    info = f.read(34)
+    if len(info) < 34:
+        return None
+    packed = int.from_bytes(info[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x07) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate:
+        return None
+    return AudioInfo('flac', total_samples / sample_rate, sample_rate, channels)
+
+
+def probe_wav(f, size):
+    header = f.read(12)
+    if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    byte_rate = sample_rate = channels = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, chunk_size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+        if chunk_id == b'fmt ':
+            fmt = f.read(chunk_size)
+            _, channels, sample_rate, byte_rate = struct.unpack('<HHII', fmt[:12])
+            f.seek(chunk_size & 1, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            # Truncated files report more data than they hold
+            data_size = min(chunk_size, size - f.tell())
+            return AudioInfo('wav', data_size / byte_rate, sample_rate, channels)
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def probe_ogg(f, size):
+    first_page = f.read(4096)
+    if first_page[:4] != b'OggS':
+        return None
+    pre_skip = 0
+    if b'\x01vorbis' in first_page:
+        pos = first_page.index(b'\x01vorbis') + 7
+        channels, sample_rate = struct.unpack('<BI', first_page[pos + 4:pos + 9])
+        codec = 'vorbis'
+    elif b'OpusHead' in first_page:
+        pos = first_page.index(b'OpusHead') + 8
+        channels, pre_skip = struct.unpack('<BH', first_page[pos + 1:pos + 4])
+        sample_rate = 48000  # Opus granule positions always count 48 kHz samples
+        codec = 'opus'
+    else:
+        return None
+
+    # The last page's granule position is the total sample count
+    tail_size = min(size, 64 * 1024)
+    f.seek(size - tail_size)
+    tail = f.read(tail_size)
+    pos = tail.rfind(b'OggS')
+    while pos >= 0:
+        if len(tail) >= pos + 14:
+            granule = struct.unpack('<q', tail[pos + 6:pos + 14])[0]
+            if granule >= 0:
+                return AudioInfo(codec, max(granule - pre_skip, 0) / sample_rate, sample_rate, channels)
+        pos = tail.rfind(b'OggS', 0, pos)
+    return None
+
+
+def iter_mp4_atoms(f, start, end):
+    """Yield (type, payload_offset, payload_end) for atoms between start and end."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        atom_size, atom_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if atom_size == 1:
+            atom_size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif atom_size == 0:
+            atom_size = end - offset
+        if atom_size < header_size:
+            return
+        yield atom_type, offset + header_size, offset + atom_size
+        offset += atom_size
+
+
+def probe_mp4(f, size):
+    f.seek(4)
+    if f.read(4) != b'ftyp':
+        return None
+    for atom_type, start, end in iter_mp4_atoms(f, 0, size):
+        if atom_type != b'moov':
+            continue
+        for child_type, child_start, _ in iter_mp4_atoms(f, start, end):
+            if child_type != b'mvhd':
+                continue
+            f.seek(child_start)
+            version = f.read(4)[0]
+            if version == 1:
+                timescale, duration = struct.unpack('>IQ', f.read(28)[16:28])
+            else:
+                timescale, duration = struct.unpack('>II', f.read(16)[8:16])
+            if not timescale:
+                return None
+            return AudioInfo('mp4', duration / timescale, None, None)
+    return None
+
+
+# Probers tried per extension; the others are tried afterwards in case the extension lies
+PROBERS_BY_EXT = {
+    '.mp3': probe_mp3,
+    '.flac': probe_flac,
+    '.wav': probe_wav,
+    '.ogg': probe_ogg,
+    '.opus': probe_ogg,
+    '.m4a': probe_mp4,
+    '.mp4': probe_mp4,
+}
+CONTAINER_PROBERS = (probe_flac, probe_wav, probe_ogg, probe_mp4)
+
+
+def probe(file_path):
+    """Read container headers to find the format and duration, without spawning a process."""
+    ext = os.path.splitext(file_path)[1].lower()
+    first = PROBERS_BY_EXT.get(ext)
+    probers = ([first] if first else []) + [p for p in CONTAINER_PROBERS if p is not first]
+    try:
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            for prober in probers:
+                f.seek(0)
+                try:
+                    info = prober(f, size)
+                except (struct.error, IndexError, ValueError):
+                    info = None
+                if info:
+                    return info
+    except OSError:
+        pass
+    return None
+
+
+def ffprobe_duration(file_path):
+    """Duration in seconds according to ffprobe, or None if it couldn't tell (or isn't installed)."""
+    try:
+        output = subprocess.check_output(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', file_path],
+            stderr=subprocess.DEVNULL)
+        return float(output)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+class DurationCache:
+    """Durations keyed by path, size and mtime, persisted in the library index DB.
+
+    Lookups hit an in-memory dict first, then SQLite, then the header parser, and
+    only shell out to ffprobe for formats the parser doesn't understand.
+    """
+
+    def __init__(self, db_path=INDEX_DB_PATH):
+        self.db_path = db_path
+        self._conn = None
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            with self._conn:
+                self._conn.execute('''CREATE TABLE IF NOT EXISTS durations
+                                   (path TEXT PRIMARY KEY,
+                                    size INTEGER,
+                                    mtime_ns INTEGER,
+                                    duration REAL,
+                                    format TEXT)''')
+        return self._conn
+
+    def get_duration(self, file_path):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return 0.0
+        key = (file_path, st.st_size, st.st_mtime_ns)
+        if key in self._memory:
+            return self._memory[key]
+
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT size, mtime_ns, duration FROM durations WHERE path = ?',
+                               (file_path,)).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                self._memory[key] = row[2]
+                return row[2]
+
+            info = probe(file_path)
+            if info:
+                duration, fmt = info.duration, info.format
+            else:
+                duration, fmt = ffprobe_duration(file_path), 'ffprobe'
+                if duration is None:
+                    return 0.0  # Not cached: a missing ffprobe or a transient failure gets retried next time
+            with conn:
+                conn.execute('''INSERT OR REPLACE INTO durations (path, size, mtime_ns, duration, format)
+                             VALUES (?, ?, ?, ?, ?)''',
+                             (file_path, st.st_size, st.st_mtime_ns, duration, fmt))
+            self._memory[key] = duration
+            return duration
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class SeekTable:
+    """Maps a time in an MP3 file to the frame index the decoder seeks to, without decoding.
+
+    Every frame of a stream holds the same number of samples, so the index is plain
+    arithmetic. The frame count, from a Xing/Info/VBRI header or else one pass over
+    the frame headers, only bounds it.
+    """
+
+    def __init__(self, sample_rate, samples_per_frame, frame_count, audio_start=0):
+        self.sample_rate = sample_rate
+        self.samples_per_frame = samples_per_frame
+        self.frame_count = frame_count
+        self.audio_start = audio_start
+
+    @property
+    def duration(self):
+        return self.frame_count * self.samples_per_frame / self.sample_rate
+
+    def frame_at(self, seconds):
+        frame = int(seconds * self.sample_rate / self.samples_per_frame)
+        return max(0, min(frame, self.frame_count - 1))
+
+    @classmethod
+    def build(cls, file_path):
+        """Read file_path's headers and return its SeekTable, or None if it isn't MPEG audio."""
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset, first = find_first_mp3_frame(mm)
+                if first is None:
+                    return None
+                frames, _, _ = read_vbr_header(mm, offset, first)
+                if frames is not None:
+                    # The Xing/Info/VBRI frame carries no audio; mpg123 doesn't count it
+                    return cls(first.sample_rate, first.samples, frames, offset + first.length)
+                frames = sum(1 for _ in iter_mp3_frames(mm, offset, mp3_audio_end(mm, size)))
+                return cls(first.sample_rate, first.samples, frames, offset)
+
+    def to_row(self):
+        return self.sample_rate, self.samples_per_frame, self.frame_count, self.audio_start
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+
+class SeekIndex:
+    """Per-file MP3 seek tables, built on first use and persisted in the library index DB."""
+
+    def __init__(self, db_path=INDEX_DB_PATH):
+        self.db_path = db_path
+        self._conn = None
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            with self._conn:
+                self._conn.execute('''CREATE TABLE IF NOT EXISTS seek_tables
+                                   (path TEXT PRIMARY KEY,
+                                    size INTEGER,
+                                    mtime_ns INTEGER,
+                                    sample_rate INTEGER,
+                                    samples_per_frame INTEGER,
+                                    frame_count INTEGER,
+                                    audio_start INTEGER)''')
+        return self._conn
+
+    def get(self, file_path):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        key = (file_path, st.st_size, st.st_mtime_ns)
+        if key in self._memory:
+            return self._memory[key]
+
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('''SELECT size, mtime_ns, sample_rate, samples_per_frame, frame_count, audio_start
+                                  FROM seek_tables WHERE path = ?''', (file_path,)).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                table = SeekTable.from_row(row[2:])
+            else:
+                try:
+                    table = SeekTable.build(file_path)
+                except (OSError, ValueError, struct.error):
+                    table = None
+                if table is None:
+                    return None
+                with conn:
+                    conn.execute('''INSERT OR REPLACE INTO seek_tables
+                                 (path, size, mtime_ns, sample_rate, samples_per_frame, frame_count, audio_start)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                 (file_path, st.st_size, st.st_mtime_ns) + table.to_row())
+            self._memory = {key: table}  # Only the current track is worth keeping in memory
+            return table
+
+    def frame_at(self, file_path, seconds):
+        """Frame index to hand to the decoder for a seek, or None if there is no table."""
+        table = self.get(file_path)
+        return table.frame_at(seconds) if table else None
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python audio_probe.py <audio_file> [...]")
+        sys.exit(1)
+
+    for path in sys.argv[1:]:
+        info = probe(path)
+        if info:
+            print(f"{path}: {info.format}, {info.duration:.2f}s, {info.sample_rate or '?'} Hz, {info.channels or '?'} ch")
+        else:
+            duration = ffprobe_duration(path)
+            shown = f"{duration:.2f}s" if duration is not None else "nothing"
+            print(f"{path}: unknown format (ffprobe says {shown})")
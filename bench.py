@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from audio_probe import DurationCache
+from library_index import LibraryIndex
+from metadata_db import MetadataWriter
+from track_library import TrackLibrary
+
+SCRIPT_DIR = Path(__file__).parent
+RESULTS_PATH = SCRIPT_DIR / 'bench_results.jsonl'
+MARKER = 'bench_library.json'  # Written next to a generated library so --dir can reuse it
+
+# MPEG-1 Layer III, 128 kbit/s, 44.1 kHz, mono: 417-byte frames of 1152 samples
+FRAME_HEADER = b'\xff\xfb\x90\xc0'
+FRAME_BYTES = 417
+FRAME_SAMPLES = 1152
+SAMPLE_RATE = 44100
+XING_OFFSET = 4 + 17
+
+TRACKS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 4
+CLIP_SECONDS = 0.25   # Library files: big libraries stay a few GB
+PLAY_TRACKS = 6       # Long enough to seek in, for the playback latencies
+PLAY_SECONDS = 40
+DURATION_SAMPLE = 2000
+CHOOSE_CALLS = 10000
+RENDER_FRAMES = 2000
+INSERT_TRACKS = 50000
+AUDIO_TIMEOUT = 10
+
+
+def silent_mp3(seconds):
+    """A valid MP3 of digital silence with an Info header, so its length is known from the first frame."""
+    frames = max(1, round(seconds * SAMPLE_RATE / FRAME_SAMPLES))
+    frame = FRAME_HEADER + bytes(FRAME_BYTES - len(FRAME_HEADER))
+    info = bytearray(frame)
+    info[XING_OFFSET:XING_OFFSET + 16] = b'Info' + struct.pack('>III', 0x3, frames, (frames + 1) * FRAME_BYTES)
+    return bytes(info) + frame * frames
+
+
+def track_info(i):
+    """The yt-dlp info dict downloader.store_metadata would get for synthetic track i."""
+    album_no, position = divmod(i, TRACKS_PER_ALBUM)
+    artist_no = album_no // ALBUMS_PER_ARTIST
+    return {'id': f'bench{i:07d}', 'title': f'Track {i}', 'playlist_id': f'benchalbum{album_no}',
+            'playlist_title': f'Album {album_no}', 'playlist_index': position + 1,
+            'artist': f'Artist {artist_no}', 'webpage_url': f'https://example.com/watch?v=bench{i}'}
+
+
+def track_path(music_dir, i):
+    album_no, position = divmod(i, TRACKS_PER_ALBUM)
+    return os.path.join(music_dir, f'Artist {album_no // ALBUMS_PER_ARTIST:05d}', f'Album {album_no:06d}',
+                        f'{position + 1:02d} Track {i:07d}.mp3')
+
+
+def generate_library(root, tracks, seconds=CLIP_SECONDS):
+    """Write tracks silent MP3s under root/music, laid out like downloader.py, plus their metadata rows.
+
+    Returns (music dir, metadata DB path). A library already generated with the same
+    size and length is reused.
+    """
+    music_dir = os.path.join(root, 'music')
+    metadata_path = os.path.join(root, 'music_metadata.db')
+    marker = os.path.join(root, MARKER)
+    spec = {'tracks': tracks, 'seconds': seconds}
+    try:
+        with open(marker) as f:
+            if json.load(f) == spec:
+                return music_dir, metadata_path
+    except (OSError, ValueError):
+        pass
+    for stale in (music_dir, metadata_path, metadata_path + '-wal', metadata_path + '-shm'):
+        if os.path.isdir(stale):
+            shutil.rmtree(stale)
+        elif os.path.exists(stale):
+            os.remove(stale)
+
+    data = silent_mp3(seconds)
+    writer = MetadataWriter(metadata_path, batch_size=5000)
+    for i in range(tracks):
+        path = track_path(music_dir, i)
+        if i % TRACKS_PER_ALBUM == 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        writer.add(track_info(i), path)
+    writer.close()
+    with open(marker, 'w') as f:
+        json.dump(spec, f)
+    return music_dir, metadata_path
+
+
+def remove_db(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def summary(name, times, unit='ms'):
+    """One result from repeated timings in seconds: the median, with p95 and the spread."""
+    scale = {'s': 1, 'ms': 1e3, 'us': 1e6}[unit]
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    return {'name': name, 'value': statistics.median(times) * scale, 'unit': unit, 'samples': len(times),
+            'p95': p95 * scale, 'min': times[0] * scale, 'max': times[-1] * scale}
+
+
+def per_call(name, elapsed, calls, unit='us'):
+    scale = {'ms': 1e3, 'us': 1e6}[unit]
+    return {'name': name, 'value': elapsed / calls * scale, 'unit': unit, 'samples': calls}
+
+
+def find_music_files(player):
+    """The whole library, loaded before anything plays: how the player started up before play-first startup.
+
+    A first start walks the tree; a restart trusts the index and leaves a rescan running.
+    """
+    with LibraryIndex(player.music_dir, player.index_path) as index:
+        first_scan = index.is_empty()
+        if first_scan:
+            index.scan()
+    if not first_scan:
+        threading.Thread(target=player.rescan_library, daemon=True).start()
+    library = TrackLibrary(player.music_dir, player.index_path, player.metadata_path)
+    library.load()
+    return library
+
+
+def bench_library(player, repeats):
+    """find_music_files on a first start (full walk) and a restart (index already built)."""
+    results = []
+    remove_db(player.index_path)
+    start = time.perf_counter()
+    library = find_music_files(player)
+    results.append({'name': 'find_music_files.first_scan', 'value': time.perf_counter() - start,
+                    'unit': 's', 'samples': 1})
+
+    times = []
+    for _ in range(repeats):
+        threads = set(threading.enumerate())
+        start = time.perf_counter()
+        find_music_files(player).close()
+        times.append(time.perf_counter() - start)
+        # The rescan it leaves running would be timed as part of the next benchmark
+        join_new_threads(threads)
+    results.append(summary('find_music_files.restart', times))
+
+    start = time.perf_counter()
+    with LibraryIndex(player.music_dir, player.index_path) as index:
+        index.scan()
+    results.append({'name': 'library_index.rescan', 'value': (time.perf_counter() - start) * 1e3,
+                    'unit': 'ms', 'samples': 1})
+    return library, results
+
+
+def bench_durations(player, library, tmp):
+    """get_song_duration from the header parser, the SQLite cache after a restart and memory."""
+    paths = [library[i] for i in sorted(random.sample(range(len(library)), min(len(library), DURATION_SAMPLE)))]
+    cache_path = os.path.join(tmp, 'durations.db')
+    remove_db(cache_path)
+    results = []
+    for name, fresh in (('cold', True), ('restart', True), ('memory', False)):
+        if fresh:
+            player.duration_cache.close()
+            player.duration_cache = DurationCache(cache_path)
+        start = time.perf_counter()
+        for path in paths:
+            player.get_song_duration(path)
+        results.append(per_call(f'get_song_duration.{name}', time.perf_counter() - start, len(paths)))
+    return results
+
+
+def bench_next_track(player, library):
+    player.music_files = library
+    start = time.perf_counter()
+    player.shuffle = player.create_shuffle()
+    results = [{'name': 'shuffle.create', 'value': (time.perf_counter() - start) * 1e3, 'unit': 'ms',
+                'samples': 1}]
+    for name, random_mode in (('random', True), ('sequential', False)):
+        player.random_mode = random_mode
+        player.current_index = 0
+        start = time.perf_counter()
+        for _ in range(CHOOSE_CALLS):
+            player.current_index = player.choose_next_index()
+        results.append(per_call(f'choose_next_index.{name}', time.perf_counter() - start, CHOOSE_CALLS))
+    return results
+
+
+def bench_render(player, name):
+    """Cost of one frame: draw() into the screen model plus the diff flushed to /dev/null."""
+    renderer = player.renderer
+    results = []
+    for kind, invalidate in (('frame', False), ('full_repaint', True)):
+        times = []
+        for _ in range(RENDER_FRAMES):
+            if invalidate:
+                player.screen.invalidate()
+            renderer.render_frame()
+            times.append(renderer.last_frame_cost)
+        results.append(summary(f'render.{kind}_{name}', times, 'us'))
+    return results
+
+
+def bench_store_metadata(tmp, count):
+    """Tracks/s through the writer behind downloader.store_metadata, on a scratch database.
+
+    downloader.store_metadata is a one-line call into the process-wide writer, which
+    always targets the real music_metadata.db, so its own MetadataWriter is used here.
+    """
+    db_path = os.path.join(tmp, 'store_metadata.db')
+    remove_db(db_path)
+    infos = [track_info(i) for i in range(count)]
+    paths = [track_path('/bench/music', i) for i in range(count)]
+    writer = MetadataWriter(db_path)
+    start = time.perf_counter()
+    for info, path in zip(infos, paths):
+        writer.add(info, path)
+    writer.close()
+    elapsed = time.perf_counter() - start
+    return [{'name': 'store_metadata.insert', 'value': count / elapsed, 'unit': 'tracks/s', 'samples': count}]
+
+
+def playback_unavailable():
+    """Why PcmPlayer can't run here, or None."""
+    try:
+        from pcm_output import FFMPEG_CMD
+    except ImportError as e:
+        return f"needs numpy ({e})"
+    if shutil.which(FFMPEG_CMD) is None:
+        return f"{FFMPEG_CMD} not found"
+    return None
+
+
+def first_buffer_sink():
+    """A realtime NullSink that notes when its first buffer arrives after heard.clear()."""
+    from pcm_output import NullSink
+
+    class FirstBufferSink(NullSink):
+        def __init__(self):
+            super().__init__(realtime=True)
+            self.heard = threading.Event()
+            self.heard_at = 0.0
+
+        def write(self, data):
+            if not self.heard.is_set():
+                self.heard_at = time.perf_counter()
+                self.heard.set()
+            super().write(data)
+
+    return FirstBufferSink()
+
+
+def join_new_threads(before):
+    for thread in set(threading.enumerate()) - before:
+        thread.join()
+
+
+def bench_startup(ninelayer, music_dir, metadata_path, tmp, repeats):
+    """From MusicPlayer() to the first buffer of audio, starting up the way player_loop does.
+
+    A first start has no library index yet; a restart has one. Neither should grow
+    with the size of the library.
+    """
+    index_path = os.path.join(tmp, 'startup_index.db')
+    remove_db(index_path)
+    results = []
+    with open(os.devnull, 'w') as devnull:
+        for name, runs in (('first_start', 1), ('restart', repeats)):
+            times = []
+            for _ in range(runs):
+                threads = set(threading.enumerate())
+                start = time.perf_counter()
+                player = ninelayer.MusicPlayer(music_dir, index_path, metadata_path, output='null', out=devnull,
+                                               session=None)
+                sink = player.engine.sink = first_buffer_sink()
+                player.music_files = player.start_library()
+                player.shuffle = player.create_shuffle()
+                player.current_index = player.shuffle.next()
+                player.running = True
+                player.play_current_song()
+                if not sink.heard.wait(AUDIO_TIMEOUT):
+                    raise RuntimeError(f"no audio {AUDIO_TIMEOUT}s after starting up")
+                times.append(sink.heard_at - start)
+                player.engine.quit()
+                # The library keeps loading in the background; let it finish before the next run
+                join_new_threads(threads)
+                player.loop.close()
+            results.append(summary(f'startup.first_audio_{name}', times))
+    return results
+
+
+def bench_playback(ninelayer, root, repeats):
+    """Key press to first audio for 'n' and '.', through the event loop into PcmPlayer and a null sink.
+
+    The player runs its loop on a thread; each command is posted like a key and the
+    clock stops when the sink receives the first buffer of the new decoder.
+    """
+    play_root = os.path.join(root, 'play')
+    os.makedirs(play_root, exist_ok=True)
+    music_dir, metadata_path = generate_library(play_root, PLAY_TRACKS, PLAY_SECONDS)
+    index_path = os.path.join(play_root, 'library_index.db')
+    with open(os.devnull, 'w') as devnull:
+        player = ninelayer.MusicPlayer(music_dir, index_path, metadata_path, output='null', out=devnull,
+                                       session=None)
+        sink = player.engine.sink = first_buffer_sink()
+        player.music_files = find_music_files(player)
+        player.shuffle = player.create_shuffle()
+        player.random_mode = False
+        player.running = True
+        loop_thread = threading.Thread(target=player.loop.run, daemon=True, name='bench-loop')
+        loop_thread.start()
+
+        def until_audio(command):
+            # Paused first, so no buffer of the previous track can arrive after the clock starts
+            if player.engine.is_playing() and not player.paused:
+                player.post('pause')
+                time.sleep(0.1)
+            sink.heard.clear()
+            start = time.perf_counter()
+            player.post(command)
+            if not sink.heard.wait(AUDIO_TIMEOUT):
+                raise RuntimeError(f"no audio {AUDIO_TIMEOUT}s after '{command}'")
+            return sink.heard_at - start
+
+        try:
+            until_audio('next')  # Starts the output thread; not a typical key press
+            next_times, seek_times = [], []
+            for _ in range(repeats):
+                next_times.append(until_audio('next'))
+                seek_times.append(until_audio('skip_forward'))
+            results = [summary('key_to_audio.next', next_times), summary('key_to_audio.seek', seek_times)]
+            until_audio('next')
+            results += bench_render(player, 'playing')
+        finally:
+            player.post('stop')
+            loop_thread.join(AUDIO_TIMEOUT)
+            player.stop()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(root, tracks, repeats):
+    """Every benchmark against a library of tracks files under root; returns (results, skipped)."""
+    ninelayer = importlib.import_module('9layer')
+    tmp = os.path.join(root, 'scratch')
+    os.makedirs(tmp, exist_ok=True)
+    start = time.perf_counter()
+    music_dir, metadata_path = generate_library(root, tracks)
+    print(f"Library of {tracks} tracks ready in {time.perf_counter() - start:.1f}s")
+
+    results = []
+    skipped = {}
+    with open(os.devnull, 'w') as devnull:
+        player = ninelayer.MusicPlayer(music_dir, os.path.join(root, 'library_index.db'), metadata_path,
+                                       out=devnull, session=None)
+        library, timings = bench_library(player, repeats)
+        results += timings
+        results += bench_durations(player, library, tmp)
+        results += bench_next_track(player, library)
+        player.now_playing = library.describe(0)
+        player.song_duration = int(PLAY_SECONDS)
+        results += bench_render(player, 'idle')
+        player.duration_cache.close()
+        library.close()
+    results += bench_store_metadata(tmp, min(tracks, INSERT_TRACKS))
+    reason = playback_unavailable()
+    if reason:
+        skipped['startup, key_to_audio'] = reason
+    else:
+        results += bench_startup(ninelayer, music_dir, metadata_path, tmp, repeats)
+        results += bench_playback(ninelayer, root, repeats)
+    return results, skipped
+
+
+def previous_results(path, tracks):
+    """{name: result} from the last recorded run with the same library size."""
+    runs = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('tracks') == tracks:
+                    runs.setdefault(record['run'], {})[record['name']] = record
+    except (OSError, ValueError):
+        return {}
+    return runs[max(runs)] if runs else {}
+
+
+def report(results, previous):
+    for result in results:
+        line = f"{result['name']:34} {result['value']:12.3f} {result['unit']:8}"
+        if 'p95' in result:
+            line += f" p95 {result['p95']:10.3f}"
+        else:
+            line += " " * 15
+        before = previous.get(result['name'])
+        if before and before['value']:
+            change = (result['value'] - before['value']) / before['value'] * 100
+            line += f"  {change:+6.1f}% vs {before['run']}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the player's hot paths on a generated library")
+    parser.add_argument('--tracks', type=int, default=1000, help="synthetic library size (default: 1000)")
+    parser.add_argument('--repeats', type=int, default=20, help="timings per latency benchmark (default: 20)")
+    parser.add_argument('--dir', help="keep the generated library here and reuse it on later runs")
+    parser.add_argument('--results', default=str(RESULTS_PATH),
+                        help="JSON lines file results are appended to (default: bench_results.jsonl)")
+    args = parser.parse_args()
+
+    previous = previous_results(args.results, args.tracks)
+    if args.dir:
+        os.makedirs(args.dir, exist_ok=True)
+        results, skipped = run(os.path.abspath(args.dir), args.tracks, args.repeats)
+    else:
+        with tempfile.TemporaryDirectory(prefix='9layer-bench-') as tmp:
+            results, skipped = run(tmp, args.tracks, args.repeats)
+
+    run_id = time.strftime('%Y-%m-%dT%H:%M:%S')
+    context = {'run': run_id, 'commit': git_commit(), 'host': platform.node(),
+               'python': platform.python_version(), 'cpus': os.cpu_count(), 'tracks': args.tracks}
+    with open(args.results, 'a') as f:
+        for result in results:
+            f.write(json.dumps({**context, **result}) + '\n')
+    report(results, previous)
+    for name, reason in skipped.items():
+        print(f"{name}: skipped, {reason}")
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
-from downloader import download_missing_playlists
+import argparse
+from downloader import download_missing_playlists, MANIFEST_MAX_AGE
 
 PLAYLISTS = [
     "https://music.youtube.com/playlist?list=OLAK5uy_n09BOqlYRm1RdhvTovqQie87TGwa3PbRA",
@@ -15,6 +16,15 @@ PLAYLISTS = [
 ]
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download any playlists that aren't in the library yet")
+    parser.add_argument('--workers', type=int, default=1, help="playlists downloaded at once (default: 1)")
+    parser.add_argument('--per-host', type=int, default=2, help="concurrent downloads per host (default: 2)")
+    parser.add_argument('--retries', type=int, default=3, help="retries per playlist, with backoff (default: 3)")
+    parser.add_argument('--refresh', action='store_true',
+                        help="re-fetch every playlist's track list instead of using the cached manifest")
+    args = parser.parse_args()
+
     print("Starting missing playlist download check...")
-    download_missing_playlists(PLAYLISTS)
+    download_missing_playlists(PLAYLISTS, workers=args.workers, per_host=args.per_host, retries=args.retries,
+                               max_age=0 if args.refresh else MANIFEST_MAX_AGE)
     print("\nDownload check complete!")
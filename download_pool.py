@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+DEFAULT_WORKERS = 4
+DEFAULT_PER_HOST = 2
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 2.0  # Seconds before the first retry; doubles each time
+MAX_BACKOFF = 60.0
+
+
+class HostLimiter:
+    """Caps how many jobs talk to the same host at once, whatever the pool size."""
+
+    def __init__(self, per_host=DEFAULT_PER_HOST):
+        self.per_host = per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def slot(self, url):
+        host = urlparse(url).hostname or ''
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+        return semaphore
+
+
+def retry_with_backoff(fn, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, sleep=time.sleep,
+                       on_retry=None):
+    """Call fn() until it returns truthy, sleeping backoff * 2**attempt (+ jitter) between tries.
+
+    Exceptions count as failures; the last one is re-raised once retries run out.
+    """
+    for attempt in range(retries + 1):
+        error = None
+        try:
+            result = fn()
+            if result:
+                return result
+        except Exception as e:
+            error = e
+        if attempt == retries:
+            if error is not None:
+                raise error
+            return result
+        delay = min(backoff * (2 ** attempt), MAX_BACKOFF) * random.uniform(0.8, 1.2)
+        if on_retry:
+            on_retry(attempt + 1, delay, error)
+        sleep(delay)
+
+
+class ProgressBoard:
+    """Aggregates yt-dlp progress from every worker into one status line."""
+
+    def __init__(self, total_jobs, out=None, min_interval=0.2):
+        self.total_jobs = total_jobs
+        self.out = out or sys.stdout
+        self.min_interval = min_interval
+        self.done = 0
+        self.failed = 0
+        self.jobs = {}  # job name -> {'downloaded': bytes, 'total': bytes, 'speed': B/s, 'status': str}
+        self._lock = threading.Lock()
+        self._last_render = 0.0
+
+    def hook_for(self, name):
+        """A yt-dlp progress hook that reports into this board under name."""
+        def hook(d):
+            with self._lock:
+                job = self.jobs.setdefault(name, {'downloaded': 0, 'total': 0, 'speed': 0, 'status': ''})
+                job['status'] = d.get('status', '')
+                job['downloaded'] = d.get('downloaded_bytes') or job['downloaded']
+                job['total'] = d.get('total_bytes') or d.get('total_bytes_estimate') or job['total']
+                job['speed'] = d.get('speed') or 0
+            self.render()
+        return hook
+
+    def start_job(self, name):
+        with self._lock:
+            self.jobs[name] = {'downloaded': 0, 'total': 0, 'speed': 0, 'status': 'starting'}
+        self.render(force=True)
+
+    def finish_job(self, name, ok):
+        with self._lock:
+            self.jobs.pop(name, None)
+            self.done += 1
+            if not ok:
+                self.failed += 1
+        self.render(force=True)
+
+    def message(self, text):
+        with self._lock:
+            self.out.write(f"\r\033[K{text}\n")
+            self.out.flush()
+        self.render(force=True)
+
+    def summary(self):
+        with self._lock:
+            active = len(self.jobs)
+            downloaded = sum(job['downloaded'] for job in self.jobs.values())
+            speed = sum(job['speed'] for job in self.jobs.values())
+            percents = []
+            for name, job in list(self.jobs.items())[:4]:
+                if job['total']:
+                    percents.append(f"{name[-8:]} {100 * job['downloaded'] / job['total']:.0f}%")
+            line = (f"[{self.done}/{self.total_jobs} done, {self.failed} failed] {active} active | "
+                    f"{downloaded / 2**20:.1f} MiB @ {speed / 2**20:.2f} MiB/s")
+            if percents:
+                line += ' | ' + ' '.join(percents)
+            return line
+
+    def render(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_render < self.min_interval:
+            return
+        self._last_render = now
+        line = self.summary()
+        with self._lock:
+            self.out.write(f"\r\033[K{line}")
+            self.out.flush()
+
+
+class DownloadPool:
+    """Runs download jobs on a bounded worker pool with per-host limits and retries.
+
+    A job is (name, url, fn) where fn(progress_hook) returns truthy on success.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, sleep=time.sleep, out=None):
+        self.workers = max(1, workers)
+        self.limiter = HostLimiter(per_host)
+        self.retries = retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.out = out
+
+    def run(self, jobs):
+        """Run every job; returns {name: bool} once all of them finished or gave up."""
+        board = ProgressBoard(len(jobs), self.out)
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='download') as executor:
+            futures = {executor.submit(self._run_job, board, name, url, fn): name for name, url, fn in jobs}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = bool(future.result())
+                except Exception as e:
+                    board.message(f"{name}: failed: {e}")
+                    results[name] = False
+        board.out.write('\n')
+        return results
+
+    def _run_job(self, board, name, url, fn):
+        def attempt():
+            with self.limiter.slot(url):
+                board.start_job(name)  # Only counts as active once it holds a host slot
+                return fn(board.hook_for(name))
+
+        def on_retry(number, delay, error):
+            reason = f": {error}" if error else ''
+            board.message(f"{name}: attempt {number} failed{reason}; retrying in {delay:.1f}s")
+
+        ok = False
+        try:
+            ok = retry_with_backoff(attempt, self.retries, self.backoff, self.sleep, on_retry)
+            return ok
+        finally:
+            board.finish_job(name, bool(ok))
@@ -1,83 +1,37 @@
 #!/usr/bin/env python3
 import sys
-import sqlite3
 from pathlib import Path
 import os
+import time
 from yt_dlp import YoutubeDL
+from download_pool import DownloadPool, DEFAULT_PER_HOST, DEFAULT_RETRIES
+from metadata_db import connect, get_writer
 
-# Database setup
-DB_PATH = Path(__file__).parent / 'music_metadata.db'
-
-def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
-        # Albums/Playlists table (combined)
-        conn.execute('''CREATE TABLE IF NOT EXISTS albums
-                     (id TEXT PRIMARY KEY,
-                      title TEXT,
-                      artist TEXT,
-                      type TEXT CHECK(type IN ('album', 'playlist')),
-                      url TEXT)''')
-        
-        # Tracks table
-        conn.execute('''CREATE TABLE IF NOT EXISTS tracks
-                     (id TEXT PRIMARY KEY,
-                      title TEXT,
-                      album_id TEXT,
-                      position INTEGER,
-                      url TEXT,
-                      file_path TEXT,
-                      download_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                      FOREIGN KEY(album_id) REFERENCES albums(id))''')
-        
-        # Optional artists table
-        conn.execute('''CREATE TABLE IF NOT EXISTS artists
-                     (name TEXT PRIMARY KEY,
-                      description TEXT)''')
-        conn.commit()
-
-init_db()
+# Playlist manifests older than this are re-fetched before being trusted
+MANIFEST_MAX_AGE = 24 * 3600
 
 def store_metadata(info, file_path):
-    with sqlite3.connect(DB_PATH) as conn:
-        # Determine if this is a playlist or album
-        is_playlist = 'playlist_id' in info
-        album_id = info['playlist_id'] if is_playlist else f"manual_{info['id']}"
-        
-        # Insert album/playlist
-        conn.execute('''INSERT OR IGNORE INTO albums
-                     (id, title, artist, type, url)
-                     VALUES (?, ?, ?, ?, ?)''',
-                     (album_id,
-                      info.get('playlist_title') if is_playlist else info.get('album', 'Unknown Album'),
-                      info.get('artist'),
-                      'playlist' if is_playlist else 'album',
-                      info.get('webpage_url')))
-        
-        # Insert track
-        conn.execute('''INSERT OR REPLACE INTO tracks
-                     (id, title, album_id, position, url, file_path)
-                     VALUES (?, ?, ?, ?, ?, ?)''',
-                     (info['id'],
-                      info.get('title'),
-                      album_id,
-                      info.get('playlist_index', 1) if is_playlist else info.get('track_number', 1),
-                      info.get('webpage_url'),
-                      file_path))
-        
-        # Optional: Store artist separately
-        if artist := info.get('artist'):
-            conn.execute('''INSERT OR IGNORE INTO artists (name) VALUES (?)''', (artist,))
-        
-        conn.commit()
+    # Buffered: rows reach the DB in batches, and before anything reads them back
+    get_writer().add(info, file_path)
 
-def download_video(url, audio_only=False, format=None, download_path=None):
+def normalize_url(url):
     # Convert YouTube Music URLs to standard YouTube format
     if 'music.youtube.com' in url:
         url = url.replace('music.youtube.com', 'www.youtube.com')
+    return url
+
+def download_video(url, audio_only=False, format=None, download_path=None,
+                   ydl_factory=YoutubeDL, progress_hooks=None, extra_opts=None, verbose=True):
+    """Download url with yt-dlp and record its metadata. Returns True on success.
+
+    ydl_factory, progress_hooks and extra_opts let the concurrent downloader
+    swap in its own progress reporting (or a local stand-in for YoutubeDL).
+    """
+    url = normalize_url(url)
     
     # Configure yt-dlp options
     ydl_opts = {
-        'progress_hooks': [progress_hook],
+        'progress_hooks': progress_hooks or [progress_hook],
         'ignoreerrors': True,
         'extract_flat': False,
         'writethumbnail': True,
@@ -92,7 +46,8 @@ def download_video(url, audio_only=False, format=None, download_path=None):
     if download_path:
         outtmpl = f'{download_path}/{outtmpl}'
     else:
-        print("Debug: Using default music path with playlist/album folders")
+        if verbose:
+            print("Debug: Using default music path with playlist/album folders")
         outtmpl = str(Path(os.path.dirname(os.path.abspath(__file__))) / 'music' / outtmpl)
     
     if audio_only:
@@ -111,10 +66,14 @@ def download_video(url, audio_only=False, format=None, download_path=None):
         else:
             ydl_opts['format'] = 'bv*[ext=mp4]+ba[ext=m4a]/b[ext=mp4]/b/worst'
         ydl_opts['outtmpl'] = outtmpl
+    if extra_opts:
+        ydl_opts.update(extra_opts)
 
     try:
-        with YoutubeDL(ydl_opts) as ydl:
+        with ydl_factory(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=True)
+            if not info:
+                raise RuntimeError("no information extracted")
             
             # Store metadata for each track
             if 'entries' in info:  # Playlist
@@ -123,10 +82,16 @@ def download_video(url, audio_only=False, format=None, download_path=None):
                         store_metadata(entry, ydl.prepare_filename(entry))
             else:  # Single track
                 store_metadata(info, ydl.prepare_filename(info))
+            # One commit for the whole download, visible to the next missing-track check
+            get_writer().flush()
             
-        print("\nDownload completed successfully!")
+        if verbose:
+            print("\nDownload completed successfully!")
+        return True
     except Exception as e:
-        print(f"\nError downloading video: {str(e)}")
+        if verbose:
+            print(f"\nError downloading video: {str(e)}")
+        return False
 
 def progress_hook(d):
     if d['status'] == 'downloading':
@@ -136,45 +101,98 @@ def progress_hook(d):
     elif d['status'] == 'finished':
         print("\nDownload finished, now processing...")
 
-def is_playlist_downloaded(playlist_id):
-    """Check if a playlist is already fully downloaded"""
-    with sqlite3.connect(DB_PATH) as conn:
-        # Check if playlist exists in albums table
-        playlist_exists = conn.execute(
-            "SELECT 1 FROM albums WHERE id = ? AND type = 'playlist'",
-            (playlist_id,)
-        ).fetchone()
-        
-        if not playlist_exists:
-            return False
-            
-        # Check if all tracks are downloaded
-        track_count = conn.execute(
-            """SELECT COUNT(*) FROM tracks t
-               JOIN albums a ON t.album_id = a.id
-               WHERE a.id = ?""",
+def playlist_url(playlist_id):
+    return f"https://www.youtube.com/playlist?list={playlist_id}"
+
+def refresh_manifest(playlist_id, ydl_factory=YoutubeDL):
+    """Fetch a playlist's entry ids with flat extraction and cache them. Returns the count."""
+    with ydl_factory({'quiet': True, 'extract_flat': 'in_playlist'}) as ydl:
+        info = ydl.extract_info(playlist_url(playlist_id), download=False)
+    if not info:
+        raise RuntimeError(f"no information extracted for playlist {playlist_id}")
+    entries = [(playlist_id, position, entry['id'])
+               for position, entry in enumerate(info.get('entries') or [], 1)
+               if entry and entry.get('id')]
+    with connect() as conn:
+        conn.execute("DELETE FROM playlist_entries WHERE playlist_id = ?", (playlist_id,))
+        conn.executemany("INSERT INTO playlist_entries (playlist_id, position, entry_id) VALUES (?, ?, ?)",
+                         entries)
+        conn.execute("INSERT OR REPLACE INTO playlist_manifests (playlist_id, entry_count, fetched_at) "
+                     "VALUES (?, ?, ?)", (playlist_id, len(entries), time.time()))
+        conn.commit()
+    return len(entries)
+
+def missing_entries(playlist_id, ydl_factory=YoutubeDL, max_age=MANIFEST_MAX_AGE):
+    """Playlist positions (1-based) whose video isn't in the tracks table yet.
+
+    Uses the cached manifest while it is younger than max_age, so re-checking a
+    library of playlists costs one local query each and no network.
+    """
+    with connect() as conn:
+        row = conn.execute("SELECT fetched_at FROM playlist_manifests WHERE playlist_id = ?",
+                           (playlist_id,)).fetchone()
+    if row is None or time.time() - row[0] > max_age:
+        refresh_manifest(playlist_id, ydl_factory)
+    with connect() as conn:
+        rows = conn.execute(
+            """SELECT e.position FROM playlist_entries e
+               LEFT JOIN tracks t ON t.id = e.entry_id
+               WHERE e.playlist_id = ? AND t.id IS NULL
+               ORDER BY e.position""",
             (playlist_id,)
-        ).fetchone()[0]
-        
-        # Get expected track count from YouTube
-        with YoutubeDL({'quiet': True}) as ydl:
-            info = ydl.extract_info(
-                f"https://www.youtube.com/playlist?list={playlist_id}",
-                download=False
-            )
-            expected_count = len(info['entries']) if 'entries' in info else 0
-        
-        return track_count >= expected_count
-
-def download_missing_playlists(playlist_urls):
-    """Download only missing playlists from a list"""
-    for url in playlist_urls:
-        playlist_id = url.split('list=')[1]
-        if not is_playlist_downloaded(playlist_id):
-            print(f"Downloading missing playlist: {playlist_id}")
-            download_video(url, audio_only=True)
-        else:
-            print(f"Playlist {playlist_id} already downloaded")
+        ).fetchall()
+    return [position for position, in rows]
+
+def is_playlist_downloaded(playlist_id, ydl_factory=YoutubeDL, max_age=MANIFEST_MAX_AGE):
+    """Check if every track in a playlist's manifest is in the tracks table"""
+    return not missing_entries(playlist_id, ydl_factory, max_age)
+
+def download_playlist_items(url, positions, **kwargs):
+    """Download only the given 1-based playlist positions of url."""
+    extra_opts = dict(kwargs.pop('extra_opts', None) or {})
+    extra_opts['playlist_items'] = ','.join(str(position) for position in positions)
+    return download_video(url, audio_only=True, extra_opts=extra_opts, **kwargs)
+
+def download_missing_playlists(playlist_urls, workers=1, per_host=DEFAULT_PER_HOST,
+                               retries=DEFAULT_RETRIES, ydl_factory=YoutubeDL, max_age=MANIFEST_MAX_AGE):
+    """Download only the missing tracks of each playlist in a list
+
+    With workers > 1 the playlists are fetched on a bounded pool with per-host
+    limits, retries with backoff and one aggregated progress line.
+    """
+    if workers <= 1:
+        for url in playlist_urls:
+            playlist_id = url.split('list=')[1]
+            try:
+                missing = missing_entries(playlist_id, ydl_factory, max_age)
+            except Exception as e:
+                print(f"Could not fetch playlist {playlist_id}: {e}")
+                continue
+            if missing:
+                print(f"Downloading {len(missing)} missing tracks of playlist: {playlist_id}")
+                download_playlist_items(url, missing, ydl_factory=ydl_factory)
+            else:
+                print(f"Playlist {playlist_id} already downloaded")
+        return
+
+    def job(url, playlist_id):
+        def run(progress_hook):
+            missing = missing_entries(playlist_id, ydl_factory, max_age)
+            if not missing:
+                return True
+            # yt-dlp's own console output would interleave across workers
+            return download_playlist_items(url, missing, ydl_factory=ydl_factory,
+                                           progress_hooks=[progress_hook],
+                                           extra_opts={'quiet': True, 'noprogress': True},
+                                           verbose=False)
+        return playlist_id, normalize_url(url), run
+
+    pool = DownloadPool(workers=workers, per_host=per_host, retries=retries)
+    results = pool.run([job(url, url.split('list=')[1]) for url in playlist_urls])
+    failed = [playlist_id for playlist_id, ok in results.items() if not ok]
+    print(f"Downloaded or verified {len(results) - len(failed)}/{len(results)} playlists")
+    for playlist_id in failed:
+        print(f"Failed: {playlist_id}")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2 or len(sys.argv) > 5:
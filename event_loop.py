@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import collections
+import heapq
+import itertools
+import os
+import selectors
+import threading
+import time
+
+
+class Timer:
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    """A small selectors-based loop: fd callbacks, timers and thread-safe wakeups.
+
+    Everything the player reacts to (keys, decoder status lines, child exit,
+    render ticks) is a callback on this loop, so nothing sleeps or polls; the
+    process only wakes when one of those actually happens.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.running = False
+        self.on_lag = None  # Called with how late each timer ran, in seconds
+        self._timers = []
+        self._counter = itertools.count()  # Tie-breaker so timers never compare callbacks
+        self._ready = collections.deque()
+        self._ready_lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, self._drain_wakeups)
+
+    def add_reader(self, fd, callback, *args):
+        self.selector.register(fd, selectors.EVENT_READ, lambda: callback(*args))
+
+    def remove_reader(self, fd):
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+    def add_writer(self, fd, callback, *args):
+        # An fd is watched for reading or for writing, not both at once
+        self.selector.register(fd, selectors.EVENT_WRITE, lambda: callback(*args))
+
+    def remove_writer(self, fd):
+        self.remove_reader(fd)
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(time.monotonic() + delay, callback, args)
+        heapq.heappush(self._timers, (timer.when, next(self._counter), timer))
+        return timer
+
+    def call_soon(self, callback, *args):
+        return self.call_later(0, callback, *args)
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Schedule callback from any thread and wake the loop."""
+        with self._ready_lock:
+            self._ready.append((callback, args))
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            pass  # Pipe already full of wakeups; the loop is going to run anyway
+
+    def watch_process(self, process, callback):
+        """Call callback() once process exits. Uses a pidfd where the kernel supports it.
+
+        Returns False if no pidfd is available; callers then rely on their pipes hitting EOF.
+        """
+        if not hasattr(os, 'pidfd_open'):
+            return False
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except OSError:
+            return False
+
+        def on_exit():
+            self.remove_reader(pidfd)
+            os.close(pidfd)
+            process.poll()  # Reap it so it doesn't linger as a zombie
+            callback()
+        self.add_reader(pidfd, on_exit)
+        return True
+
+    def stop(self):
+        self.running = False
+        self.call_soon_threadsafe(lambda: None)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            timeout = None
+            while self._timers and self._timers[0][2].cancelled:
+                heapq.heappop(self._timers)
+            if self._ready:
+                timeout = 0
+            elif self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+
+            for key, _ in self.selector.select(timeout):
+                key.data()
+                if not self.running:
+                    return
+
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, timer = heapq.heappop(self._timers)
+                if not timer.cancelled:
+                    if self.on_lag:
+                        self.on_lag(now - timer.when)
+                    timer.callback(*timer.args)
+                if not self.running:
+                    return
+
+            with self._ready_lock:
+                ready, self._ready = self._ready, collections.deque()
+            for callback, args in ready:
+                callback(*args)
+                if not self.running:
+                    return
+
+    def close(self):
+        self.selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _drain_wakeups(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class LineReader:
+    """Feeds complete lines from a non-blocking pipe to a callback on the loop."""
+
+    def __init__(self, loop, pipe, on_line, on_eof):
+        self.loop = loop
+        self.fd = pipe.fileno()
+        self.on_line = on_line
+        self.on_eof = on_eof
+        self._buffer = b''
+        os.set_blocking(self.fd, False)
+        loop.add_reader(self.fd, self._readable)
+
+    def _readable(self):
+        try:
+            chunk = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self.loop.remove_reader(self.fd)
+            self.on_eof()
+            return
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b'\n')
+        for line in lines:
+            self.on_line(line.decode('utf-8', errors='replace'))
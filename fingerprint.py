@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from library_index import LibraryIndex
+from metadata_db import connect
+
+FFMPEG_CMD = 'ffmpeg'
+MUSIC_DIR = str(Path(__file__).parent / 'music')
+RATE = 11025
+SECONDS = 60             # Fingerprint the start of each track; copies of a song agree there too
+FRAME = 2048             # ~186 ms analysis window
+HOP = 256                # ~23 ms: copies never line up worse than half of this
+BAND_EDGES = np.geomspace(300, 2000, 34)  # 33 log-spaced bands -> 32 bits per frame
+SILENCE = 1e-6           # Mean frame power below which a frame isn't indexed
+INDEX_SAMPLE = 4         # Index about one sub-fingerprint in this many, chosen by value
+MAX_POSTINGS = 32        # Values shared by more tracks than this say nothing about any of them
+MIN_VOTES = 2            # Index hits at one alignment needed before two tracks are compared
+MIN_OVERLAP = 512        # Frames (~12 s) two fingerprints must overlap to be compared
+DUPLICATE_BER = 0.20     # Same recording, re-encoded and at worst half a hop out of step
+NEAR_BER = 0.35          # Haitsma & Kalker's threshold for "same song"
+BATCH = 50
+
+_BAND_BINS = np.round(BAND_EDGES * FRAME / RATE).astype(int)
+_WINDOW = np.hanning(FRAME).astype(np.float32)
+_BIT_WEIGHTS = (1 << np.arange(32, dtype=np.uint64))
+
+
+def decode(file_path, ffmpeg_cmd=FFMPEG_CMD):
+    """The first SECONDS of file_path as mono float32 at RATE, or None if ffmpeg can't read it."""
+    result = subprocess.run([ffmpeg_cmd, '-nostdin', '-v', 'error', '-t', str(SECONDS), '-i', file_path,
+                             '-f', 'f32le', '-ac', '1', '-ar', str(RATE), '-'],
+                            stdin=subprocess.DEVNULL, capture_output=True)
+    if result.returncode != 0 or not result.stdout:
+        return None
+    data = result.stdout
+    return np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+
+
+def fingerprint_samples(samples):
+    """(sub-fingerprints as uint32, mask of frames loud enough to index) for mono PCM at RATE.
+
+    Each frame's 33 band energies give 32 bits: whether the energy difference between
+    neighbouring bands grew or shrank since the previous frame (Haitsma & Kalker).
+    Signs of differences survive re-encoding, resampling and gain changes.
+    """
+    if len(samples) < FRAME + HOP:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=bool)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME)[::HOP]
+    power = np.abs(np.fft.rfft(frames * _WINDOW, axis=1)) ** 2
+    # Bucket i sums the bins from edge i up to edge i + 1; the last bucket runs on to Nyquist and is dropped
+    bands = np.add.reduceat(power, _BAND_BINS, axis=1)[:, :-1]
+    differences = bands[:, :-1] - bands[:, 1:]
+    bits = (differences[1:] - differences[:-1]) > 0
+    values = (bits.astype(np.uint64) @ _BIT_WEIGHTS).astype(np.uint32)
+    loud = (frames[1:] ** 2).mean(axis=1) > SILENCE
+    return values, loud
+
+
+def index_positions(values, loud):
+    """Offsets of the sub-fingerprints that go into the hash index, at most one per value.
+
+    Sampling by value rather than by position means two copies of a song keep the
+    same subset whatever their alignment.
+    """
+    mixed = (values.astype(np.uint64) * 0x9E3779B1) & 0xFFFFFFFF
+    keep = np.flatnonzero(loud & (mixed < (1 << 32) // INDEX_SAMPLE))
+    _, first = np.unique(values[keep], return_index=True)
+    return np.sort(keep[first])
+
+
+def fingerprint_file(file_path):
+    """Sub-fingerprint bytes for one file, or None if it can't be decoded."""
+    samples = decode(file_path)
+    if samples is None:
+        return None
+    values, loud = fingerprint_samples(samples)
+    return values.tobytes(), index_positions(values, loud).tobytes()
+
+
+def _fingerprint_job(args):
+    rel_path, abs_path = args
+    try:
+        return rel_path, fingerprint_file(abs_path)
+    except Exception:
+        return rel_path, None
+
+
+def update_fingerprints(music_dir=MUSIC_DIR, workers=None, db_path=None, out=None):
+    """Fingerprint files that are new or changed and forget removed ones; returns the number done."""
+    out = out or sys.stdout
+    with LibraryIndex(music_dir) as index:
+        index.scan()
+        stats = {path: (size, mtime_ns) for path, size, mtime_ns in index.current_stats()}
+        abspath = index.abspath
+    conn = connect(db_path)
+    known = {path: (track, (size, mtime_ns)) for track, path, size, mtime_ns
+             in conn.execute('SELECT id, path, size, mtime_ns FROM fingerprints')}
+    removed = [track for path, (track, _) in known.items() if path not in stats]
+    if removed:
+        with conn:
+            conn.executemany('DELETE FROM fingerprint_hashes WHERE track = ?', [(t,) for t in removed])
+            conn.executemany('DELETE FROM fingerprints WHERE id = ?', [(t,) for t in removed])
+    todo = [path for path, stat in stats.items() if path not in known or known[path][1] != stat]
+    if not todo:
+        conn.close()
+        print("Fingerprints are up to date", file=out)
+        return 0
+
+    start = time.perf_counter()
+    pending = []
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_fingerprint_job, (path, abspath(path))) for path in todo]
+        for future in as_completed(futures):
+            rel_path, result = future.result()
+            done += 1
+            if result is None:
+                print(f"\r\033[KCould not decode {rel_path}", file=out)
+                continue
+            pending.append((rel_path, stats[rel_path], result))
+            if len(pending) >= BATCH:
+                _store(conn, pending)
+            out.write(f"\r\033[KFingerprinted {done}/{len(todo)}")
+            out.flush()
+    _store(conn, pending)
+    conn.close()
+    print(f"\r\033[KFingerprinted {done} files in {time.perf_counter() - start:.1f}s", file=out)
+    return done
+
+
+def _store(conn, pending):
+    with conn:
+        for rel_path, (size, mtime_ns), (values, positions) in pending:
+            track = conn.execute('''INSERT INTO fingerprints (path, size, mtime_ns, fingerprint)
+                                 VALUES (?, ?, ?, ?)
+                                 ON CONFLICT(path) DO UPDATE SET size = excluded.size,
+                                     mtime_ns = excluded.mtime_ns, fingerprint = excluded.fingerprint
+                                 RETURNING id''', (rel_path, size, mtime_ns, values)).fetchone()[0]
+            conn.execute('DELETE FROM fingerprint_hashes WHERE track = ?', (track,))
+            fingerprint = np.frombuffer(values, dtype=np.uint32)
+            conn.executemany('INSERT OR IGNORE INTO fingerprint_hashes (hash, track, offset) VALUES (?, ?, ?)',
+                             ((int(fingerprint[i]), track, int(i))
+                              for i in np.frombuffer(positions, dtype=np.int64)))
+    pending.clear()
+
+
+def candidate_pairs(conn, min_votes=MIN_VOTES, max_postings=MAX_POSTINGS):
+    """{(track, other): shift} for pairs sharing indexed values at a consistent alignment.
+
+    One pass over the hash index: the work grows with the number of tracks times
+    max_postings, not with the number of pairs of tracks.
+    """
+    best = {}
+    rows = conn.execute('''SELECT a.track, b.track, b.offset - a.offset AS shift, COUNT(*) AS votes
+                        FROM fingerprint_hashes a
+                        JOIN fingerprint_hashes b ON b.hash = a.hash AND b.track > a.track
+                        WHERE a.hash IN (SELECT hash FROM fingerprint_hashes
+                                         GROUP BY hash HAVING COUNT(*) <= ?)
+                        GROUP BY a.track, b.track, shift
+                        HAVING votes >= ?''', (max_postings, min_votes))
+    for track, other, shift, votes in rows:
+        if votes > best.get((track, other), (0, 0))[1]:
+            best[(track, other)] = (shift, votes)
+    return {pair: shift for pair, (shift, _) in best.items()}
+
+
+def bit_error_rate(a, b, shift):
+    """Fraction of differing bits with b[i + shift] lined up against a[i], or None if they barely overlap."""
+    a = a[max(0, -shift):]
+    b = b[max(0, shift):]
+    n = min(len(a), len(b))
+    if n < MIN_OVERLAP:
+        return None
+    return float(np.unpackbits(np.bitwise_xor(a[:n], b[:n]).view(np.uint8)).sum()) / (32 * n)
+
+
+def find_duplicates(conn, threshold=NEAR_BER):
+    """Groups of tracks that are the same song: [(worst BER in the group, [relative paths])]."""
+    pairs = candidate_pairs(conn)
+    fingerprints = {}
+
+    def load(track):
+        if track not in fingerprints:
+            row = conn.execute('SELECT fingerprint FROM fingerprints WHERE id = ?', (track,)).fetchone()
+            fingerprints[track] = np.frombuffer(row[0], dtype=np.uint32)
+        return fingerprints[track]
+
+    parent = {}
+
+    def root(track):
+        parent.setdefault(track, track)
+        while parent[track] != track:
+            parent[track] = parent[parent[track]]
+            track = parent[track]
+        return track
+
+    worst = {}
+    matches = []
+    for (track, other), shift in pairs.items():
+        ber = bit_error_rate(load(track), load(other), shift)
+        if ber is not None and ber <= threshold:
+            matches.append((track, other, ber))
+            parent[root(other)] = root(track)
+    for track, other, ber in matches:
+        group = root(track)
+        worst[group] = max(worst.get(group, 0.0), ber)
+
+    members = defaultdict(list)
+    for track in parent:
+        members[root(track)].append(track)
+    paths = dict(conn.execute('SELECT id, path FROM fingerprints'))
+    groups = [(worst.get(group, 0.0), sorted(paths[t] for t in tracks)) for group, tracks in members.items()]
+    return sorted(groups, key=lambda group: (group[0], group[1]))
+
+
+def link_duplicates(groups, music_dir=MUSIC_DIR, threshold=DUPLICATE_BER, dry_run=False, out=None):
+    """Hard-link each copy in a duplicate group to its largest member; returns bytes reclaimed.
+
+    Only groups no worse than threshold are linked, so live versions and remasters
+    (near-duplicates) are left alone, and only files with the same extension, so a
+    path keeps holding the format its name says.
+    """
+    out = out or sys.stdout
+    reclaimed = 0
+    for ber, paths in groups:
+        if ber > threshold:
+            continue
+        by_ext = defaultdict(list)
+        for rel_path in paths:
+            by_ext[os.path.splitext(rel_path)[1].lower()].append(os.path.join(music_dir, rel_path))
+        for copies in by_ext.values():
+            if len(copies) < 2:
+                continue
+            try:
+                stats = {path: os.stat(path) for path in copies}
+            except OSError as e:
+                print(f"Skipping {copies[0]}: {e}", file=out)
+                continue
+            keep = max(copies, key=lambda path: (stats[path].st_size, path))
+            for path in copies:
+                st, kept = stats[path], stats[keep]
+                if path == keep or (st.st_ino == kept.st_ino and st.st_dev == kept.st_dev):
+                    continue
+                print(f"{'Would link' if dry_run else 'Linking'} {path} -> {keep}", file=out)
+                if dry_run:
+                    reclaimed += st.st_size
+                    continue
+                temp = path + '.link'
+                try:
+                    # Link beside the copy, then rename over it, so the path never goes missing
+                    os.link(keep, temp)
+                    os.replace(temp, path)
+                    reclaimed += st.st_size
+                except OSError as e:
+                    print(f"Could not link {path}: {e}", file=out)
+                    if os.path.exists(temp):
+                        os.remove(temp)
+    return reclaimed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find songs stored more than once, by acoustic fingerprint")
+    parser.add_argument('music_dir', nargs='?', default=MUSIC_DIR)
+    parser.add_argument('--workers', type=int, help="decoding processes (default: one per CPU)")
+    parser.add_argument('--link', action='store_true',
+                        help=f"hard-link duplicates (bit error rate <= {DUPLICATE_BER}) to one copy")
+    parser.add_argument('--dry-run', action='store_true', help="with --link, only show what would be linked")
+    args = parser.parse_args()
+
+    update_fingerprints(args.music_dir, args.workers)
+    start = time.perf_counter()
+    with connect() as conn:
+        groups = find_duplicates(conn)
+    elapsed = time.perf_counter() - start
+    for ber, paths in groups:
+        kind = 'Duplicates' if ber <= DUPLICATE_BER else 'Near-duplicates'
+        print(f"\n{kind} (bit error rate {ber:.3f}):")
+        for rel_path in paths:
+            print(f"  {rel_path}")
+    print(f"\n{len(groups)} group(s) of the same song found in {elapsed:.2f}s")
+
+    if args.link and groups:
+        reclaimed = link_duplicates(groups, os.path.abspath(args.music_dir), dry_run=args.dry_run)
+        print(f"{'Would reclaim' if args.dry_run else 'Reclaimed'} {reclaimed / 2**20:.1f} MiB")
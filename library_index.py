@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+import os
+import random
+import sys
+import sqlite3
+import time
+from pathlib import Path
+
+# The index lives next to music_metadata.db so restarts don't have to walk the tree
+INDEX_DB_PATH = Path(__file__).parent / 'library_index.db'
+SUPPORTED_FORMATS = ('.mp3', '.wav', '.ogg', '.flac', '.m4a', '.aac')
+# Written by the player (shuffle.PlayStats); keyed by path so scan() can carry it across renames
+PLAY_STATS_SCHEMA = '''CREATE TABLE IF NOT EXISTS play_stats
+                    (path TEXT PRIMARY KEY,
+                     plays INTEGER,
+                     last_played INTEGER)'''
+
+
+def locate_audio_file(path):
+    """path if it exists, else the same name with another supported extension, else None.
+
+    Downloads are recorded under their pre-conversion name (e.g. .webm), so the file
+    on disk usually has a different extension than music_metadata.db says.
+    """
+    if not path:
+        return None
+    if os.path.exists(path):
+        return path
+    stem = os.path.splitext(path)[0]
+    return next((stem + ext for ext in SUPPORTED_FORMATS if os.path.exists(stem + ext)), None)
+
+
+class LibraryIndex:
+    """Persistent, incrementally rescanned index of the audio files under a music directory.
+
+    Paths are stored relative to the music directory. A rescan only lists directories
+    whose mtime changed since the last run; unchanged directories cost a single stat.
+    """
+
+    def __init__(self, music_dir, db_path=INDEX_DB_PATH):
+        self.music_dir = os.path.abspath(music_dir)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.init_db()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def init_db(self):
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS dirs
+                              (path TEXT PRIMARY KEY,
+                               parent TEXT,
+                               mtime_ns INTEGER)''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS files
+                              (path TEXT PRIMARY KEY,
+                               dir TEXT,
+                               size INTEGER,
+                               mtime_ns INTEGER,
+                               inode INTEGER)''')
+            # Changes recorded by each rescan (added/removed/renamed)
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS changes
+                              (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                               scan_time REAL,
+                               kind TEXT CHECK(kind IN ('added', 'removed', 'renamed')),
+                               path TEXT,
+                               old_path TEXT)''')
+            self.conn.execute(PLAY_STATS_SCHEMA)
+            self.conn.execute('CREATE INDEX IF NOT EXISTS files_dir ON files(dir)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS files_inode ON files(inode)')
+
+    def abspath(self, rel_path):
+        return os.path.join(self.music_dir, rel_path) if rel_path else self.music_dir
+
+    def files(self):
+        """Return absolute paths of every indexed file, without touching the filesystem."""
+        prefix = self.music_dir + os.sep
+        return [prefix + row[0] for row in self.conn.execute('SELECT path FROM files ORDER BY path')]
+
+    def file_stats(self):
+        """(relative path, size, mtime_ns) for every indexed file, without touching the filesystem."""
+        return self.conn.execute('SELECT path, size, mtime_ns FROM files ORDER BY path').fetchall()
+
+    def current_stats(self):
+        """file_stats() with every file stat'ed again, for tools that must notice in-place rewrites.
+
+        scan() only re-lists directories whose mtime moved, and rewriting a file doesn't
+        move it. Rows that drifted are corrected; files that vanished are left to scan().
+        """
+        stats = []
+        drifted = []
+        for path, size, mtime_ns in self.file_stats():
+            try:
+                st = os.stat(self.abspath(path))
+            except OSError:
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                drifted.append((st.st_size, st.st_mtime_ns, st.st_ino, path))
+            stats.append((path, st.st_size, st.st_mtime_ns))
+        if drifted:
+            with self.conn:
+                self.conn.executemany('UPDATE files SET size = ?, mtime_ns = ?, inode = ? WHERE path = ?', drifted)
+        return stats
+
+    def is_empty(self):
+        return self.conn.execute('SELECT 1 FROM dirs LIMIT 1').fetchone() is None
+
+    def find_file(self, size, inode):
+        """Absolute path of the indexed file with this size and inode, e.g. after a rename; None if none."""
+        row = self.conn.execute('SELECT path FROM files WHERE inode = ? AND size = ? LIMIT 1',
+                                (inode, size)).fetchone()
+        return self.abspath(row[0]) if row else None
+
+    def sample_files(self, count):
+        """Up to count distinct absolute paths picked at random, in O(count log n) rather than a table scan."""
+        top = self.conn.execute('SELECT MAX(rowid) FROM files').fetchone()[0]
+        if top is None:
+            return []
+        picked = {}
+        for _ in range(count * 2):  # Deleted rows leave gaps; a few retries fill the sample anyway
+            row = self.conn.execute('SELECT path FROM files WHERE rowid >= ? ORDER BY rowid LIMIT 1',
+                                    (random.randint(1, top),)).fetchone()
+            if row:
+                picked[row[0]] = None
+            if len(picked) >= count:
+                break
+        return [self.abspath(path) for path in picked]
+
+    def scan(self, on_found=None):
+        """Bring the index up to date and return the list of (kind, path, old_path) changes.
+
+        on_found, if given, is called with the relative paths of new files in each
+        directory as soon as it has been listed, long before the index is written.
+        """
+        known_dirs = dict(self.conn.execute('SELECT path, mtime_ns FROM dirs'))
+        added = {}    # rel_path -> (dir, size, mtime_ns, inode)
+        removed = {}  # rel_path -> (size, inode)
+        dir_updates = []
+        dropped_dirs = []
+
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                st = os.stat(self.abspath(rel_dir))
+            except OSError:
+                # Vanished between listing its parent and now; the parent's listing drops it
+                continue
+
+            if known_dirs.get(rel_dir) == st.st_mtime_ns:
+                stack.extend(row[0] for row in self.conn.execute(
+                    'SELECT path FROM dirs WHERE parent = ?', (rel_dir,)))
+                continue
+
+            # Directory is new or changed: list it and diff against what we had
+            known_files = {row[0]: (row[1], row[2]) for row in self.conn.execute(
+                'SELECT path, size, inode FROM files WHERE dir = ?', (rel_dir,))}
+            known_subdirs = {row[0] for row in self.conn.execute(
+                'SELECT path FROM dirs WHERE parent = ?', (rel_dir,))}
+            seen_subdirs = set()
+            new_files = []
+            try:
+                entries = list(os.scandir(self.abspath(rel_dir)))
+            except OSError:
+                continue
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                try:
+                    if entry.is_dir():
+                        # Links to directories aren't followed, as os.walk didn't: they'd
+                        # index the same files twice, or forever if they point back up
+                        if not entry.is_symlink():
+                            seen_subdirs.add(rel_path)
+                            stack.append(rel_path)
+                    elif entry.name.lower().endswith(SUPPORTED_FORMATS):
+                        if known_files.pop(rel_path, None) is None:
+                            fst = entry.stat()
+                            added[rel_path] = (rel_dir, fst.st_size, fst.st_mtime_ns, fst.st_ino)
+                            new_files.append(rel_path)
+                except OSError:
+                    continue
+            if on_found and new_files:
+                on_found(new_files)
+            removed.update(known_files)
+            for gone in known_subdirs - seen_subdirs:
+                dropped_dirs.append(gone)
+            dir_updates.append((rel_dir, self._parent(rel_dir), st.st_mtime_ns))
+
+        # Whole subtrees that disappeared
+        for gone in dropped_dirs:
+            pattern = self._like_prefix(gone)
+            removed.update({row[0]: (row[1], row[2]) for row in self.conn.execute(
+                "SELECT path, size, inode FROM files WHERE dir = ? OR dir LIKE ? ESCAPE '\\'",
+                (gone, pattern))})
+
+        changes = self._match_renames(added, removed)
+
+        with self.conn:
+            for gone in dropped_dirs:
+                self.conn.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                                  (gone, self._like_prefix(gone)))
+            self.conn.executemany('DELETE FROM files WHERE path = ?', ((p,) for p in removed))
+            self.conn.executemany('INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)',
+                                  dir_updates)
+            self.conn.executemany('''INSERT OR REPLACE INTO files (path, dir, size, mtime_ns, inode)
+                                  VALUES (?, ?, ?, ?, ?)''',
+                                  ((p,) + meta for p, meta in added.items()))
+            # Stats of removed files are kept: they apply again if the file comes back
+            self.conn.executemany('UPDATE OR REPLACE play_stats SET path = ? WHERE path = ?',
+                                  ((path, old_path) for kind, path, old_path in changes if kind == 'renamed'))
+            now = time.time()
+            self.conn.executemany('INSERT INTO changes (scan_time, kind, path, old_path) VALUES (?, ?, ?, ?)',
+                                  ((now,) + change for change in changes))
+        return changes
+
+    def changes_since(self, since=0):
+        return self.conn.execute(
+            'SELECT scan_time, kind, path, old_path FROM changes WHERE scan_time > ? ORDER BY id',
+            (since,)).fetchall()
+
+    @staticmethod
+    def _match_renames(added, removed):
+        # A file that vanished and reappeared with the same inode and size was renamed or moved
+        by_identity = {(size, inode): path for path, (size, inode) in removed.items()}
+        changes = []
+        for path, (_, size, _, inode) in added.items():
+            old_path = by_identity.pop((size, inode), None)
+            if old_path is not None:
+                changes.append(('renamed', path, old_path))
+            else:
+                changes.append(('added', path, None))
+        renamed_from = {change[2] for change in changes if change[0] == 'renamed'}
+        changes.extend(('removed', path, None) for path in removed if path not in renamed_from)
+        return changes
+
+    @staticmethod
+    def _parent(rel_dir):
+        return os.path.dirname(rel_dir) if rel_dir else None
+
+    @staticmethod
+    def _like_prefix(rel_dir):
+        escaped = rel_dir.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return escaped + os.sep + '%'
+
+
+if __name__ == "__main__":
+    music_dir = sys.argv[1] if len(sys.argv) > 1 else str(Path(__file__).parent / 'music')
+    if not Path(music_dir).is_dir():
+        print(f"ERROR: Music directory does not exist: {music_dir}")
+        sys.exit(1)
+
+    with LibraryIndex(music_dir) as index:
+        start = time.time()
+        changes = index.scan()
+        elapsed = time.time() - start
+        for kind, path, old_path in changes:
+            print(f"{kind:8} {old_path + ' -> ' if old_path else ''}{path}")
+        print(f"Indexed {len(index.files())} files in {elapsed:.2f}s ({len(changes)} changes)")
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+import argparse
+import math
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from library_index import LibraryIndex
+from loudness_gains import gain_db
+from metadata_db import connect
+
+FFMPEG_CMD = 'ffmpeg'
+MUSIC_DIR = str(Path(__file__).parent / 'music')
+RATE = 48000             # BS.1770's K-weighting coefficients are specified at 48 kHz
+SUB_BLOCK = RATE // 10   # 100 ms; a gating block is four of these (400 ms, 75% overlap)
+CHUNK = SUB_BLOCK * 50   # Samples filtered per FFT: 5 s
+IR_LENGTH = 8192         # The K-filter's impulse response is below -150 dB by then
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+OVERSAMPLE = 4
+# Block loudness histogram kept per track, so album loudness never needs re-decoding
+HIST_MIN, HIST_MAX, HIST_STEP = -70.0, 10.0, 0.1
+HIST_BINS = int((HIST_MAX - HIST_MIN) / HIST_STEP)
+BATCH = 50
+
+# ITU-R BS.1770-4 K-weighting: a high shelf followed by a high-pass, as (b, a) at 48 kHz
+K_SHELF = ((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585))
+K_HIGHPASS = ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621))
+
+
+def _biquad_impulse_response(stages, length):
+    # Only IR_LENGTH samples, once per process; the audio itself is filtered by FFT convolution
+    signal = [0.0] * length
+    signal[0] = 1.0
+    for (b0, b1, b2), (_, a1, a2) in stages:
+        out = [0.0] * length
+        x1 = x2 = y1 = y2 = 0.0
+        for n, x in enumerate(signal):
+            y = b0 * x + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+            out[n] = y
+            x2, x1, y2, y1 = x1, x, y1, y
+        signal = out
+    return np.array(signal)
+
+
+_FFT_SIZE = 1 << (CHUNK + IR_LENGTH - 1).bit_length()
+_K_SPECTRUM = np.fft.rfft(_biquad_impulse_response((K_SHELF, K_HIGHPASS), IR_LENGTH), _FFT_SIZE)
+
+
+def _oversampling_phases():
+    # Windowed-sinc interpolator split into OVERSAMPLE polyphase branches of 12 taps
+    taps = 12 * OVERSAMPLE
+    n = np.arange(taps) - (taps - 1) / 2
+    h = np.sinc(n / OVERSAMPLE) * np.kaiser(taps, 8.0)
+    phases = [h[p::OVERSAMPLE] for p in range(OVERSAMPLE)]
+    return [phase / phase.sum() for phase in phases]
+
+
+_PHASES = _oversampling_phases()
+
+
+def block_loudness(powers):
+    return -0.691 + 10 * np.log10(np.maximum(powers, 1e-20))
+
+
+def gated_loudness(powers):
+    """Integrated loudness (LUFS) of per-block channel-summed mean squares, with both gates."""
+    powers = powers[block_loudness(powers) > ABSOLUTE_GATE]
+    if len(powers) == 0:
+        return None
+    threshold = block_loudness(powers.mean()) + RELATIVE_GATE
+    gated = powers[block_loudness(powers) > threshold]
+    return float(block_loudness(gated.mean())) if len(gated) else None
+
+
+def histogram_of(powers):
+    bins = np.floor((block_loudness(powers) - HIST_MIN) / HIST_STEP).astype(np.int64)
+    bins = bins[(bins >= 0) & (bins < HIST_BINS)]
+    return np.bincount(bins, minlength=HIST_BINS).astype(np.uint32)
+
+
+def histogram_loudness(histogram):
+    """gated_loudness() from a block histogram, e.g. the sum of an album's tracks."""
+    centres = HIST_MIN + (np.arange(HIST_BINS) + 0.5) * HIST_STEP
+    return gated_loudness(np.repeat(10 ** ((centres + 0.691) / 10), histogram.astype(np.int64)))
+
+
+def decode(file_path, ffmpeg_cmd=FFMPEG_CMD):
+    """Yield (2, n) float32 chunks of the file at 48 kHz."""
+    process = subprocess.Popen([ffmpeg_cmd, '-nostdin', '-v', 'error', '-i', file_path,
+                                '-f', 'f32le', '-ac', '2', '-ar', str(RATE), '-'],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        chunk_bytes = CHUNK * 2 * 4
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if len(data) < 8:
+                break
+            samples = np.frombuffer(data[:len(data) - len(data) % 8], dtype=np.float32)
+            yield samples.reshape(-1, 2).T
+    finally:
+        process.kill()
+        process.stdout.close()
+        process.wait()
+
+
+def analyze_file(file_path):
+    """(integrated LUFS, true peak dBTP, histogram bytes) for one file, or None if it can't be decoded.
+
+    K-weighting is an FFT convolution with the filter's impulse response (overlap-add
+    across chunks), and the gating and oversampled peak search are array operations,
+    so memory stays at a few chunks whatever the track length.
+    """
+    tail = np.zeros((2, IR_LENGTH - 1))
+    sub_blocks = []
+    leftover = np.zeros((2, 0))
+    peak = 0.0
+    decoded = False
+    for chunk in decode(file_path):
+        decoded = True
+        n = chunk.shape[1]
+        filtered = np.fft.irfft(np.fft.rfft(chunk, _FFT_SIZE) * _K_SPECTRUM, _FFT_SIZE)[:, :n + IR_LENGTH - 1]
+        filtered[:, :IR_LENGTH - 1] += tail
+        tail = filtered[:, n:].copy()
+        squared = np.concatenate([leftover, filtered[:, :n] ** 2], axis=1)
+        whole = squared.shape[1] // SUB_BLOCK * SUB_BLOCK
+        sub_blocks.append(squared[:, :whole].reshape(2, -1, SUB_BLOCK).mean(axis=2).sum(axis=0))
+        leftover = squared[:, whole:]
+
+        peak = max(peak, float(np.abs(chunk).max()))
+        for channel in chunk:
+            for phase in _PHASES:
+                peak = max(peak, float(np.abs(np.convolve(channel, phase, 'same')).max()))
+    if not decoded:
+        return None
+
+    sub_blocks = np.concatenate(sub_blocks) if sub_blocks else np.zeros(0)
+    if len(sub_blocks) >= 4:
+        windows = np.lib.stride_tricks.sliding_window_view(sub_blocks, 4)
+        powers = windows.mean(axis=1)
+    else:
+        powers = np.zeros(0)
+    integrated = gated_loudness(powers)
+    true_peak = 20 * math.log10(peak) if peak > 0 else -math.inf
+    return integrated, true_peak, histogram_of(powers).tobytes()
+
+
+def _analyze_job(args):
+    rel_path, abs_path = args
+    try:
+        return rel_path, analyze_file(abs_path)
+    except Exception:
+        return rel_path, None
+
+
+def analyze_library(music_dir=MUSIC_DIR, workers=None, db_path=None, out=None):
+    """Analyze files that are new or changed since the last run; returns the number analyzed."""
+    out = out or sys.stdout
+    with LibraryIndex(music_dir) as index:
+        index.scan()
+        stats = {path: (size, mtime_ns) for path, size, mtime_ns in index.current_stats()}
+        abspath = index.abspath
+    conn = connect(db_path)
+    known = {path: (size, mtime_ns) for path, size, mtime_ns
+             in conn.execute('SELECT path, size, mtime_ns FROM loudness')}
+    todo = [path for path, stat in stats.items() if known.get(path) != stat]
+    if not todo:
+        print("Loudness is up to date", file=out)
+        return 0
+
+    start = time.perf_counter()
+    albums = set()
+    pending = []
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_analyze_job, (path, abspath(path))) for path in todo]
+        for future in as_completed(futures):
+            rel_path, result = future.result()
+            done += 1
+            if result is None:
+                # Recorded without loudness so an unchanged file isn't decoded again on every run
+                print(f"\r\033[KCould not decode {rel_path}", file=out)
+                result = (None, None, None)
+            integrated, true_peak, histogram = result
+            size, mtime_ns = stats[rel_path]
+            album = os.path.dirname(rel_path)
+            albums.add(album)
+            pending.append((rel_path, album, size, mtime_ns, integrated,
+                            true_peak if true_peak is not None and math.isfinite(true_peak) else None,
+                            histogram, time.time()))
+            if len(pending) >= BATCH:
+                _store(conn, pending)
+            out.write(f"\r\033[KAnalyzed {done}/{len(todo)}")
+            out.flush()
+    _store(conn, pending)
+    _update_albums(conn, albums)
+    conn.close()
+    print(f"\r\033[KAnalyzed {done} files in {time.perf_counter() - start:.1f}s", file=out)
+    return done
+
+
+def _store(conn, rows):
+    with conn:
+        conn.executemany('''INSERT OR REPLACE INTO loudness
+                         (path, album, size, mtime_ns, integrated, true_peak, histogram, analyzed_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    rows.clear()
+
+
+def _update_albums(conn, albums):
+    # Album loudness gates over every block of every track, rebuilt from the stored histograms
+    with conn:
+        for album in albums:
+            total = np.zeros(HIST_BINS, dtype=np.uint64)
+            peak = None
+            for histogram, true_peak in conn.execute('SELECT histogram, true_peak FROM loudness WHERE album = ?',
+                                                     (album,)):
+                if histogram:
+                    total += np.frombuffer(histogram, dtype=np.uint32)
+                if true_peak is not None:
+                    peak = true_peak if peak is None else max(peak, true_peak)
+            conn.execute('INSERT OR REPLACE INTO album_loudness (album, integrated, true_peak) VALUES (?, ?, ?)',
+                         (album, histogram_loudness(total), peak))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure EBU R128 loudness and true peak of new or changed files")
+    parser.add_argument('music_dir', nargs='?', default=MUSIC_DIR)
+    parser.add_argument('--workers', type=int, help="decoding processes (default: one per CPU)")
+    parser.add_argument('--file', help="analyze one file and print the result instead")
+    args = parser.parse_args()
+
+    if args.file:
+        result = analyze_file(args.file)
+        if result is None:
+            print(f"Could not decode {args.file}")
+            sys.exit(1)
+        integrated, true_peak, _ = result
+        shown = f"{integrated:.1f} LUFS" if integrated is not None else "silent"
+        print(f"{shown}, true peak {true_peak:.1f} dBTP, gain {gain_db(integrated, true_peak):+.1f} dB")
+    else:
+        analyze_library(args.music_dir, args.workers)
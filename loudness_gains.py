@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import os
+import threading
+from pathlib import Path
+
+from metadata_db import connect
+
+# Kept apart from loudness.py so the player can apply gains without importing NumPy
+MUSIC_DIR = str(Path(__file__).parent / 'music')
+TARGET_LUFS = -18.0      # ReplayGain 2.0 reference level
+PEAK_CEILING = -1.0      # dBTP a gain may raise the true peak to
+MAX_BOOST = 12.0         # dB; quieter tracks than this are left quieter rather than lifting their noise
+
+
+def gain_db(integrated, true_peak, target=TARGET_LUFS):
+    """Gain that brings integrated loudness to target without pushing the peak past PEAK_CEILING."""
+    if integrated is None:
+        return 0.0
+    gain = min(target - integrated, MAX_BOOST)
+    if true_peak is not None:
+        gain = min(gain, PEAK_CEILING - true_peak)
+    return gain
+
+
+class LoudnessGains:
+    """Per-track playback gain from the stored analysis: one indexed lookup per track.
+
+    mode is 'track', 'album' (falls back to track for albums without data) or 'off'.
+    """
+
+    def __init__(self, music_dir=MUSIC_DIR, mode='track', db_path=None):
+        self.music_dir = os.path.abspath(music_dir)
+        self.mode = mode
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def gain(self, file_path):
+        """Linear gain factor for file_path; 1.0 when it hasn't been analyzed."""
+        if self.mode == 'off':
+            return 1.0
+        rel_path = os.path.relpath(file_path, self.music_dir)
+        with self._lock:
+            if self._conn is None:
+                self._conn = connect(self.db_path, check_same_thread=False)
+            row = self._conn.execute('''SELECT l.integrated, l.true_peak, a.integrated, a.true_peak
+                                     FROM loudness l LEFT JOIN album_loudness a ON a.album = l.album
+                                     WHERE l.path = ?''', (rel_path,)).fetchone()
+        if row is None:
+            return 1.0
+        if self.mode == 'album' and row[2] is not None:
+            return 10 ** (gain_db(row[2], row[3]) / 20)
+        return 10 ** (gain_db(row[0], row[1]) / 20)
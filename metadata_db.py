@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+import atexit
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+DB_PATH = Path(__file__).parent / 'music_metadata.db'
+BATCH_SIZE = 500       # Pending tracks that trigger a flush
+FLUSH_INTERVAL = 1.0   # Seconds a track may wait in memory before it is written
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def _create_base_schema(conn):
+    # Albums/Playlists table (combined)
+    conn.execute('''CREATE TABLE IF NOT EXISTS albums
+                 (id TEXT PRIMARY KEY,
+                  title TEXT,
+                  artist TEXT,
+                  type TEXT CHECK(type IN ('album', 'playlist')),
+                  url TEXT)''')
+
+    # Tracks table
+    conn.execute('''CREATE TABLE IF NOT EXISTS tracks
+                 (id TEXT PRIMARY KEY,
+                  title TEXT,
+                  album_id TEXT,
+                  position INTEGER,
+                  url TEXT,
+                  file_path TEXT,
+                  download_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  FOREIGN KEY(album_id) REFERENCES albums(id))''')
+
+    # Optional artists table
+    conn.execute('''CREATE TABLE IF NOT EXISTS artists
+                 (name TEXT PRIMARY KEY,
+                  description TEXT)''')
+
+    # Cached playlist contents from flat extraction, so checking a playlist
+    # for missing tracks is a local query instead of a full remote extract
+    conn.execute('''CREATE TABLE IF NOT EXISTS playlist_manifests
+                 (playlist_id TEXT PRIMARY KEY,
+                  entry_count INTEGER,
+                  fetched_at REAL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS playlist_entries
+                 (playlist_id TEXT,
+                  position INTEGER,
+                  entry_id TEXT,
+                  PRIMARY KEY(playlist_id, position))''')
+
+
+def _add_indexes(conn):
+    # Album listings, playlist counts and path lookups were all full table scans
+    conn.execute('CREATE INDEX IF NOT EXISTS tracks_album_id ON tracks(album_id, position)')
+    conn.execute('CREATE INDEX IF NOT EXISTS tracks_file_path ON tracks(file_path)')
+    conn.execute('CREATE INDEX IF NOT EXISTS albums_type ON albums(type)')
+
+
+def _add_library_roots(conn):
+    # Tracks store a path relative to a library root, so moving a library is one UPDATE
+    conn.execute('''CREATE TABLE IF NOT EXISTS library_roots
+                 (id INTEGER PRIMARY KEY,
+                  path TEXT UNIQUE NOT NULL)''')
+    conn.execute('ALTER TABLE tracks ADD COLUMN root_id INTEGER REFERENCES library_roots(id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS tracks_root_path ON tracks(root_id, file_path)')
+    roots = {}
+    rows = conn.execute('SELECT id, file_path FROM tracks WHERE file_path IS NOT NULL').fetchall()
+    for track_id, file_path in rows:
+        root, rel_path = split_library_path(file_path)
+        if root is None:
+            continue
+        if root not in roots:
+            roots[root] = root_id(conn, root)
+        conn.execute('UPDATE tracks SET root_id = ?, file_path = ? WHERE id = ?',
+                     (roots[root], rel_path, track_id))
+    conn.execute('''CREATE VIEW IF NOT EXISTS track_paths AS
+                 SELECT t.id, t.album_id,
+                        CASE WHEN r.path IS NULL THEN t.file_path
+                             ELSE r.path || '/' || t.file_path END AS file_path
+                 FROM tracks t LEFT JOIN library_roots r ON t.root_id = r.id''')
+
+
+def path_stem_sql(column):
+    """SQL for a root-relative path up to its last '.', lowercased.
+
+    Downloads are recorded under their pre-conversion name (e.g. .webm) but
+    land on disk as .mp3, so tracks are matched to files on this.
+    """
+    return f"lower(rtrim({column}, replace({column}, '.', '')))"
+
+
+def _add_path_stem_index(conn):
+    # Lets the player join files on disk to their metadata without a scan per file
+    conn.execute(f'CREATE INDEX IF NOT EXISTS tracks_path_stem ON tracks({path_stem_sql("file_path")})')
+
+
+def _add_title_index(conn):
+    # show_db.py's duplicates summary walks titles in index order, a page at a time
+    conn.execute('CREATE INDEX IF NOT EXISTS tracks_title_key ON tracks(lower(title))')
+
+
+def _add_loudness_tables(conn):
+    # Written by loudness.py; paths are relative to the music directory like library_index.db
+    conn.execute('''CREATE TABLE IF NOT EXISTS loudness
+                 (path TEXT PRIMARY KEY,
+                  album TEXT,
+                  size INTEGER,
+                  mtime_ns INTEGER,
+                  integrated REAL,
+                  true_peak REAL,
+                  histogram BLOB,
+                  analyzed_at REAL)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS loudness_album ON loudness(album)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS album_loudness
+                 (album TEXT PRIMARY KEY,
+                  integrated REAL,
+                  true_peak REAL)''')
+
+
+def _add_fingerprint_tables(conn):
+    # Written by fingerprint.py. Only a value-sampled subset of each track's sub-fingerprints is
+    # indexed; two copies of a song share enough of them to be found without comparing every pair.
+    conn.execute('''CREATE TABLE IF NOT EXISTS fingerprints
+                 (id INTEGER PRIMARY KEY,
+                  path TEXT UNIQUE,
+                  size INTEGER,
+                  mtime_ns INTEGER,
+                  fingerprint BLOB)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS fingerprint_hashes
+                 (hash INTEGER,
+                  track INTEGER,
+                  offset INTEGER,
+                  PRIMARY KEY (hash, track, offset)) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX IF NOT EXISTS fingerprint_hashes_track ON fingerprint_hashes(track)')
+
+
+def _add_integrity_table(conn):
+    # Written by integrity.py; keyed on the track so relocating a library root doesn't force a re-hash
+    conn.execute('''CREATE TABLE IF NOT EXISTS file_integrity
+                 (track_id TEXT PRIMARY KEY,
+                  path TEXT,
+                  size INTEGER,
+                  mtime_ns INTEGER,
+                  hash BLOB,
+                  status TEXT,
+                  checked_at REAL)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS file_integrity_status ON file_integrity(status)')
+
+
+# Applied in order; PRAGMA user_version records how many have run. Append only.
+MIGRATIONS = [
+    _create_base_schema,
+    _add_indexes,
+    _add_library_roots,
+    _add_path_stem_index,
+    _add_title_index,
+    _add_loudness_tables,
+    _add_fingerprint_tables,
+    _add_integrity_table,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn):
+    """Bring the schema up to SCHEMA_VERSION, each migration in its own transaction."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have migrated while we waited for the write lock
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= number:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return SCHEMA_VERSION
+
+
+def split_library_path(file_path):
+    """(root, relative path) for an absolute artist/album/title path, else (None, file_path).
+
+    downloader.py lays files out as <root>/<artist>/<album>/<title>.<ext>.
+    """
+    path = Path(file_path)
+    if not path.is_absolute() or len(path.parts) < 5:
+        return None, file_path
+    return str(path.parents[2]), str(path.relative_to(path.parents[2]))
+
+
+def root_id(conn, root):
+    conn.execute('INSERT OR IGNORE INTO library_roots (path) VALUES (?)', (root,))
+    return conn.execute('SELECT id FROM library_roots WHERE path = ?', (root,)).fetchone()[0]
+
+
+def relocate_root(conn, old_root, new_root):
+    """Point every track under old_root at new_root; returns the number of roots updated."""
+    old_root, new_root = old_root.rstrip('/'), new_root.rstrip('/')
+    with conn:
+        existing = conn.execute('SELECT id FROM library_roots WHERE path = ?', (new_root,)).fetchone()
+        if existing is None:
+            return conn.execute('UPDATE library_roots SET path = ? WHERE path = ?',
+                                (new_root, old_root)).rowcount
+        # new_root is already known: move old_root's tracks onto it
+        old = conn.execute('SELECT id FROM library_roots WHERE path = ?', (old_root,)).fetchone()
+        if old is None:
+            return 0
+        conn.execute('UPDATE tracks SET root_id = ? WHERE root_id = ?', (existing[0], old[0]))
+        conn.execute('DELETE FROM library_roots WHERE id = ?', (old[0],))
+        return 1
+
+
+def connect(db_path=None, check_same_thread=True):
+    """Open the metadata DB in WAL mode, migrating the schema on first use in this process."""
+    db_path = str(db_path or DB_PATH)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=check_same_thread)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    with _init_lock:
+        if db_path not in _initialized:
+            migrate(conn)
+            _initialized.add(db_path)
+    return conn
+
+
+def track_rows(info, file_path):
+    """The (album, track, artist) rows downloader.store_metadata records for one yt-dlp info dict."""
+    # Determine if this is a playlist or album
+    is_playlist = 'playlist_id' in info
+    album_id = info['playlist_id'] if is_playlist else f"manual_{info['id']}"
+    album = (album_id,
+             info.get('playlist_title') if is_playlist else info.get('album', 'Unknown Album'),
+             info.get('artist'),
+             'playlist' if is_playlist else 'album',
+             info.get('webpage_url'))
+    track = (info['id'],
+             info.get('title'),
+             album_id,
+             info.get('playlist_index', 1) if is_playlist else info.get('track_number', 1),
+             info.get('webpage_url'),
+             file_path)
+    return album, track, info.get('artist')
+
+
+class MetadataWriter:
+    """Buffers track metadata and writes it in grouped transactions over one WAL connection.
+
+    add() is safe to call from any thread. Rows are flushed once batch_size tracks
+    are pending, after flush_interval seconds, on flush() and at interpreter exit,
+    so a 300-track playlist costs a handful of commits instead of 300.
+    """
+
+    def __init__(self, db_path=None, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self._albums = []
+        self._tracks = []
+        self._artists = []
+        self._conn = None
+        self._root_ids = {}
+        self._lock = threading.Lock()        # Guards the pending lists
+        self._write_lock = threading.Lock()  # Serialises transactions on the connection
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def add(self, info, file_path):
+        album, track, artist = track_rows(info, file_path)
+        with self._lock:
+            self._albums.append(album)
+            self._tracks.append(track)
+            if artist:
+                self._artists.append((artist,))
+            pending = len(self._tracks)
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._flush_periodically, daemon=True,
+                                                name='metadata-writer')
+                self._thread.start()
+        if pending >= self.batch_size:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._tracks)
+
+    def flush(self):
+        """Write everything pending in one transaction; returns the number of tracks written."""
+        with self._write_lock:
+            with self._lock:
+                albums, self._albums = self._albums, []
+                tracks, self._tracks = self._tracks, []
+                artists, self._artists = self._artists, []
+            if not tracks:
+                return 0
+            if self._conn is None:
+                self._conn = connect(self.db_path, check_same_thread=False)
+            with self._conn:
+                tracks = [track[:5] + self._relative(track[5]) for track in tracks]
+                self._conn.executemany('''INSERT OR IGNORE INTO albums
+                                       (id, title, artist, type, url)
+                                       VALUES (?, ?, ?, ?, ?)''', albums)
+                self._conn.executemany('''INSERT OR REPLACE INTO tracks
+                                       (id, title, album_id, position, url, root_id, file_path)
+                                       VALUES (?, ?, ?, ?, ?, ?, ?)''', tracks)
+                self._conn.executemany('INSERT OR IGNORE INTO artists (name) VALUES (?)', artists)
+            self.rows_written += len(tracks)
+            return len(tracks)
+
+    def _relative(self, file_path):
+        # (root_id, path relative to that root), caching root ids for the writer's lifetime
+        root, rel_path = split_library_path(file_path) if file_path else (None, file_path)
+        if root is None:
+            return None, rel_path
+        if root not in self._root_ids:
+            self._root_ids[root] = root_id(self._conn, root)
+        return self._root_ids[root], rel_path
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+        with self._write_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _flush_periodically(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            if self._closed:
+                return
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Error writing metadata: {e}")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """The process-wide writer shared by every download worker; flushed at exit."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MetadataWriter()
+            atexit.register(_writer.close)
+        return _writer
+
+
+def benchmark(count=5000, threads=4):
+    """Compare one connection + commit per track against MetadataWriter fed from several threads."""
+    infos = [{'id': f'track{i}', 'title': f'Track {i}', 'playlist_id': f'list{i // 300}',
+              'playlist_title': f'Playlist {i // 300}', 'playlist_index': i % 300 + 1,
+              'artist': f'Artist {i // 900}', 'webpage_url': f'https://example.com/{i}'}
+             for i in range(count)]
+    with tempfile.TemporaryDirectory() as tmp:
+        naive_path = os.path.join(tmp, 'naive.db')
+        connect(naive_path).close()
+        start = time.perf_counter()
+        for info in infos:
+            album, track, artist = track_rows(info, f'/music/{info["id"]}.mp3')
+            with sqlite3.connect(naive_path) as conn:
+                conn.execute('INSERT OR IGNORE INTO albums VALUES (?, ?, ?, ?, ?)', album)
+                conn.execute('''INSERT OR REPLACE INTO tracks (id, title, album_id, position, url, file_path)
+                             VALUES (?, ?, ?, ?, ?, ?)''', track)
+                conn.execute('INSERT OR IGNORE INTO artists (name) VALUES (?)', (artist,))
+                conn.commit()
+            conn.close()
+        naive = time.perf_counter() - start
+
+        writer = MetadataWriter(os.path.join(tmp, 'batched.db'))
+        start = time.perf_counter()
+        workers = [threading.Thread(target=lambda part=infos[i::threads]: [
+            writer.add(info, f'/music/{info["id"]}.mp3') for info in part]) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        writer.close()
+        batched = time.perf_counter() - start
+
+    print(f"per-track commits: {count / naive:10.0f} tracks/s ({naive:.2f}s)")
+    print(f"MetadataWriter:    {count / batched:10.0f} tracks/s ({batched:.2f}s, {threads} threads)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
+    else:
+        print("Usage: python metadata_db.py --bench [tracks]")
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+import bisect
+import os
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+# Upper bounds in seconds, from a render frame (~50 µs) to a cold ffprobe call
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BUCKET_LABELS = [f'{bound:g}' for bound in BUCKETS] + ['+Inf']
+WRITE_INTERVAL = 5       # Seconds between rewrites of a metrics file
+PROFILE_INTERVAL = 0.01  # 100 stack samples a second
+SOCKET_TIMEOUT = 1       # Seconds a scraper gets to send its request and read the reply
+
+HISTOGRAMS = {
+    'ninelayer_command_seconds': 'Time spent handling a player command',
+    'ninelayer_command_dequeue_seconds': 'Delay between a command being posted and being handled',
+    'ninelayer_loop_lag_seconds': 'How late event loop timers run; a key press waits as long',
+    'ninelayer_duration_probe_seconds': 'get_song_duration, cache hits included',
+    'ninelayer_decoder_start_seconds': 'Starting the decoder and loading a track into it',
+    'ninelayer_first_audio_seconds': 'From play_current_song to the decoder producing audio',
+    'ninelayer_render_frame_seconds': 'Drawing and flushing one UI frame',
+}
+
+
+class Histogram:
+    """A Prometheus histogram: cumulative bucket counts, a sum and a count."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class Metrics:
+    """Latency histograms and gauges, rendered in the Prometheus text format.
+
+    observe() is safe to call from any thread. Gauges are functions evaluated at
+    render time, so they cost nothing between scrapes.
+    """
+
+    def __init__(self, histograms=HISTOGRAMS):
+        self.help = dict(histograms)
+        self._histograms = {}  # (name, sorted label items) -> Histogram
+        self._gauges = {}      # name -> (help, kind, function)
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return True
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def span(self, name, **labels):
+        """A context manager observing how long its block took."""
+        return Span(self, name, labels)
+
+    def gauge(self, name, help_text, function, kind='gauge'):
+        self._gauges[name] = (help_text, kind, function)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted((key, h.counts[:], h.sum, h.count) for key, h in self._histograms.items())
+        seen = set()
+        for (name, labels), counts, total, count in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# HELP {name} {self.help.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+            label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKET_LABELS, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = f'{{{label_text}}}' if label_text else ''
+            lines.append(f'{name}_sum{suffix} {total:.9g}')
+            lines.append(f'{name}_count{suffix} {count}')
+        for name, (help_text, kind, function) in sorted(self._gauges.items()):
+            try:
+                value = function()
+            except (OSError, ValueError):
+                continue
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value:.9g}')
+        return '\n'.join(lines) + '\n'
+
+
+class NullMetrics:
+    """Stands in for Metrics when they're off: every call is a no-op."""
+
+    def __bool__(self):
+        return False
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def span(self, name, **labels):
+        return NULL_SPAN
+
+    def gauge(self, name, help_text, function, kind='gauge'):
+        pass
+
+    def render(self):
+        return ''
+
+
+NULL_SPAN = nullcontext()
+NULL_METRICS = NullMetrics()
+
+
+def _resident_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def add_process_gauges(metrics):
+    """Thread count, CPU time, resident memory and open files of this process."""
+    metrics.gauge('ninelayer_threads', 'Python threads alive', threading.active_count)
+    metrics.gauge('process_cpu_seconds_total', 'User and system CPU time', time.process_time, 'counter')
+    if os.path.exists('/proc/self/statm'):
+        metrics.gauge('process_resident_memory_bytes', 'Resident memory', _resident_bytes)
+        metrics.gauge('process_open_fds', 'Open file descriptors', lambda: len(os.listdir('/proc/self/fd')))
+
+
+def write_atomically(path, text):
+    # A scraper or node_exporter's textfile collector never sees a half-written file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class FileExporter:
+    """Rewrites the metrics file every WRITE_INTERVAL seconds from the loop, and on close()."""
+
+    def __init__(self, metrics, loop, path, interval=WRITE_INTERVAL):
+        self.metrics = metrics
+        self.loop = loop
+        self.path = path
+        self.interval = interval
+        self._timer = None
+
+    def start(self):
+        self._write()
+
+    def _write(self):
+        write_atomically(self.path, self.metrics.render())
+        self._timer = self.loop.call_later(self.interval, self._write)
+
+    def close(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        write_atomically(self.path, self.metrics.render())
+
+
+class SocketExporter:
+    """Serves the metrics on a Unix socket from the player's loop.
+
+    Answers an HTTP GET (`curl --unix-socket <path> http://localhost/metrics`) with
+    an HTTP response, and any other request line with the bare text.
+    """
+
+    def __init__(self, metrics, loop, path):
+        self.metrics = metrics
+        self.loop = loop
+        self.path = path
+        self.server = None
+        self._clients = {}  # socket -> (reply still to send, or None before the request, deadline timer)
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Left behind by a player that didn't exit cleanly
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(4)
+        self.server.setblocking(False)
+        self.loop.add_reader(self.server.fileno(), self._accept)
+
+    def _accept(self):
+        try:
+            conn, _ = self.server.accept()
+        except (BlockingIOError, OSError):
+            return
+        conn.setblocking(False)
+        # A scraper that stalls is dropped rather than waited for
+        self._clients[conn] = (None, self.loop.call_later(SOCKET_TIMEOUT, self._finish, conn))
+        self.loop.add_reader(conn.fileno(), self._respond, conn)
+
+    def _respond(self, conn):
+        try:
+            request = conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._finish(conn)
+            return
+        body = self.metrics.render().encode()
+        if request.startswith(b'GET'):
+            body = (b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                    b'Content-Length: %d\r\n\r\n' % len(body)) + body
+        # Sent as the socket drains, a buffer at a time, so a slow reader never blocks the loop
+        self._clients[conn] = (memoryview(body), self._clients[conn][1])
+        self.loop.remove_reader(conn.fileno())
+        self.loop.add_writer(conn.fileno(), self._write, conn)
+
+    def _write(self, conn):
+        reply, deadline = self._clients[conn]
+        try:
+            sent = conn.send(reply)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._finish(conn)
+            return
+        if sent < len(reply):
+            self._clients[conn] = (reply[sent:], deadline)
+        else:
+            self._finish(conn)
+
+    def _finish(self, conn):
+        _, deadline = self._clients.pop(conn, (None, None))
+        if deadline:
+            deadline.cancel()
+        self.loop.remove_writer(conn.fileno())
+        conn.close()
+
+    def close(self):
+        for conn in list(self._clients):
+            self._finish(conn)
+        if self.server is not None:
+            self.loop.remove_reader(self.server.fileno())
+            self.server.close()
+            self.server = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+def make_exporter(spec, metrics, loop):
+    """An exporter from a NINELAYER_METRICS value: 'file:<path>' or 'unix:<path>'."""
+    kind, _, path = spec.partition(':')
+    if kind == 'file':
+        return FileExporter(metrics, loop, path or 'ninelayer.prom')
+    if kind == 'unix':
+        return SocketExporter(metrics, loop, path or 'ninelayer.sock')
+    raise ValueError(f"unknown metrics output: {spec}")
+
+
+class SamplingProfiler:
+    """Samples every thread's stack PROFILE_INTERVAL apart and counts identical stacks.
+
+    Written as folded stacks ('thread;outer (file:line);...;inner (file:line) count'),
+    the input flamegraph.pl and speedscope take. Nothing is traced between samples.
+    """
+
+    def __init__(self, path, interval=PROFILE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name='profiler')
+        self._thread.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                calls.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(calls))] += 1
+            self.samples += 1
+
+    def stop(self):
+        """Stop sampling and write the folded stacks."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        write_atomically(self.path, ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common()))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python metrics.py <socket path>   # Print a running player's metrics")
+        sys.exit(1)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(sys.argv[1])
+        client.sendall(b'metrics\n')
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    sys.stdout.write(b''.join(chunks).decode())
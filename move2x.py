@@ -1,112 +1,566 @@
-import subprocess
+#!/usr/bin/env python3
+import argparse
 import json
+import os
+import sqlite3
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+TARGET_FPS = 30
+MAX_FPS = 60
+VIDEO_EXTENSIONS = ('.mov', '.mp4', '.m4v', '.mkv', '.avi', '.webm')
+PROBE_CACHE_PATH = Path(__file__).parent / 'video_probe.db'
+# minterpolate runs on a single thread, so each encode gets one core for it and one for libx264
+CORES_PER_JOB = 2
+MIN_SEGMENT_SECONDS = 10  # Shorter segments cost more in process startup than they save
+
+VideoInfo = namedtuple('VideoInfo', 'framerate duration has_audio start_time')
 
-def get_video_framerate(file_path):
+
+def run_ffprobe(file_path):
+    """ffprobe's JSON description of every stream and the container, or None on failure."""
+    command = [
+        'ffprobe',
+        '-v', 'quiet',
+        '-print_format', 'json',
+        '-show_streams',
+        '-show_format',
+        file_path
+    ]
     try:
-        # Run ffprobe command to get video information in JSON format
-        command = [
-            'ffprobe',
-            '-v', 'quiet',
-            '-print_format', 'json',
-            '-show_streams',
-            '-select_streams', 'v:0',
-            file_path
-        ]
-        
         result = subprocess.run(command, capture_output=True, text=True, check=True)
-        
-        # Parse the JSON output
-        video_info = json.loads(result.stdout)
-        
-        # Check if 'streams' key exists in the output
-        if 'streams' not in video_info:
-            print(f"Error: 'streams' key not found in ffprobe output. Full output: {video_info}")
-            return None
-        
-        # Extract the framerate
-        stream = video_info['streams'][0]
-        if 'avg_frame_rate' in stream:
-            framerate_str = stream['avg_frame_rate']
-            num, den = map(int, framerate_str.split('/'))
-            framerate = num / den if den != 0 else 0
-            return framerate
-        else:
-            print(f"Error: 'avg_frame_rate' not found in stream information. Stream info: {stream}")
-            return None
-    
-    except subprocess.CalledProcessError as e:
-        print(f"Error running ffprobe: {e}")
-        print(f"ffprobe stderr output: {e.stderr}")
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error running ffprobe on {file_path}: {e}")
         return None
+    try:
+        return json.loads(result.stdout)
     except json.JSONDecodeError as e:
         print(f"Error parsing JSON output: {e}")
         print(f"Raw ffprobe output: {result.stdout}")
         return None
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+
+
+def parse_framerate(rate):
+    num, _, den = (rate or '0/0').partition('/')
+    try:
+        num, den = int(num), int(den or 1)
+    except ValueError:
+        return 0
+    return num / den if den != 0 else 0
+
+
+def video_info(probe):
+    """VideoInfo from ffprobe's JSON, or None if there is no video stream."""
+    streams = probe.get('streams') or []
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    if video is None:
+        return None
+    # avg_frame_rate is 0/0 for some variable-rate streams; r_frame_rate is always set
+    framerate = parse_framerate(video.get('avg_frame_rate')) or parse_framerate(video.get('r_frame_rate'))
+    duration = float(probe.get('format', {}).get('duration') or video.get('duration') or 0)
+    has_audio = any(s.get('codec_type') == 'audio' for s in streams)
+    start_time = float(probe.get('format', {}).get('start_time') or 0)
+    return VideoInfo(framerate, duration, has_audio, start_time)
+
+
+class ProbeCache:
+    """ffprobe results keyed by path, size and mtime, persisted in video_probe.db.
+
+    Re-running a batch over the same folders only probes files that are new or
+    changed. The lock covers the database, not ffprobe, so probes run in parallel.
+    """
+
+    def __init__(self, db_path=PROBE_CACHE_PATH):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            with self._conn:
+                self._conn.execute('''CREATE TABLE IF NOT EXISTS probes
+                                   (path TEXT PRIMARY KEY,
+                                    size INTEGER,
+                                    mtime_ns INTEGER,
+                                    probe TEXT)''')
+        return self._conn
+
+    def get(self, file_path):
+        """VideoInfo for file_path, or None if it can't be probed or has no video."""
+        file_path = os.path.abspath(file_path)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._connect().execute('SELECT size, mtime_ns, probe FROM probes WHERE path = ?',
+                                          (file_path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return video_info(json.loads(row[2]))
+
+        # Failures are cached too (as no streams), so a broken file isn't re-probed every run
+        probe = run_ffprobe(file_path) or {}
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO probes (path, size, mtime_ns, probe) VALUES (?, ?, ?, ?)',
+                             (file_path, st.st_size, st.st_mtime_ns, json.dumps(probe)))
+        return video_info(probe)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def get_video_framerate(file_path, cache=None):
+    info = (cache or ProbeCache()).get(file_path)
+    if info is None:
+        print(f"Error: no video stream found in {file_path}")
         return None
+    return info.framerate
+
+
+def output_path(input_file, target_fps=TARGET_FPS):
+    return input_file.rsplit('.', 1)[0] + f'_{target_fps}fps.mp4'
+
 
-def decrease_framerate(input_file, output_file, target_fps=None):
+def is_up_to_date(input_file, output_file):
+    """True if output_file exists, isn't empty and is newer than input_file."""
     try:
-        # Use exactly 30 fps for best compatibility
-        if target_fps is None:
-            target_fps = "30"
-            
-        command = [
-            'ffmpeg',
-            '-i', input_file,
-            '-c:v', 'libx264',     # H264 video codec
-            '-c:a', 'aac',         # AAC audio codec
-            '-b:a', '128k',        # Standard audio bitrate
-            '-filter_complex',
-            # Use fps filter with interpolation for smoother frame conversion
-            f'[0:v]minterpolate=\'mi_mode=mci:mc_mode=aobmc:fps={target_fps}\',fps={target_fps}[v];[0:a]aresample=async=1[a]',
-            '-map', '[v]',         # Map video stream
-            '-map', '[a]',         # Map audio stream
-            '-movflags', '+faststart',  # Enable fast start for streaming
-            output_file
-        ]
-        
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        print(f"Successfully converted {input_file} to {target_fps} fps.")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error converting video: {e}")
-        print(f"ffmpeg stderr output: {e.stderr}")
+        src, dst = os.stat(input_file), os.stat(output_file)
+    except OSError:
         return False
+    return dst.st_size > 0 and dst.st_mtime_ns >= src.st_mtime_ns
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python move2x.py <path_to_mov_file>")
-        sys.exit(1)
-    
-    mov_file = sys.argv[1]
+
+def interpolation_filter(target_fps):
+    return f"minterpolate='mi_mode=mci:mc_mode=aobmc:fps={target_fps}',fps={target_fps}"
+
+
+def transcode_command(input_file, output_file, target_fps=TARGET_FPS, has_audio=True, threads=None):
+    filters = f'[0:v]{interpolation_filter(target_fps)}[v]'
+    maps = ['-map', '[v]']          # Map video stream
+    if has_audio:
+        filters += ';[0:a]aresample=async=1[a]'
+        maps += ['-map', '[a]']     # Map audio stream
+    command = [
+        'ffmpeg', '-y', '-nostdin',
+        '-v', 'error',
+        '-progress', 'pipe:1',      # key=value progress blocks on stdout
+        '-nostats',
+        '-i', input_file,
+        '-c:v', 'libx264',          # H264 video codec
+        '-c:a', 'aac',              # AAC audio codec
+        '-b:a', '128k',             # Standard audio bitrate
+        # Use fps filter with interpolation for smoother frame conversion
+        '-filter_complex', filters,
+    ] + maps
+    if threads:
+        command += ['-threads', str(threads)]
+    command += [
+        '-movflags', '+faststart',  # Enable fast start for streaming
+        '-f', 'mp4',                # The temporary name doesn't end in .mp4
+        output_file
+    ]
+    return command
+
+
+def parse_progress(lines):
+    """Yield (seconds encoded, speed) for each block of ffmpeg -progress output."""
+    block = {}
+    for line in lines:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        block[key] = value
+        if key != 'progress':
+            continue
+        try:
+            # out_time_us is microseconds; older ffmpegs only have out_time_ms, which is too
+            seconds = int(block.get('out_time_us') or block.get('out_time_ms') or 0) / 1e6
+        except ValueError:
+            seconds = 0.0
+        speed = block.get('speed', '').rstrip('x')
+        try:
+            speed = float(speed)
+        except ValueError:
+            speed = 0.0
+        yield max(seconds, 0.0), speed
+        block = {}
+
+
+def run_ffmpeg(command, on_progress=None):
+    """Run an ffmpeg command that writes -progress to stdout; returns (ok, stderr text)."""
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=stderr, text=True)
+        for seconds, speed in parse_progress(process.stdout):
+            if on_progress:
+                on_progress(seconds, speed)
+        process.stdout.close()
+        returncode = process.wait()
+        stderr.seek(0)
+        return returncode == 0, stderr.read()
+
+
+def keyframe_times(input_file, start_time=0.0):
+    """Keyframe timestamps of the first video stream, read from packet flags without decoding."""
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', input_file]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    times = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            # -ss counts from the container's start time, pts_time from zero
+            times.append(float(pts_time) - start_time)
+    return sorted(times)
+
+
+def segment_bounds(keyframes, duration, segments, min_length=MIN_SEGMENT_SECONDS):
+    """Split [0, duration) into up to segments (start, length) pieces that each begin on a keyframe.
+
+    The last piece's length is None (to the end of the file).
+    """
+    segments = max(1, min(segments, int(duration // min_length)))
+    starts = [0.0]
+    for i in range(1, segments):
+        target = duration * i / segments
+        nearest = min(keyframes, key=lambda t: abs(t - target), default=None)
+        if nearest is not None and nearest - starts[-1] >= min_length and duration - nearest >= min_length:
+            starts.append(nearest)
+    ends = starts[1:] + [None]
+    return [(start, None if end is None else end - start) for start, end in zip(starts, ends)]
+
+
+def segment_command(input_file, output_file, start, length, target_fps=TARGET_FPS, threads=None):
+    # Seeking before -i lands exactly on the keyframe the segment starts with
+    command = ['ffmpeg', '-y', '-nostdin', '-v', 'error', '-progress', 'pipe:1', '-nostats',
+               '-ss', f'{start:.6f}']
+    if length is not None:
+        command += ['-t', f'{length:.6f}']
+    command += ['-i', input_file, '-an', '-vf', interpolation_filter(target_fps), '-c:v', 'libx264']
+    if threads:
+        command += ['-threads', str(threads)]
+    return command + ['-f', 'mp4', output_file]
+
+
+def audio_command(input_file, output_file):
+    return ['ffmpeg', '-y', '-nostdin', '-v', 'error', '-progress', 'pipe:1', '-nostats', '-i', input_file,
+            '-vn', '-af', 'aresample=async=1', '-c:a', 'aac', '-b:a', '128k', '-f', 'mp4', output_file]
+
+
+def concat_command(list_file, audio_file, output_file):
+    command = ['ffmpeg', '-y', '-nostdin', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_file]
+    if audio_file:
+        command += ['-i', audio_file, '-map', '0:v:0', '-map', '1:a:0']
+    return command + ['-c', 'copy', '-movflags', '+faststart', '-f', 'mp4', output_file]
+
+
+def encode_segmented(input_file, output_file, bounds, target_fps, has_audio, workers, threads,
+                     on_progress=None):
+    """Encode bounds in parallel ffmpeg processes, the audio once alongside them, then join the
+    pieces with the concat demuxer. Returns (ok, stderr text of the first failure)."""
+    with tempfile.TemporaryDirectory(prefix='.move2x-', dir=os.path.dirname(os.path.abspath(output_file))) as tmp:
+        segment_files = [os.path.join(tmp, f'segment{i:04d}.mp4') for i in range(len(bounds))]
+        audio_file = os.path.join(tmp, 'audio.m4a') if has_audio else None
+        done = [0.0] * len(bounds)
+        speeds = [0.0] * len(bounds)
+        lock = threading.Lock()
+
+        def encode(i):
+            def progress(seconds, speed):
+                with lock:
+                    done[i], speeds[i] = seconds, speed
+                    total, speed = sum(done), sum(speeds)
+                if on_progress:
+                    on_progress(total, speed)
+            start, length = bounds[i]
+            return run_ffmpeg(segment_command(input_file, segment_files[i], start, length, target_fps, threads),
+                              progress)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='segment') as executor:
+            # Audio is cheap next to interpolation, so it is resampled once rather than per segment
+            audio = executor.submit(run_ffmpeg, audio_command(input_file, audio_file)) if has_audio else None
+            results = list(executor.map(encode, range(len(bounds))))
+            if audio is not None:
+                results.append(audio.result())
+        for ok, errors in results:
+            if not ok:
+                return False, errors
+
+        list_file = os.path.join(tmp, 'segments.txt')
+        with open(list_file, 'w') as f:
+            for segment_file in segment_files:
+                f.write("file '" + segment_file.replace("'", "'\\''") + "'\n")
+        return run_ffmpeg(concat_command(list_file, audio_file, output_file))
+
+
+def decrease_framerate(input_file, output_file, target_fps=None, has_audio=True, threads=None,
+                       on_progress=None, segments=1, workers=None, info=None):
+    """Interpolate input_file to target_fps. With segments > 1, a long input is split at
+    keyframes and the pieces are encoded by up to workers ffmpeg processes at once."""
+    # Use exactly 30 fps for best compatibility
+    if target_fps is None:
+        target_fps = TARGET_FPS
+    bounds = None
+    if segments > 1:
+        info = info or ProbeCache().get(input_file)
+        if info is not None:
+            has_audio = info.has_audio
+            bounds = segment_bounds(keyframe_times(input_file, info.start_time), info.duration, segments)
+    # Encode to a temporary name so an interrupted run never looks up to date
+    partial = output_file + '.part'
+    try:
+        if bounds and len(bounds) > 1:
+            workers = max(1, workers or default_workers())
+            ok, errors = encode_segmented(input_file, partial, bounds, target_fps, has_audio, workers,
+                                          threads or max(1, available_cores() // workers), on_progress)
+        else:
+            ok, errors = run_ffmpeg(transcode_command(input_file, partial, target_fps, has_audio, threads),
+                                    on_progress)
+        if not ok:
+            print(f"Error converting {input_file}")
+            print(f"ffmpeg stderr output: {errors}")
+            return False
+        os.replace(partial, output_file)
+    except OSError as e:
+        print(f"Error converting {input_file}: {e}")
+        return False
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return True
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_workers(cores=None):
+    return max(1, (cores or available_cores()) // CORES_PER_JOB)
+
+
+def find_videos(paths, target_fps=TARGET_FPS):
+    """Video files named in paths or found under them, leaving out our own outputs."""
+    suffix = f'_{target_fps}fps.mp4'
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(VIDEO_EXTENSIONS) and not name.endswith(suffix):
+                    yield os.path.join(root, name)
+
+
+class TranscodeBoard:
+    """One status line for every running encode, fed from ffmpeg's -progress output."""
+
+    def __init__(self, total_jobs, out=None, min_interval=0.5):
+        self.total_jobs = total_jobs
+        self.out = out or sys.stdout
+        self.min_interval = min_interval
+        self.done = 0
+        self.failed = 0
+        self.jobs = {}  # name -> [seconds encoded, duration, speed]
+        self._lock = threading.Lock()
+        self._last_render = 0.0
+
+    def start_job(self, name, duration):
+        with self._lock:
+            self.jobs[name] = [0.0, duration, 0.0]
+        self.render(force=True)
+
+    def progress_for(self, name):
+        def on_progress(seconds, speed):
+            with self._lock:
+                job = self.jobs.get(name)
+                if job is not None:
+                    job[0], job[2] = seconds, speed
+            self.render()
+        return on_progress
+
+    def finish_job(self, name, ok):
+        with self._lock:
+            self.jobs.pop(name, None)
+            self.done += 1
+            if not ok:
+                self.failed += 1
+        self.render(force=True)
+
+    def message(self, text):
+        with self._lock:
+            self.out.write(f"\r\033[K{text}\n")
+            self.out.flush()
+
+    def summary(self):
+        with self._lock:
+            parts = []
+            for name, (seconds, duration, speed) in list(self.jobs.items())[:4]:
+                percent = f"{100 * min(seconds / duration, 1):.0f}%" if duration else f"{seconds:.0f}s"
+                parts.append(f"{Path(name).name[-16:]} {percent} {speed:.2f}x")
+            line = f"[{self.done}/{self.total_jobs} done, {self.failed} failed] {len(self.jobs)} active"
+            if parts:
+                line += ' | ' + ' '.join(parts)
+            return line
+
+    def render(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_render < self.min_interval:
+            return
+        self._last_render = now
+        line = self.summary()
+        with self._lock:
+            self.out.write(f"\r\033[K{line}")
+            self.out.flush()
+
+
+def plan_batch(paths, target_fps=TARGET_FPS, cache=None, force=False, workers=None, out=None):
+    """Jobs (input, output, VideoInfo) for the files that need converting, longest first.
+
+    Files whose output is newer than them are skipped without probing; the rest
+    are probed in parallel through the cache.
+    """
+    out = out or sys.stdout
+    cache = cache or ProbeCache()
+    candidates = []
+    for input_file in find_videos(paths, target_fps):
+        output_file = output_path(input_file, target_fps)
+        if not force and is_up_to_date(input_file, output_file):
+            print(f"Up to date: {output_file}", file=out)
+        else:
+            candidates.append((input_file, output_file))
+
+    jobs = []
+    with ThreadPoolExecutor(max_workers=workers or available_cores()) as executor:
+        infos = executor.map(lambda job: cache.get(job[0]), candidates)
+        for (input_file, output_file), info in zip(candidates, infos):
+            if info is None:
+                print(f"Skipping {input_file}: no video stream", file=out)
+            elif abs(info.framerate - target_fps) < 0.01 and not force:
+                print(f"Skipping {input_file}: already {target_fps} fps", file=out)
+            else:
+                jobs.append((input_file, output_file, info))
+    # Starting the longest encodes first keeps one long clip from finishing alone at the end
+    jobs.sort(key=lambda job: job[2].duration, reverse=True)
+    return jobs
+
+
+def run_batch(paths, target_fps=TARGET_FPS, workers=None, force=False, cache=None, out=None, segments=1):
+    """Convert every video under paths that isn't at target_fps; returns {input: bool}.
+
+    With segments > 1 files are converted one at a time, each split into segments
+    that share the workers, which suits a few long videos better than many clips.
+    """
+    out = out or sys.stdout
+    cores = available_cores()
+    workers = max(1, workers or default_workers(cores))
+    jobs = plan_batch(paths, target_fps, cache, force, out=out)
+    if not jobs:
+        print("Nothing to convert", file=out)
+        return {}
+
+    threads = max(1, cores // workers)
+    if segments > 1:
+        print(f"Converting {len(jobs)} file(s) to {target_fps} fps one at a time, in up to {segments} "
+              f"segments with {workers} encoding at once", file=out)
+    else:
+        print(f"Converting {len(jobs)} file(s) to {target_fps} fps, {workers} at a time "
+              f"with {threads} encoder thread(s) each", file=out)
+    board = TranscodeBoard(len(jobs), out)
+    results = {}
+    start = time.perf_counter()
+
+    def convert(input_file, output_file, info):
+        board.start_job(input_file, info.duration)
+        ok = False
+        try:
+            ok = decrease_framerate(input_file, output_file, target_fps, info.has_audio, threads,
+                                    board.progress_for(input_file), segments, workers, info)
+            return ok
+        finally:
+            board.finish_job(input_file, ok)
+
+    file_workers = 1 if segments > 1 else workers
+    with ThreadPoolExecutor(max_workers=file_workers, thread_name_prefix='transcode') as executor:
+        futures = {executor.submit(convert, *job): job[0] for job in jobs}
+        for future in as_completed(futures):
+            input_file = futures[future]
+            try:
+                results[input_file] = future.result()
+            except Exception as e:
+                board.message(f"{input_file}: failed: {e}")
+                results[input_file] = False
+    failed = sum(1 for ok in results.values() if not ok)
+    out.write(f"\r\033[KConverted {len(results) - failed} file(s), {failed} failed, "
+              f"in {time.perf_counter() - start:.1f}s\n")
+    return results
+
+
+def benchmark(input_file, target_fps=TARGET_FPS, segments=None, workers=None):
+    """Time the single-process encode of input_file against the segment-parallel one."""
+    workers = max(1, workers or default_workers())
+    segments = segments or workers
+    info = ProbeCache().get(input_file)
+    if info is None:
+        print(f"Failed to determine the framerate of {input_file}")
+        return
+    bounds = segment_bounds(keyframe_times(input_file, info.start_time), info.duration, segments)
+    print(f"{input_file}: {info.duration:.1f}s at {info.framerate:.2f} fps, {available_cores()} core(s), "
+          f"{len(bounds)} segment(s) on {workers} worker(s)")
+    with tempfile.TemporaryDirectory() as tmp:
+        timings = []
+        for label, count in (("single process", 1), ("segmented", segments)):
+            output_file = os.path.join(tmp, f'{count}.mp4')
+            start = time.perf_counter()
+            ok = decrease_framerate(input_file, output_file, target_fps, info.has_audio,
+                                    segments=count, workers=workers, info=info)
+            elapsed = time.perf_counter() - start
+            timings.append(elapsed)
+            print(f"{label:15s} {elapsed:8.1f}s  {info.duration / elapsed:5.2f}x realtime"
+                  + ("" if ok else "  (failed)"))
+    print(f"speedup: {timings[0] / timings[1]:.2f}x")
+
+
+def convert_interactively(mov_file):
     framerate = get_video_framerate(mov_file)
-    
+
     if framerate is not None:
         print(f"The framerate of {mov_file} is {framerate:.2f} fps")
-        
-        if framerate > 60:
-            print("Warning: Frame rate exceeds maximum allowed 60 fps")
+        output_file = output_path(mov_file)
+
+        if framerate > MAX_FPS:
+            print(f"Warning: Frame rate exceeds maximum allowed {MAX_FPS} fps")
             user_input = input("Do you want to convert to 30 fps? (y/n): ").lower()
             if user_input == 'y':
-                output_file = mov_file.rsplit('.', 1)[0] + '_30fps.mp4'
                 if decrease_framerate(mov_file, output_file):
                     print(f"Converted file saved as {output_file}")
                 else:
                     print("Conversion failed.")
-        elif framerate < 30:
+        elif framerate < TARGET_FPS:
             print(f"Frame rate is below 30 fps. Will interpolate frames to reach 30 fps.")
-            output_file = mov_file.rsplit('.', 1)[0] + '_30fps.mp4'
             if decrease_framerate(mov_file, output_file):
                 print(f"Converted file saved as {output_file}")
             else:
                 print("Conversion failed.")
-        elif framerate != 30:
+        elif framerate != TARGET_FPS:
             user_input = input("Do you want to convert to 30 fps for optimal compatibility? (y/n): ").lower()
             if user_input == 'y':
-                output_file = mov_file.rsplit('.', 1)[0] + '_30fps.mp4'
                 if decrease_framerate(mov_file, output_file):
                     print(f"Converted file saved as {output_file}")
                 else:
@@ -115,3 +569,31 @@ if __name__ == "__main__":
             print("The framerate is already 30 fps. No conversion needed.")
     else:
         print(f"Failed to determine the framerate of {mov_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert videos to a constant frame rate. One file asks before converting; "
+                    "directories, several files or --batch convert everything without asking.")
+    parser.add_argument('paths', nargs='+', help="video files or directories")
+    parser.add_argument('--batch', action='store_true', help="don't ask, even for a single file")
+    parser.add_argument('--fps', type=int, default=TARGET_FPS, help="target frame rate (batch mode)")
+    parser.add_argument('--workers', type=int,
+                        help=f"parallel encodes (default: one per {CORES_PER_JOB} cores, "
+                             f"here {default_workers()})")
+    parser.add_argument('--force', action='store_true', help="convert even if the output is up to date")
+    parser.add_argument('--segments', type=int, default=1,
+                        help="split each video at keyframes into up to this many pieces encoded in parallel "
+                             "(batch mode; 0 means one per worker)")
+    parser.add_argument('--bench', action='store_true',
+                        help="time a single-process encode of the first file against a segmented one")
+    args = parser.parse_args()
+    segments = args.segments or max(1, args.workers or default_workers())
+
+    if args.bench:
+        benchmark(args.paths[0], args.fps, segments if segments > 1 else None, args.workers)
+    elif not args.batch and len(args.paths) == 1 and not os.path.isdir(args.paths[0]):
+        convert_interactively(args.paths[0])
+    else:
+        results = run_batch(args.paths, args.fps, args.workers, args.force, segments=segments)
+        sys.exit(1 if not all(results.values()) else 0)
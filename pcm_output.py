@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+import os
+import subprocess
+import sys
+import threading
+import time
+import wave
+
+import numpy as np
+
+from playback import PRELOAD_SECONDS, warm_file
+
+FFMPEG_CMD = 'ffmpeg'
+SAMPLE_RATE = 44100
+CHANNELS = 2
+BUFFER_FRAMES = 2048  # ~46 ms at 44.1 kHz: the longest a volume change waits to be heard
+BYTES_PER_FRAME = 2 * CHANNELS  # s16le
+
+
+def apply_gain(data, gain):
+    """Scale a buffer of s16le samples by gain, clipping instead of wrapping around."""
+    if gain == 1.0:
+        return data
+    if gain <= 0.0:
+        return bytes(len(data))
+    samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+    samples *= gain
+    np.clip(samples, -32768, 32767, out=samples)
+    return samples.astype(np.int16).tobytes()
+
+
+class FFmpegDecoder:
+    """An ffmpeg process decoding one file to interleaved s16le PCM on its stdout.
+
+    Starting one ahead of time (a preload) means the first buffers are already
+    waiting in the pipe when playback switches to it.
+    """
+
+    def __init__(self, file_path, start_secs=0, rate=SAMPLE_RATE, channels=CHANNELS, ffmpeg_cmd=FFMPEG_CMD):
+        self.file_path = file_path
+        self.start_secs = start_secs
+        self.gain = 1.0  # Loudness normalization, multiplied with the player's volume
+        cmd = [ffmpeg_cmd, '-nostdin', '-v', 'error']
+        if start_secs > 0:
+            cmd += ['-ss', f'{start_secs:.3f}']
+        cmd += ['-i', file_path, '-f', 's16le', '-ac', str(channels), '-ar', str(rate), '-']
+        self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+
+    def read(self, size):
+        """Up to size bytes of PCM, or b'' at the end of the track."""
+        data = self.process.stdout.read(size)
+        # Keep buffers frame-aligned so the gain never splits a sample
+        return data[:len(data) - len(data) % BYTES_PER_FRAME]
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+
+
+class NullSink:
+    """Discards audio, optionally at the speed a sound card would consume it. For tests."""
+
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.frames_written = 0
+        self.rate = SAMPLE_RATE
+
+    def open(self, rate, channels):
+        self.rate = rate
+
+    def write(self, data):
+        frames = len(data) // BYTES_PER_FRAME
+        self.frames_written += frames
+        if self.realtime:
+            time.sleep(frames / self.rate)
+
+    def close(self):
+        pass
+
+
+class WavSink:
+    """Writes everything played to a WAV file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def open(self, rate, channels):
+        self.file = wave.open(self.path, 'wb')
+        self.file.setnchannels(channels)
+        self.file.setsampwidth(2)
+        self.file.setframerate(rate)
+
+    def write(self, data):
+        self.file.writeframes(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class AlsaSink:
+    """Plays through ALSA with pyalsaaudio; write() blocks, which paces playback."""
+
+    def __init__(self, device='default'):
+        self.device = device
+        self.pcm = None
+
+    def open(self, rate, channels):
+        import alsaaudio  # Only needed when this sink is chosen
+        self.pcm = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, device=self.device, channels=channels, rate=rate,
+                                 format=alsaaudio.PCM_FORMAT_S16_LE, periodsize=BUFFER_FRAMES)
+
+    def write(self, data):
+        self.pcm.write(data)
+
+    def close(self):
+        if self.pcm is not None:
+            self.pcm.close()
+            self.pcm = None
+
+
+def make_sink(spec):
+    """A sink from a NINELAYER_OUTPUT value: 'alsa', 'alsa:<device>', 'wav:<path>' or 'null'."""
+    kind, _, arg = spec.partition(':')
+    if kind == 'alsa':
+        return AlsaSink(arg or 'default')
+    if kind == 'wav':
+        return WavSink(arg or 'ninelayer.wav')
+    if kind == 'null':
+        return NullSink()
+    raise ValueError(f"unknown audio output: {spec}")
+
+
+class PcmPlayer:
+    """Decodes through ffmpeg and plays from a thread in this process.
+
+    Drop-in for GaplessPlayer: gain and mute are applied with NumPy to every
+    buffer on its way to the sink, so a volume change is heard within one
+    buffer and never spawns anything. The next track can be preloaded as a
+    second decoder and is switched to in the same thread, with no gap.
+    Callbacks run on the player's EventLoop.
+    """
+
+    seeks_in_seconds = True  # load() takes a start time, not an mpg123 frame
+
+    def __init__(self, sink, loop=None, on_finished=None, on_advanced=None, on_near_end=None,
+                 duration_of=None, rate=SAMPLE_RATE, channels=CHANNELS, on_started=None):
+        self.sink = sink
+        self.loop = loop
+        self.on_finished = on_finished
+        self.on_advanced = on_advanced
+        self.on_near_end = on_near_end
+        self.on_started = on_started  # First buffer of a track reached the sink
+        self.duration_of = duration_of  # Track length in seconds, for near-end detection
+        self.rate = rate
+        self.channels = channels
+        self.gain = 1.0
+        self.paused = False
+        self.position = 0.0
+        self.remaining = 0.0
+        self.preloaded_path = None
+        self._decoder = None
+        self._next = None
+        self._duration = 0.0
+        self._near_end_sent = False
+        self._started_sent = False
+        self._handed_over_path = None
+        self._thread = None
+        self._quit = False
+        self._cond = threading.Condition()
+
+    def start(self):
+        if self.alive():
+            return
+        self.sink.open(self.rate, self.channels)
+        self._quit = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name='pcm-output')
+        self._thread.start()
+
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def has_position(self):
+        return self._decoder is not None
+
+    def is_playing(self):
+        return self._decoder is not None
+
+    def load(self, file_path, start_secs=0, paused=False, gain=1.0):
+        with self._cond:
+            if self._handed_over_path == file_path and start_secs == 0:
+                # Already playing: the switch happened when the last track ended
+                self._handed_over_path = None
+                return
+            self._handed_over_path = None
+            if self._next is not None and self.preloaded_path == file_path and start_secs == 0:
+                decoder, self._next = self._next, None
+            else:
+                self._close_next()
+                decoder = FFmpegDecoder(file_path, start_secs, self.rate, self.channels)
+            decoder.gain = gain
+            self.preloaded_path = None
+            self._play(decoder)
+            self.paused = paused
+            self._cond.notify_all()
+
+    def preload(self, file_path, gain=1.0):
+        with self._cond:
+            if self.preloaded_path == file_path:
+                return
+            self._close_next()
+            warm_file(file_path)
+            self._next = FFmpegDecoder(file_path, 0, self.rate, self.channels)
+            self._next.gain = gain
+            self.preloaded_path = file_path
+
+    def cancel_preload(self):
+        with self._cond:
+            self._close_next()
+
+    def set_paused(self, paused):
+        with self._cond:
+            self.paused = paused
+            self._cond.notify_all()
+
+    def set_volume(self, percent):
+        # Read by the output thread before every buffer
+        self.gain = max(0.0, percent / 100)
+
+    def stop(self):
+        with self._cond:
+            self._close_next()
+            if self._decoder is not None:
+                self._decoder.close()
+                self._decoder = None
+
+    def quit(self, timeout=1):
+        with self._cond:
+            self._quit = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.stop()
+        self.sink.close()
+
+    def _play(self, decoder):
+        if self._decoder is not None:
+            self._decoder.close()
+        self._decoder = decoder
+        self.position = float(decoder.start_secs)
+        self._duration = self.duration_of(decoder.file_path) if self.duration_of else 0.0
+        self.remaining = max(self._duration - self.position, 0.0)
+        self._near_end_sent = False
+        self._started_sent = False
+
+    def _close_next(self):
+        if self._next is not None:
+            self._next.close()
+            self._next = None
+        self.preloaded_path = None
+
+    def _notify(self, callback):
+        if callback is None:
+            return
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(callback)
+        else:
+            callback()
+
+    def _run(self):
+        chunk = BUFFER_FRAMES * BYTES_PER_FRAME
+        while True:
+            with self._cond:
+                while not self._quit and (self._decoder is None or self.paused):
+                    self._cond.wait()
+                if self._quit:
+                    return
+                decoder = self._decoder
+            try:
+                data = decoder.read(chunk)
+            except (OSError, ValueError):
+                data = b''  # Closed under us by stop() or load()
+            with self._cond:
+                if decoder is not self._decoder:
+                    continue  # Replaced while reading; drop the stale buffer
+                if not data:
+                    self._track_ended()
+                    continue
+            self.sink.write(apply_gain(data, self.gain * decoder.gain))
+            if not self._started_sent:
+                self._started_sent = True
+                self._notify(self.on_started)
+            self.position += len(data) / (BYTES_PER_FRAME * self.rate)
+            if self._duration:
+                self.remaining = max(self._duration - self.position, 0.0)
+                if not self._near_end_sent and self.remaining <= PRELOAD_SECONDS:
+                    self._near_end_sent = True
+                    self._notify(self.on_near_end)
+
+    def _track_ended(self):
+        # Called with the lock held
+        if self._next is not None:
+            self._handed_over_path = self.preloaded_path
+            decoder, self._next = self._next, None
+            self.preloaded_path = None
+            self._play(decoder)
+            self._notify(self.on_advanced)
+        else:
+            self._decoder.close()
+            self._decoder = None
+            self._notify(self.on_finished)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python pcm_output.py <audio file> [output: alsa|wav:<path>|null] [volume %]")
+        sys.exit(1)
+    sink = make_sink(sys.argv[2] if len(sys.argv) > 2 else 'alsa')
+    done = threading.Event()
+    player = PcmPlayer(sink, on_finished=done.set)
+    player.start()
+    player.set_volume(int(sys.argv[3]) if len(sys.argv) > 3 else 100)
+    start = time.perf_counter()
+    player.load(os.path.abspath(sys.argv[1]))
+    try:
+        done.wait()
+    except KeyboardInterrupt:
+        pass
+    player.quit()
+    print(f"Played {player.position:.1f}s in {time.perf_counter() - start:.1f}s")
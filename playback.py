@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+import os
+import subprocess
+import threading
+
+from event_loop import LineReader
+
+PLAYER_CMD = 'mpg123'
+# How long before the end of a track the next one is resolved and loaded
+PRELOAD_SECONDS = 5
+# mpg123 amplifies above 100% without a limiter, so a loudness boost is capped at full scale
+MAX_VOLUME = 100
+
+
+class RemotePlayer:
+    """A single long-lived `mpg123 -R` process driven over its stdin/stdout.
+
+    Track changes and seeks are LOAD/JUMP commands to the running decoder instead
+    of a terminate + Popen per action, and the playback position comes from the
+    decoder's @F frame events rather than wall-clock arithmetic.
+
+    With an EventLoop, status lines and the child's exit are handled as loop
+    callbacks; without one a reader thread is used.
+    """
+
+    def __init__(self, player_cmd=PLAYER_CMD, on_finished=None, loop=None, on_near_end=None, on_started=None):
+        self.player_cmd = player_cmd
+        self.loop = loop
+        # Called when a track ends; returning True swallows the event
+        self.on_finished = on_finished
+        # Called once per track when fewer than PRELOAD_SECONDS remain
+        self.on_near_end = on_near_end
+        # Called once per track with the first frame decoded after a load
+        self.on_started = on_started
+        self.process = None
+        self.position = 0.0      # Seconds into the current track, from @F
+        self.remaining = 0.0
+        self.frame = 0
+        self.paused = False
+        self.playing = False
+        self.track_gain = 1.0    # Loudness normalization for the loaded track, folded into VOLUME
+        self.last_error = None
+        self._finished = threading.Event()
+        self._awaiting_start = False
+        self._near_end_sent = False
+        self._started_sent = False
+        self._write_lock = threading.Lock()
+
+    def start(self):
+        """Spawn the decoder. Raises FileNotFoundError if player_cmd isn't installed."""
+        if self.alive():
+            return
+        self.process = subprocess.Popen(
+            [self.player_cmd, '-R'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        if self.loop:
+            LineReader(self.loop, self.process.stdout, self._handle_line, self._decoder_exited)
+            self.loop.watch_process(self.process, self._decoder_exited)
+        else:
+            threading.Thread(target=self._read_events, daemon=True).start()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def send(self, command):
+        if not self.alive():
+            return False
+        try:
+            with self._write_lock:
+                self.process.stdin.write(command.encode('utf-8', errors='surrogateescape') + b'\n')
+                self.process.stdin.flush()
+            return True
+        except (BrokenPipeError, OSError, ValueError):
+            return False
+
+    def load(self, file_path, frame=0, paused=False):
+        """Start playing file_path, optionally from a frame index or left paused."""
+        self._finished.clear()
+        self._awaiting_start = True
+        self._near_end_sent = False
+        self._started_sent = False
+        self.position = 0.0
+        self.remaining = 0.0
+        self.frame = frame
+        self.paused = paused
+        self.playing = True
+        if frame > 0 or paused:
+            # Load paused so the first frames aren't audible before the jump lands
+            self.send(f'LOADPAUSED {file_path}')
+            if frame > 0:
+                self.send(f'JUMP {frame}')
+            if not paused:
+                self.send('PAUSE')
+        else:
+            self.send(f'LOAD {file_path}')
+
+    def jump(self, frame):
+        self.send(f'JUMP {frame}')
+
+    def set_paused(self, paused):
+        # PAUSE toggles, so only send it when the state actually changes
+        if self.playing and paused != self.paused:
+            self.send('PAUSE')
+            self.paused = paused
+
+    def set_volume(self, percent):
+        self.send(f'VOLUME {percent}')
+
+    def stop(self):
+        self.playing = False
+        self._awaiting_start = False
+        self.send('STOP')
+
+    def is_playing(self):
+        """True while a track is loaded, even if it is paused."""
+        return self.playing and self.alive()
+
+    def take_finished(self):
+        """Return True once after the current track ends or fails to play."""
+        if self._finished.is_set():
+            self._finished.clear()
+            return True
+        return False
+
+    def quit(self, timeout=1):
+        if not self.process:
+            return
+        self.playing = False
+        self.send('QUIT')
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def has_position(self):
+        """True once the decoder has reported a position for the current track."""
+        return self.playing and not self._awaiting_start
+
+    def _read_events(self):
+        for line in self.process.stdout:
+            self._handle_line(line.decode('utf-8', errors='replace').rstrip('\n'))
+        self._decoder_exited()
+
+    def _handle_line(self, line):
+        if line.startswith('@F '):
+            if self._awaiting_start:
+                return  # Still the previous track's frames
+            # @F <frame> <frames left> <seconds> <seconds left>
+            parts = line.split()
+            try:
+                self.frame = int(parts[1])
+                self.position = float(parts[3])
+                self.remaining = float(parts[4])
+            except (IndexError, ValueError):
+                return
+            if not self._started_sent:
+                self._started_sent = True
+                if self.on_started:
+                    self.on_started(self)
+            if not self._near_end_sent and 0 < self.remaining <= PRELOAD_SECONDS:
+                self._near_end_sent = True
+                if self.on_near_end:
+                    self.on_near_end(self)
+        elif line.startswith('@P '):
+            state = line[3:].strip()
+            if state in ('0', '3'):
+                # A stale stop from the previous track can arrive right after LOAD
+                if self.playing and not self._awaiting_start:
+                    self.playing = False
+                    self._track_finished()
+            elif state == '1':
+                self.paused = True
+            elif state == '2':
+                self.paused = False
+        elif line.startswith('@S '):
+            # Stream info is printed once the new track's first header is read
+            self._awaiting_start = False
+        elif line.startswith('@E '):
+            self.last_error = line[3:]
+            if self.playing:
+                self.playing = False
+                self._awaiting_start = False
+                self._track_finished()
+
+    def _decoder_exited(self):
+        # Reported by both the pidfd and stdout EOF; only the first one counts
+        if self.playing:
+            self.playing = False
+            self._track_finished()
+
+    def _track_finished(self):
+        if self.on_finished is None or not self.on_finished(self):
+            self._finished.set()
+
+
+def warm_file(file_path):
+    """Ask the kernel to read file_path into the page cache ahead of playback."""
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            os.read(fd, 1024 * 1024)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class GaplessPlayer:
+    """Two RemotePlayers: one playing, one holding the next track loaded and paused.
+
+    When the active track ends the standby decoder is unpaused straight from the
+    status-line handler, before anything else runs, so the next track starts with
+    no gap. Listeners are told through on_finished (track ended, nothing
+    preloaded), on_advanced (the preloaded track took over) and on_near_end.
+    """
+
+    seeks_in_seconds = False  # load() takes an mpg123 frame index
+
+    def __init__(self, player_cmd=PLAYER_CMD, loop=None, on_finished=None, on_advanced=None,
+                 on_near_end=None, on_started=None):
+        self.active = RemotePlayer(player_cmd, self._on_finished, loop, self._on_near_end, self._on_started)
+        self.standby = RemotePlayer(player_cmd, self._on_finished, loop, self._on_near_end, self._on_started)
+        self.on_finished = on_finished
+        self.on_advanced = on_advanced
+        self.on_near_end = on_near_end
+        self.on_started = on_started
+        self.preloaded_path = None
+        self.volume = None
+        self._handed_over_path = None
+        self._lock = threading.Lock()
+
+    @property
+    def position(self):
+        return self.active.position
+
+    @property
+    def remaining(self):
+        return self.active.remaining
+
+    def start(self):
+        self.active.start()
+
+    def alive(self):
+        return self.active.alive()
+
+    def has_position(self):
+        return self.active.has_position()
+
+    def is_playing(self):
+        return self.active.is_playing()
+
+    def preload(self, file_path, gain=1.0):
+        """Warm file_path and load it paused in the standby decoder."""
+        with self._lock:
+            if self.preloaded_path == file_path:
+                return
+            warm_file(file_path)
+            if not self.standby.alive():
+                self.standby.start()
+            self.standby.track_gain = gain
+            self._apply_volume(self.standby)
+            self.standby.load(file_path, paused=True)
+            self.preloaded_path = file_path
+
+    def cancel_preload(self):
+        with self._lock:
+            if self.preloaded_path is not None:
+                self.standby.stop()
+                self.preloaded_path = None
+
+    def load(self, file_path, frame=0, paused=False, gain=1.0):
+        with self._lock:
+            if self._handed_over_path == file_path and frame == 0:
+                # Already playing: the handover happened when the last track ended
+                self._handed_over_path = None
+                return
+            self._handed_over_path = None
+            if self.preloaded_path == file_path and frame == 0 and not paused:
+                self.active.stop()
+                self._swap()
+                return
+            if self.preloaded_path is not None:
+                self.standby.stop()
+                self.preloaded_path = None
+        self.active.track_gain = gain
+        self._apply_volume(self.active)
+        self.active.load(file_path, frame, paused)
+
+    def jump(self, frame):
+        self.active.jump(frame)
+
+    def set_paused(self, paused):
+        self.active.set_paused(paused)
+
+    def set_volume(self, percent):
+        self.volume = percent
+        self._apply_volume(self.active)
+        self._apply_volume(self.standby)
+
+    def _apply_volume(self, player):
+        if self.volume is not None:
+            player.set_volume(min(MAX_VOLUME, round(self.volume * player.track_gain)))
+
+    def stop(self):
+        self.cancel_preload()
+        self.active.stop()
+
+    def quit(self, timeout=1):
+        self.active.quit(timeout)
+        self.standby.quit(timeout)
+
+    def _swap(self):
+        self.standby.set_paused(False)
+        self.active, self.standby = self.standby, self.active
+        self.preloaded_path = None
+
+    def _on_near_end(self, engine):
+        if engine is self.active and self.on_near_end:
+            self.on_near_end()
+
+    def _on_started(self, engine):
+        if engine is self.active and self.on_started:
+            self.on_started()
+
+    def _on_finished(self, engine):
+        with self._lock:
+            if engine is not self.active:
+                return True  # A stopped standby; nobody cares
+            if self.preloaded_path is None:
+                handed_over = False
+            else:
+                self._handed_over_path = self.preloaded_path
+                self._swap()
+                handed_over = True
+        if handed_over:
+            if self.on_advanced:
+                self.on_advanced()
+        elif self.on_finished:
+            self.on_finished()
+        return True
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import os
+import sys
+import threading
+import time
+
+DEFAULT_FPS = 10
+SSH_FPS = 4     # Remote terminals pay for every byte, so animate slower by default
+IDLE_FPS = 1    # Rate once nothing on screen has changed for a few frames
+IDLE_AFTER_FRAMES = 3
+
+
+def default_fps():
+    """Frame rate from NINELAYER_FPS, or a lower default over SSH."""
+    try:
+        return max(1, int(os.environ['NINELAYER_FPS']))
+    except (KeyError, ValueError):
+        return SSH_FPS if os.environ.get('SSH_CONNECTION') else DEFAULT_FPS
+
+
+class Screen:
+    """A model of the terminal's rows that flushes only what changed, in one write.
+
+    Rows are 1-based like ANSI cursor addressing. Text may contain SGR colour codes;
+    rows with codes are rewritten whole, plain rows from the first changed column.
+    """
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.rows = {}       # What the frame being built should show
+        self.on_screen = {}  # What the terminal currently shows
+        self._clear = True
+        self._lock = threading.Lock()
+        self.bytes_written = 0
+
+    def set_line(self, row, text):
+        with self._lock:
+            self.rows[row] = text
+
+    def clear_line(self, row):
+        with self._lock:
+            self.rows.pop(row, None)
+
+    def invalidate(self):
+        """Force a full repaint on the next flush, e.g. after a resize or stray output."""
+        with self._lock:
+            self._clear = True
+
+    def flush(self):
+        """Write the differences since the last flush; return the number of bytes written."""
+        with self._lock:
+            parts = []
+            if self._clear:
+                parts.append('\033[2J')
+                self.on_screen = {}
+                self._clear = False
+            for row, text in self.rows.items():
+                old = self.on_screen.get(row)
+                if old == text:
+                    continue
+                parts.append(self._diff_row(row, old, text))
+                self.on_screen[row] = text
+            for row in [r for r in self.on_screen if r not in self.rows]:
+                parts.append(f'\033[{row};1H\033[K')
+                del self.on_screen[row]
+        if not parts:
+            return 0
+        frame = ''.join(parts)
+        self.out.write(frame)
+        self.out.flush()
+        self.bytes_written += len(frame)
+        return len(frame)
+
+    @staticmethod
+    def _diff_row(row, old, new):
+        if old is None or '\033' in old or '\033' in new:
+            return f'\033[{row};1H{new}\033[K'
+        # Skip the unchanged prefix; only safe to count columns over plain ASCII
+        limit = min(len(old), len(new))
+        col = 0
+        while col < limit and old[col] == new[col] and old[col].isascii():
+            col += 1
+        tail = new[col:]
+        clear = '\033[K' if len(new) < len(old) else ''
+        return f'\033[{row};{col + 1}H{tail}{clear}'
+
+
+class Renderer:
+    """Draws the player UI from timers on the player's EventLoop.
+
+    draw(screen, frame_idx) fills the screen model; the renderer flushes the diff
+    and slows down to IDLE_FPS once frames stop changing. wake() redraws at once.
+    """
+
+    def __init__(self, screen, draw, loop, fps=None, idle_fps=IDLE_FPS, on_frame=None):
+        self.screen = screen
+        self.draw = draw
+        self.loop = loop
+        self.on_frame = on_frame  # Called with each frame's cost in seconds
+        self.fps = fps or default_fps()
+        self.idle_fps = min(idle_fps, self.fps)
+        self.frame_idx = 0
+        self.last_frame_cost = 0.0
+        self._idle_frames = 0
+        self._timer = None
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._schedule(0)
+
+    def stop(self):
+        self._running = False
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def wake(self):
+        """Redraw as soon as possible; safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self._wake_now)
+
+    def render_frame(self):
+        start = time.perf_counter()
+        self.draw(self.screen, self.frame_idx)
+        written = self.screen.flush()
+        self.frame_idx += 1
+        self.last_frame_cost = time.perf_counter() - start
+        if self.on_frame:
+            self.on_frame(self.last_frame_cost)
+        return written
+
+    def _wake_now(self):
+        if self._running:
+            self._idle_frames = 0
+            self._tick()
+
+    def _schedule(self, delay):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = self.loop.call_later(delay, self._tick)
+
+    def _tick(self):
+        if not self._running:
+            return
+        try:
+            written = self.render_frame()
+        except Exception:
+            written = 0  # Never let a drawing bug take the player down
+        self._idle_frames = 0 if written else self._idle_frames + 1
+        fps = self.fps if self._idle_frames < IDLE_AFTER_FRAMES else self.idle_fps
+        # A slow terminal (e.g. a congested SSH link) stretches the interval instead of queueing frames
+        self._schedule(max(1 / fps, self.last_frame_cost * 4))
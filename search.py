@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+from array import array
+from collections import Counter
+from pathlib import Path
+
+from metadata_db import DB_PATH as METADATA_DB_PATH
+
+MAX_VERIFY = 20000       # Candidates checked by substring before giving up on more
+MAX_FUZZY_POSTINGS = 50000  # Trigrams this common say nothing useful about a typo
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Substring search over short documents through trigram posting lists.
+
+    Doc ids must be added in increasing order, which keeps every posting list
+    sorted. A query checks the rarest trigram's postings with a plain substring
+    test, and falls back to ranking by shared trigrams when nothing matches
+    exactly, which tolerates typos.
+    """
+
+    def __init__(self):
+        self.docs = []      # Normalized text per doc id
+        self.postings = {}  # trigram -> array('I') of doc ids
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, text):
+        doc_id = len(self.docs)
+        text = normalize(text)
+        self.docs.append(text)
+        postings = self.postings
+        for gram in trigrams(text):
+            bucket = postings.get(gram)
+            if bucket is None:
+                postings[gram] = array('I', (doc_id,))
+            else:
+                bucket.append(doc_id)
+        return doc_id
+
+    def search(self, query, limit=20):
+        words = normalize(query).split()
+        if not words:
+            return []
+        grams = set()
+        for word in words:
+            grams |= trigrams(word)
+
+        if grams and all(gram in self.postings for gram in grams):
+            rarest = min(grams, key=lambda gram: len(self.postings[gram]))
+            candidates = self.postings[rarest]
+        elif grams:
+            candidates = ()
+        else:
+            candidates = range(len(self.docs))  # Only 1-2 character words: scan
+
+        matches = []
+        for checked, doc_id in enumerate(candidates):
+            if checked >= MAX_VERIFY or len(matches) >= limit * 10:
+                break
+            text = self.docs[doc_id]
+            if all(word in text for word in words):
+                matches.append((self._score(text, words), doc_id))
+        if not matches and grams:
+            return self._fuzzy(grams, limit)
+        matches.sort()
+        return [doc_id for _, doc_id in matches[:limit]]
+
+    @staticmethod
+    def _score(text, words):
+        # Earlier and word-initial matches rank first
+        score = 0
+        for word in words:
+            pos = text.find(word)
+            score += pos
+            if pos > 0 and text[pos - 1] != ' ':
+                score += 100
+        return score
+
+    def _fuzzy(self, grams, limit):
+        counts = Counter()
+        for gram in grams:
+            bucket = self.postings.get(gram)
+            if bucket is not None and len(bucket) <= MAX_FUZZY_POSTINGS:
+                counts.update(bucket)
+        needed = max(1, len(grams) // 2)
+        return [doc_id for doc_id, count in counts.most_common(limit) if count >= needed]
+
+
+def index_descriptions(descriptions):
+    """Index (title, album, artist) tuples; doc ids follow their order."""
+    index = TrigramIndex()
+    for description in descriptions:
+        index.add(' '.join(part for part in description if part))
+    return index
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python search.py <query> [music_dir]")
+        sys.exit(1)
+
+    from library_index import LibraryIndex
+    from track_library import TrackLibrary
+
+    music_dir = sys.argv[2] if len(sys.argv) > 2 else str(Path(__file__).parent / 'music')
+    with LibraryIndex(music_dir) as library_index:
+        if library_index.is_empty():
+            library_index.scan()
+    library = TrackLibrary(music_dir, metadata_path=METADATA_DB_PATH)
+    library.load()
+    start = time.perf_counter()
+    # The same titles the player indexes, so results match what [/] finds
+    index = index_descriptions(library.describe(i) for i in range(len(library)))
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    results = index.search(sys.argv[1])
+    elapsed = time.perf_counter() - start
+    for doc_id in results:
+        print(os.path.relpath(library[doc_id], music_dir))
+    print(f"{len(results)} results in {elapsed * 1000:.2f} ms (index of {len(index)} tracks built in {built:.2f}s)")
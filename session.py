@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+from pathlib import Path
+
+SESSION_PATH = Path(__file__).parent / 'session.json'
+SESSION_VERSION = 1
+HISTORY_KEPT = 100  # Most recent plays kept across restarts, for [P]rev
+
+
+def track_identity(music_dir, file_path):
+    """{'path', 'size', 'inode'} for file_path, or None if it's gone.
+
+    The path is relative to music_dir; size and inode find the file again after a rename.
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return {'path': os.path.relpath(file_path, music_dir), 'size': st.st_size, 'inode': st.st_ino}
+
+
+def resolve_track(music_dir, identity, index=None):
+    """Absolute path of the track identity describes, or None if it's gone.
+
+    Normally a single stat; index is only asked, by size and inode, when the file
+    is no longer at its path because a rescan saw it renamed or moved.
+    """
+    if not identity:
+        return None
+    path = os.path.join(music_dir, identity['path'])
+    if os.path.exists(path):
+        return path
+    if index is not None:
+        return index.find_file(identity.get('size'), identity.get('inode'))
+    return None
+
+
+def load_session(path=SESSION_PATH):
+    """The saved snapshot as a dict, or None if there is none or it can't be read."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != SESSION_VERSION:
+        return None
+    return state
+
+
+def save_session(state, path=SESSION_PATH):
+    """Write state atomically: a reader, or the next start after a crash, sees the old or the new snapshot."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': SESSION_VERSION, **state}, f, separators=(',', ':'))
+        # On disk before the rename, or a crash could leave session.json empty or cut short
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    state = load_session(sys.argv[1] if len(sys.argv) > 1 else SESSION_PATH)
+    if state is None:
+        print("No saved session")
+        sys.exit(1)
+    track = state.get('track') or {}
+    print(f"Track:    {track.get('path', '-')} at {state.get('position', 0):.1f}s")
+    print(f"Random:   {'ON' if state.get('random_mode') else 'OFF'}, AutoPlay: {'ON' if state.get('auto_play') else 'OFF'}")
+    print(f"Volume:   {state.get('volume')}%{' (muted)' if state.get('muted') else ''}")
+    print(f"History:  {len(state.get('history', []))} tracks")
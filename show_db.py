@@ -1,39 +1,272 @@
 #!/usr/bin/env python3
+import argparse
+import csv
+import json
+import shlex
 import sqlite3
-from tabulate import tabulate
+import sys
 
-DB_PATH = 'music_metadata.db'
+from library_index import locate_audio_file
+from metadata_db import DB_PATH, connect
+
+PAGE_SIZE = 50
+
+
+def file_missing(row):
+    # Downloads are recorded under their pre-conversion name, so any audio extension counts
+    return locate_audio_file(row[-1]) is None
+
+
+# name -> (description, keyset query taking (after, limit), start key, row filter).
+# The key is each query's first column.
+# Every query seeks on an indexed key, so a page costs the same at row 10 as at row 10 million.
+SUMMARIES = {
+    'playlists': (
+        "Tracks per playlist/album, with the count its manifest expects",
+        '''SELECT a.id, a.title, a.artist, a.type,
+                  (SELECT COUNT(*) FROM tracks t WHERE t.album_id = a.id) AS tracks,
+                  m.entry_count AS expected
+           FROM albums a LEFT JOIN playlist_manifests m ON m.playlist_id = a.id
+           WHERE a.id > ? ORDER BY a.id LIMIT ?''',
+        '', None),
+    'duplicates': (
+        "Titles recorded more than once, with the albums they appear on",
+        '''SELECT lower(title) AS title_key, COUNT(*) AS copies,
+                  group_concat(album_id, ', ') AS albums
+           FROM tracks
+           WHERE title IS NOT NULL AND lower(title) > ?
+           GROUP BY lower(title) HAVING COUNT(*) > 1
+           ORDER BY lower(title) LIMIT ?''',
+        '', None),
+    'missing': (
+        "Tracks whose file isn't on disk",
+        '''SELECT t.id, t.title, t.album_id,
+                  CASE WHEN r.path IS NULL THEN t.file_path
+                       ELSE r.path || '/' || t.file_path END AS file_path
+           FROM tracks t LEFT JOIN library_roots r ON r.id = t.root_id
+           WHERE t.id > ? ORDER BY t.id LIMIT ?''',
+        '', file_missing),
+    'damaged': (
+        "Tracks integrity.py found missing, truncated or corrupt",
+        '''SELECT i.track_id, t.title, t.album_id, i.status, i.path
+           FROM file_integrity i LEFT JOIN tracks t ON t.id = i.track_id
+           WHERE i.status != 'ok' AND i.track_id > ? ORDER BY i.track_id LIMIT ?''',
+        '', None),
+}
+
+
+def table_names(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+
+
+def table_query(conn, table_name):
+    """Keyset query over a table's rowid, or its primary key for a WITHOUT ROWID table.
+
+    Returns (query, start key, row filter, key width); the key columns lead each row
+    and are dropped from the output by without_key.
+    """
+    if table_name not in table_names(conn):
+        raise ValueError(f"no such table or summary: {table_name}")
+    try:
+        conn.execute(f'SELECT rowid FROM "{table_name}" LIMIT 0')
+    except sqlite3.OperationalError:
+        pass
+    else:
+        return f'SELECT rowid, * FROM "{table_name}" WHERE rowid > ? ORDER BY rowid LIMIT ?', 0, None, 1
+
+    # No rowid (fingerprint_hashes): seek on the primary key as a row value
+    key = [name for position, name in sorted(
+        (row[5], row[1]) for row in conn.execute(f'PRAGMA table_info("{table_name}")') if row[5])]
+    columns = ', '.join(f'"{name}"' for name in key)
+    marks = ', '.join('?' * len(key))
+    query = f'SELECT {columns}, * FROM "{table_name}" WHERE ({columns}) > ({marks}) ORDER BY {columns} LIMIT ?'
+    # Key columns of a WITHOUT ROWID table are NOT NULL, and -inf sorts below any number, text or blob
+    start = (float('-inf'),) + (None,) * (len(key) - 1)
+    return query, start, None, len(key)
+
+
+def row_key(row, key_width):
+    return row[0] if key_width == 1 else tuple(row[:key_width])
+
+
+def stream(conn, query, after, page_size, key_width=1, keep=None):
+    """Yield (headers, rows) one page at a time, seeking past the last key each time.
+
+    A key wider than one column is a tuple, bound as one parameter per column.
+    """
+    while True:
+        params = (*after, page_size) if key_width > 1 else (after, page_size)
+        cursor = conn.execute(query, params)
+        headers = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        after = row_key(rows[-1], key_width)
+        full = len(rows) == page_size
+        if keep:
+            rows = [row for row in rows if keep(row)]
+        yield headers, rows
+        if not full:
+            return
+
+
+def limited(pages, limit, key_width=1, last_key=None):
+    """Cut a page stream after limit rows; if it was cut, last_key[0] is where to resume."""
+    emitted = 0
+    for headers, rows in pages:
+        if limit is not None:
+            rows = rows[:limit - emitted]
+        emitted += len(rows)
+        yield headers, rows
+        if limit is not None and emitted >= limit:
+            if rows and last_key is not None:
+                last_key[0] = row_key(rows[-1], key_width)
+            return
+
+
+def without_key(pages, key_width=1):
+    # Tables are paged on key columns selected ahead of their own: the rowid, or a copy of the primary key
+    for headers, rows in pages:
+        yield headers[key_width:], [row[key_width:] for row in rows]
+
+
+def write_table(pages, out):
+    from tabulate import tabulate  # Only the table format needs it
+    for headers, rows in pages:
+        if rows:
+            out.write(tabulate(rows, headers=headers, tablefmt='grid') + '\n')
+
+
+def write_csv(pages, out):
+    writer = csv.writer(out)
+    wrote_header = False
+    for headers, rows in pages:
+        if not wrote_header:
+            writer.writerow(headers)
+            wrote_header = True
+        writer.writerows(rows)
+
+
+def write_jsonl(pages, out):
+    for headers, rows in pages:
+        for row in rows:
+            out.write(json.dumps(dict(zip(headers, row)), ensure_ascii=False) + '\n')
+
+
+def write_parquet(pages, path):
+    """Columnar export, one row group per page. Needs pyarrow."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for headers, rows in pages:
+            if not rows:
+                continue
+            columns = list(zip(*rows))
+            if writer is None:
+                schema = pa.schema([(name, _arrow_type(pa, values)) for name, values in zip(headers, columns)])
+                writer = pq.ParquetWriter(path, schema)
+            arrays = [pa.array(_coerce(values, field.type, pa), type=field.type)
+                      for values, field in zip(columns, schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _arrow_type(pa, values):
+    # SQLite columns aren't strictly typed; infer from the first page and coerce the rest
+    kinds = {type(value) for value in values if value is not None}
+    if kinds == {int}:
+        return pa.int64()
+    if kinds and kinds <= {int, float}:
+        return pa.float64()
+    if kinds == {bytes}:
+        return pa.binary()
+    return pa.string()
+
+
+def _coerce(values, arrow_type, pa):
+    if arrow_type == pa.string():
+        return [None if value is None else str(value) for value in values]
+    return values
+
+
+WRITERS = {'table': write_table, 'csv': write_csv, 'jsonl': write_jsonl}
+
+
+def show_overview(conn):
+    """The old default: the first page of every table, then tracks per playlist."""
+    for table_name in table_names(conn):
+        print(f"\n{table_name.upper()}:")
+        query, start, keep, key_width = table_query(conn, table_name)
+        pages = stream(conn, query, start, PAGE_SIZE, key_width, keep)
+        write_table(without_key(limited(pages, PAGE_SIZE, key_width), key_width), sys.stdout)
+    print("\nPLAYLIST TRACK COUNTS:")
+    _, query, start, keep = SUMMARIES['playlists']
+    write_table(limited(stream(conn, query, start, PAGE_SIZE, keep=keep), PAGE_SIZE), sys.stdout)
 
-def display_table(conn, table_name):
-    print(f"\n{table_name.upper()}:")
-    cursor = conn.execute(f"SELECT * FROM {table_name} LIMIT 50")
-    headers = [desc[0] for desc in cursor.description]
-    print(tabulate(cursor.fetchall(), headers=headers, tablefmt='grid'))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Browse or export music_metadata.db a page at a time",
+        epilog="summaries: " + "; ".join(f"{name}: {desc}" for name, (desc, *_) in SUMMARIES.items()))
+    parser.add_argument('name', nargs='?', help="table or summary to show (default: overview of every table)")
+    parser.add_argument('--format', choices=['table', 'csv', 'jsonl', 'parquet'], default='table')
+    parser.add_argument('--after', help="key of the last row already seen (printed after each page)")
+    parser.add_argument('--limit', type=int,
+                        help=f"rows to show (default: {PAGE_SIZE} for --format table, everything otherwise)")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE * 20, help="rows fetched per query")
+    parser.add_argument('-o', '--output', help="write to a file instead of stdout (required for parquet)")
+    parser.add_argument('--db', default=str(DB_PATH))
+    args = parser.parse_args()
+
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            # Show all tables
-            tables = conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table'"
-            ).fetchall()
-            
-            for table in tables:
-                display_table(conn, table[0])
-                
-            # Show playlist track counts
-            print("\nPLAYLIST TRACK COUNTS:")
-            cursor = conn.execute("""
-                SELECT a.id, a.title, COUNT(t.id) as tracks
-                FROM albums a
-                LEFT JOIN tracks t ON a.id = t.album_id
-                WHERE a.type = 'playlist'
-                GROUP BY a.id
-                ORDER BY a.title
-            """)
-            print(tabulate(cursor.fetchall(), 
-                         headers=['ID', 'Playlist', 'Tracks'], 
-                         tablefmt='grid'))
-            
+        with connect(args.db) as conn:
+            if args.name is None:
+                show_overview(conn)
+                sys.exit(0)
+
+            key_width = 1
+            if args.name in SUMMARIES:
+                _, query, start, keep = SUMMARIES[args.name]
+            else:
+                query, start, keep, key_width = table_query(conn, args.name)
+            if args.after is not None:
+                if key_width > 1:
+                    start = tuple(json.loads(args.after))  # A composite key is printed as a JSON list
+                else:
+                    start = int(args.after) if isinstance(start, int) else args.after
+            limit = args.limit
+            page_size = args.page_size
+            if args.format == 'table':
+                limit = limit or PAGE_SIZE
+                page_size = min(page_size, limit)
+
+            last_key = [None]
+            pages = limited(stream(conn, query, start, page_size, key_width, keep), limit, key_width, last_key)
+            if args.name not in SUMMARIES:
+                pages = without_key(pages, key_width)
+
+            if args.format == 'parquet':
+                if not args.output:
+                    parser.error("--format parquet needs --output")
+                write_parquet(pages, args.output)
+            elif args.output:
+                with open(args.output, 'w', newline='', encoding='utf-8') as out:
+                    WRITERS[args.format](pages, out)
+            else:
+                WRITERS[args.format](pages, sys.stdout)
+
+            if last_key[0] is not None:
+                key = last_key[0]
+                after = shlex.quote(json.dumps(list(key)) if key_width > 1 else str(key))
+                print(f"-- next page: python show_db.py {args.name} --after={after}", file=sys.stderr)
+    except ImportError as e:
+        print(f"Missing dependency for --format {args.format}: {e.name}")
+        sys.exit(1)
     except Exception as e:
         print(f"Error reading database: {e}")
+        sys.exit(1)
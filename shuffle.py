@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+import random
+import sqlite3
+import threading
+import time
+from array import array
+from collections import deque
+
+from library_index import PLAY_STATS_SCHEMA
+
+FEISTEL_ROUNDS = 6
+MASK64 = (1 << 64) - 1
+HISTORY_MAXLEN = 5_000_000  # 4 bytes per entry, so ~20 MB at the cap
+RECENCY_HORIZON = 7 * 24 * 3600  # A track played this long ago counts as fresh again
+
+
+class RandomPermutation:
+    """A random bijection of range(n) computed on demand: O(1) memory, O(1) per lookup.
+
+    A small Feistel network permutes the next power-of-four domain and values
+    outside range(n) are cycle-walked back in, which takes under 4 steps on average.
+    """
+
+    def __init__(self, n, seed=None):
+        self.n = n
+        rng = random.Random(seed)
+        bits = max(2, (max(n - 1, 1)).bit_length())
+        bits += bits & 1  # Even, so the two Feistel halves are the same width
+        self.half_bits = bits // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.keys = [rng.getrandbits(64) for _ in range(FEISTEL_ROUNDS)]
+
+    def _round(self, value, key):
+        # splitmix64-style finaliser: cheap, and every input bit affects every output bit
+        x = ((value ^ key) * 0x9E3779B97F4A7C15) & MASK64
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        x ^= x >> 31
+        return x & self.half_mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self.half_bits) | right
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        value = self._encrypt(i)
+        while value >= self.n:
+            value = self._encrypt(value)
+        return value
+
+
+class PlayStats:
+    """Play counts and last-played times for every track, in two flat arrays.
+
+    The arrays are indexed like the track list, so shuffle weights cost a lookup.
+    Given a db_path, every play is also saved by path in the library index DB and
+    load() maps the saved stats onto a library's current order, after a restart
+    or whenever the list is rebuilt.
+    """
+
+    def __init__(self, n=0, db_path=None):
+        self.counts = array('I', bytes(4 * n))
+        self.last_played = array('I', bytes(4 * n))  # Unix seconds, 0 = never
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            with self._conn:
+                self._conn.execute(PLAY_STATS_SCHEMA)
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def resize(self, n):
+        if n > len(self.counts):
+            extra = n - len(self.counts)
+            self.counts.frombytes(bytes(4 * extra))
+            self.last_played.frombytes(bytes(4 * extra))
+
+    def load(self, library):
+        """Start over with library's saved stats, from its play_stats() (index, plays, last_played) rows."""
+        counts = array('I', bytes(4 * len(library)))
+        last_played = array('I', bytes(4 * len(library)))
+        for idx, plays, last in library.play_stats():
+            if 0 <= idx < len(counts):
+                counts[idx] = plays
+                last_played[idx] = last
+        self.counts, self.last_played = counts, last_played
+
+    def record(self, idx, now=None, rel_path=None):
+        """Count a play of track idx; rel_path, relative to the music dir, is what's saved."""
+        now = int(now or time.time())
+        self.resize(idx + 1)
+        self.counts[idx] += 1
+        self.last_played[idx] = now
+        if self.db_path is None or rel_path is None:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('''INSERT INTO play_stats (path, plays, last_played) VALUES (?, 1, ?)
+                             ON CONFLICT(path) DO UPDATE SET plays = plays + 1,
+                                 last_played = excluded.last_played''', (rel_path, now))
+
+
+def play_count_weight(stats):
+    """Favour tracks that have been played less often."""
+    def weight(idx):
+        return 1.0 / (1 + stats.counts[idx]) if idx < len(stats.counts) else 1.0
+    return weight
+
+
+def recency_weight(stats, horizon=RECENCY_HORIZON):
+    """Favour tracks that haven't been played recently."""
+    def weight(idx):
+        if idx >= len(stats.last_played) or not stats.last_played[idx]:
+            return 1.0
+        age = time.time() - stats.last_played[idx]
+        return min(1.0, max(age / horizon, 0.05))
+    return weight
+
+
+class ShuffleBag:
+    """Shuffle without repeats: every track plays once before any track plays twice.
+
+    Each pass over the library walks a fresh RandomPermutation, so a step is O(1)
+    and the bag itself needs no per-track memory. An optional weight(idx) in (0, 1]
+    skews the order: a track that loses its draw is deferred to the end of the
+    pass rather than dropped, so the no-repeat guarantee still holds.
+    """
+
+    def __init__(self, n, weight=None, seed=None):
+        self.rng = random.Random(seed)
+        self.weight = weight
+        self._start_pass(n)
+
+    def _start_pass(self, n):
+        self.n = n
+        self.permutation = RandomPermutation(n, self.rng.getrandbits(64))
+        self.position = 0
+        self.deferred = deque()
+
+    def resize(self, n):
+        """The library grew or shrank; start a new pass over the new size."""
+        if n != self.n:
+            self._start_pass(n)
+
+    def next(self, avoid=None):
+        """Return the next index, not equal to avoid unless the library has one track."""
+        if self.n == 0:
+            return None
+        while True:
+            idx = self._draw()
+            if idx is None:
+                self._start_pass(self.n)
+                continue
+            if idx == avoid and self.n > 1:
+                # Just played (e.g. picked via history): push it back, or skip it if it's all that's left
+                if self.position < self.n or self.deferred:
+                    self.deferred.append(idx)
+                else:
+                    self._start_pass(self.n)
+                continue
+            return idx
+
+    def _draw(self):
+        while self.position < self.n:
+            idx = self.permutation[self.position]
+            self.position += 1
+            if self.weight is None or self.rng.random() < self.weight(idx):
+                return idx
+            self.deferred.append(idx)
+        if self.deferred:
+            return self.deferred.popleft()
+        return None
+
+
+class History:
+    """Play history as a flat array of track indices; a few bytes per entry.
+
+    Supports the deque operations the player uses (append, pop, [-1], len, clear)
+    and drops the oldest half when it reaches maxlen.
+    """
+
+    def __init__(self, maxlen=HISTORY_MAXLEN):
+        self.maxlen = maxlen
+        self.items = array('I')
+
+    def append(self, idx):
+        if len(self.items) >= self.maxlen:
+            del self.items[:self.maxlen // 2]
+        self.items.append(idx)
+
+    def pop(self):
+        return self.items.pop()
+
+    def clear(self):
+        self.items = array('I')
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from library_index import INDEX_DB_PATH, LibraryIndex
+from metadata_db import DB_PATH as METADATA_DB_PATH, connect as connect_metadata, path_stem_sql
+
+PAGE_SIZE = 512
+CACHED_PAGES = 16  # LRU of pages kept in Python; everything else stays in SQLite
+
+
+class TrackLibrary:
+    """The player's track list: files from the library index joined with their metadata.
+
+    The join with music_metadata.db is ordered by album directory and tracks.position
+    and materialised once inside SQLite as a temp table keyed by play order. Python
+    only holds the pages that were looked at, so startup costs one SQL statement
+    however big the library is. Indexing returns an absolute path, like the plain
+    list of files it replaces; describe() returns (title, album, artist).
+    """
+
+    def __init__(self, music_dir, index_path=INDEX_DB_PATH, metadata_path=METADATA_DB_PATH):
+        self.music_dir = os.path.abspath(music_dir)
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+        self.count = 0
+        self.conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self._attached = False
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def load(self):
+        """(Re)build the play order from the index and metadata DBs; returns the track count."""
+        with self._lock:
+            self._pages.clear()
+            self._attach_metadata()
+            self.conn.execute('DROP TABLE IF EXISTS temp.play_order')
+            self.conn.execute('''CREATE TEMP TABLE play_order
+                              (idx INTEGER PRIMARY KEY,
+                               path TEXT,
+                               title TEXT,
+                               album TEXT,
+                               artist TEXT)''')
+            if self._attached:
+                # One indexed probe per file: on-disk name and recorded name agree up to the extension
+                self.conn.execute(f'''INSERT INTO temp.play_order (path, title, album, artist)
+                                  SELECT f.path, t.title, a.title, a.artist
+                                  FROM main.files f
+                                  LEFT JOIN meta.tracks t ON t.rowid =
+                                      (SELECT rowid FROM meta.tracks
+                                       WHERE {path_stem_sql('file_path')} = {path_stem_sql('f.path')}
+                                       LIMIT 1)
+                                  LEFT JOIN meta.albums a ON a.id = t.album_id
+                                  ORDER BY f.dir, t.position IS NULL, t.position, f.path''')
+            else:
+                self.conn.execute('''INSERT INTO temp.play_order (path)
+                                  SELECT path FROM main.files ORDER BY dir, path''')
+            self.conn.execute('CREATE INDEX temp.play_order_path ON play_order(path)')
+            self.conn.commit()
+            self.count = self.conn.execute('SELECT COUNT(*) FROM temp.play_order').fetchone()[0]
+            return self.count
+
+    def _attach_metadata(self):
+        if self._attached or not Path(self.metadata_path).exists():
+            return
+        connect_metadata(self.metadata_path).close()  # Applies pending migrations, e.g. the stem index
+        self.conn.execute('ATTACH DATABASE ? AS meta', (str(self.metadata_path),))
+        self._attached = True
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __getitem__(self, i):
+        return os.path.join(self.music_dir, self._row(i)[0])
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def describe(self, i):
+        """(title, album, artist) from the metadata DB, falling back to the path."""
+        path, title, album, artist = self._row(i)
+        parts = Path(path).parts
+        return (title or Path(path).stem,
+                album or (parts[-2] if len(parts) >= 2 else ''),
+                artist or (parts[-3] if len(parts) >= 3 else ''))
+
+    def paths_at(self, indices):
+        """Absolute paths of several tracks in one query, in the order given."""
+        indices = list(indices)
+        if not indices:
+            return []
+        with self._lock:
+            rows = dict(self.conn.execute(
+                f'SELECT idx, path FROM temp.play_order WHERE idx IN ({",".join("?" * len(indices))})',
+                [i + 1 for i in indices]))
+        return [os.path.join(self.music_dir, rows[i + 1]) for i in indices if i + 1 in rows]
+
+    def play_stats(self):
+        """(index, plays, last_played) for every track the player has counted, in one indexed join."""
+        with self._lock:
+            return self.conn.execute('''SELECT o.idx - 1, s.plays, s.last_played
+                                     FROM main.play_stats s JOIN temp.play_order o ON o.path = s.path''').fetchall()
+
+    def index_of(self, file_path):
+        rel_path = os.path.relpath(file_path, self.music_dir)
+        with self._lock:
+            row = self.conn.execute('SELECT idx FROM temp.play_order WHERE path = ?', (rel_path,)).fetchone()
+        return row[0] - 1 if row else None
+
+    def _row(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        page_no, offset = divmod(i, PAGE_SIZE)
+        with self._lock:
+            page = self._pages.get(page_no)
+            if page is None:
+                # Keyset read on the rowid: the cost of a page doesn't grow with its position
+                start = page_no * PAGE_SIZE
+                page = self.conn.execute('''SELECT path, title, album, artist FROM temp.play_order
+                                         WHERE idx > ? AND idx <= ? ORDER BY idx''',
+                                         (start, start + PAGE_SIZE)).fetchall()
+                self._pages[page_no] = page
+                if len(self._pages) > CACHED_PAGES:
+                    self._pages.popitem(last=False)
+            else:
+                self._pages.move_to_end(page_no)
+            return page[offset]
+
+
+class PartialLibrary:
+    """The tracks known before a TrackLibrary is ready: a growing list of absolute paths.
+
+    Stands in for TrackLibrary while the first scan runs or the play order is being
+    built, so playback can start on the first track found. extend() may be called
+    from the scanning thread; titles come from the path until the real library
+    replaces this one.
+    """
+
+    def __init__(self, music_dir):
+        self.music_dir = os.path.abspath(music_dir)
+        self.paths = []
+        self.ready = threading.Event()  # Set once there is a track to play, or there will be none
+
+    def extend(self, paths):
+        self.paths.extend(paths)  # List appends are atomic under the GIL, so readers never see a torn list
+        if self.paths:
+            self.ready.set()
+
+    def finish(self):
+        self.ready.set()
+
+    def load(self):
+        return len(self.paths)
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __bool__(self):
+        return bool(self.paths)
+
+    def __getitem__(self, i):
+        return self.paths[i]
+
+    def __iter__(self):
+        return iter(list(self.paths))
+
+    def describe(self, i):
+        parts = Path(os.path.relpath(self.paths[i], self.music_dir)).parts
+        return (Path(parts[-1]).stem,
+                parts[-2] if len(parts) >= 2 else '',
+                parts[-3] if len(parts) >= 3 else '')
+
+    def paths_at(self, indices):
+        return [self.paths[i] for i in indices]
+
+    def play_stats(self):
+        return []  # Saved stats are mapped once the TrackLibrary takes over
+
+    def index_of(self, file_path):
+        try:
+            return self.paths.index(file_path)
+        except ValueError:
+            return None
+
+
+if __name__ == "__main__":
+    music_dir = sys.argv[1] if len(sys.argv) > 1 else str(Path(__file__).parent / 'music')
+    with LibraryIndex(music_dir) as index:
+        if index.is_empty():
+            index.scan()
+    start = time.perf_counter()
+    library = TrackLibrary(music_dir)
+    count = library.load()
+    elapsed = time.perf_counter() - start
+    for i in range(min(count, 20)):
+        title, album, artist = library.describe(i)
+        print(f"{i + 1:5d}. {title} — {artist} / {album}")
+    print(f"{count} tracks loaded in {elapsed * 1000:.1f} ms")
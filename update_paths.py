@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
-import sqlite3
 import os
+from metadata_db import connect, relocate_root
 
 OLD_PATH = '/Volumes/3ool0ne 2TB/coding tools/youtube-dl/music/'
 NEW_PATH = '/Volumes/3ool0ne 2TB/coding tools/9layer/music/'
@@ -9,21 +9,18 @@ NEW_PATH = '/Volumes/3ool0ne 2TB/coding tools/9layer/music/'
 os.makedirs(NEW_PATH, exist_ok=True)
 
 # Update database paths
-with sqlite3.connect('music_metadata.db') as conn:
-    # Update tracks table
-    conn.execute("""
-        UPDATE tracks 
-        SET file_path = REPLACE(file_path, ?, ?)
-    """, (OLD_PATH, NEW_PATH))
-    
+with connect() as conn:
+    # Track paths are relative to their library root, so only the root row changes
+    roots = relocate_root(conn, OLD_PATH, NEW_PATH)
+
     # Update albums table
-    conn.execute("""
-        UPDATE albums 
+    albums = conn.execute("""
+        UPDATE albums
         SET url = REPLACE(url, 'youtube-dl', '9layer')
         WHERE url LIKE '%youtube-dl%'
-    """)
-    
+    """).rowcount
+
     conn.commit()
-    print(f"Updated {conn.total_changes} database records")
+    print(f"Relocated {roots} library root(s) and updated {albums} album records")
 
 print("Path update complete!")